@@ -0,0 +1,89 @@
+from datetime import datetime
+import mne
+import utils
+import bdf_header
+
+# Part of the cache key of loaded sessions, changed when the window computation changes
+VERSION = 3
+
+
+def _time_of_day(seconds):
+    # Like the original synchronisation, only the time of day of both clocks is compared
+    return seconds % 86400
+
+
+def recording_window(bdf_file, channels=utils.CHANNELS):
+    """
+    (start in seconds since 1970 with its sub-second part, sampling rate, number of samples)
+    of the used channels of a bdf file, from its header only.
+    """
+    header = bdf_header.read_header(bdf_file)
+    rates = bdf_header.sampling_rates(header)
+    missing = [channel for channel in channels if channel not in rates]
+    if missing:
+        raise ValueError(f"Channels {missing} are not in '{bdf_file}'.")
+    sfreqs = {rates[channel] for channel in channels}
+    if len(sfreqs) > 1:
+        raise ValueError(f"The channels of '{bdf_file}' have different sampling rates {sorted(sfreqs)}.")
+    sfreq = sfreqs.pop()
+    start = (header['start'] - datetime(1970, 1, 1)).total_seconds()
+    return start, sfreq, int(round(header['duration'] * sfreq))
+
+
+def crop_window(log_start, log_end, bdf_start, sfreq, n_times):
+    """
+    Samples [start, stop) of the recording matching the log. A recording started
+    before the first F1 is cut at F1; one started after keeps the log duration from
+    its own start, as the original synchronisation did. The window is clipped to the recording.
+    """
+    offset = max(0.0, _time_of_day(log_start) - _time_of_day(bdf_start))
+    start = int(round(offset * sfreq))
+    # The sample at the last keypress is included, like Raw.crop(tmax=...)
+    stop = min(n_times, int(round((offset + log_end - log_start) * sfreq)) + 1)
+    if start >= stop:
+        raise ValueError("The log does not overlap the recording.")
+    return start, stop
+
+
+def align(log_file, bdf_file, channels=utils.CHANNELS):
+    """
+    Synchronises a keypress log with its recording by reading only the log
+    keypresses and the bdf header, to the millisecond of the log and the
+    sample of the recording. Returns a dict with the clock times (seconds since
+    1970), 'sfreq', 'n_times', the window in samples ('start_sample', 'stop_sample')
+    and in seconds ('tmin', 'tmax', 'cut_from_start', 'cut_from_end').
+    """
+    log_start, log_end = utils.flag_event_range(log_file, first_flag='F1', fractional=True)
+    if log_start is None:
+        raise ValueError(f"No F1 keypress in '{log_file}'.")
+    bdf_start, sfreq, n_times = recording_window(bdf_file, channels)
+    start, stop = crop_window(log_start, log_end, bdf_start, sfreq, n_times)
+    return {
+        'log_start': log_start, 'log_end': log_end, 'bdf_start': bdf_start, 'sfreq': sfreq, 'n_times': n_times,
+        'start_sample': start, 'stop_sample': stop, 'tmin': start / sfreq, 'tmax': (stop - 1) / sfreq,
+        'cut_from_start': start / sfreq, 'cut_from_end': (n_times - stop) / sfreq,
+    }
+
+
+def open_window(bdf_file, window, preload=True, verbose=None):
+    """
+    Opens the used channels of the recording cropped to an aligned window; with
+    preload only the window is read from disk. Channels are renamed and the
+    biosemi16 montage is set.
+    """
+    raw = mne.io.read_raw_bdf(bdf_file, include=utils.CHANNELS, preload=False, verbose=verbose)
+    raw.pick(utils.CHANNELS)
+    raw.crop(tmin=window['tmin'], tmax=window['tmax'])
+    if preload:
+        raw.load_data()
+    raw.rename_channels(mapping=utils.CHANNELS_DICT)
+    raw.set_montage('biosemi16')
+    return raw
+
+
+def load_session(log_file, bdf_file):
+    """
+    Aligned and loaded recording of a session, with its window.
+    """
+    window = align(log_file, bdf_file)
+    return open_window(bdf_file, window), window
@@ -0,0 +1,86 @@
+import numpy as np
+import mne
+
+# Samples examined at once, bounds the temporary memory of the detector
+BLOCK_SAMPLES = 2 ** 18
+
+
+def _per_channel(value, n_channels):
+    value = np.asarray(value, dtype=float)
+    if value.ndim == 0:
+        value = np.full(n_channels, float(value))
+    if value.shape != (n_channels,):
+        raise ValueError(f"Expected one threshold or {n_channels} per-channel thresholds, got {value.shape[0]}")
+    return value[:, np.newaxis]
+
+
+def _sliding_rms(data, start, stop, window):
+    # RMS over the trailing window ending at every sample of [start, stop), shorter at the recording start
+    low = max(0, start - window + 1)
+    squares = data[:, low:stop] ** 2
+    cumsum = np.zeros((data.shape[0], stop - low + 1))
+    np.cumsum(squares, axis=1, out=cumsum[:, 1:])
+    end = np.arange(start - low, stop - low) + 1
+    begin = np.maximum(0, end - window)
+    return np.sqrt((cumsum[:, end] - cumsum[:, begin]) / (end - begin))
+
+
+def detect_noisy_runs(data, sfreq, threshold, min_duration, rms_threshold=None, rms_window=0.5,
+                      progress=None):
+    """
+    Finds the runs of samples where any channel is above its amplitude threshold
+    (or, with rms_threshold, where its sliding RMS is above it) lasting at least
+    min_duration seconds. Thresholds are in the data unit, either one value or one
+    per channel. Works block by block in a single O(N) pass without copying the data.
+    Returns (onsets, durations) in seconds from the first sample.
+    """
+    n_channels, n_samples = data.shape
+    threshold = _per_channel(threshold, n_channels)
+    if rms_threshold is not None:
+        rms_threshold = _per_channel(rms_threshold, n_channels)
+        rms_samples = max(1, int(round(rms_window * sfreq)))
+    min_samples = max(1, int(min_duration * sfreq))
+
+    onsets = []
+    offsets = []
+    run_start = None
+    for start in range(0, n_samples, BLOCK_SAMPLES):
+        stop = min(start + BLOCK_SAMPLES, n_samples)
+        block = data[:, start:stop]
+        noisy = ((block > threshold) | (block < -threshold)).any(axis=0)
+        if rms_threshold is not None:
+            noisy |= (_sliding_rms(data, start, stop, rms_samples) > rms_threshold).any(axis=0)
+
+        # Run boundaries inside the block, the state at its start is carried over
+        edges = np.diff(noisy.astype(np.int8), prepend=np.int8(run_start is not None))
+        rises = np.flatnonzero(edges == 1) + start
+        falls = np.flatnonzero(edges == -1) + start
+        if run_start is not None:
+            rises = np.concatenate([[run_start], rises])
+        if len(rises) > len(falls):
+            run_start = rises[-1]
+            rises = rises[:-1]
+        else:
+            run_start = None
+        long_runs = (falls - rises) >= min_samples
+        onsets.append(rises[long_runs])
+        offsets.append(falls[long_runs])
+        if progress is not None:
+            progress(stop, n_samples)
+
+    if run_start is not None and n_samples - run_start >= min_samples:
+        onsets.append([run_start])
+        offsets.append([n_samples])
+    onsets = np.concatenate(onsets) if onsets else np.array([], dtype=int)
+    offsets = np.concatenate(offsets) if offsets else np.array([], dtype=int)
+    return onsets / sfreq, (offsets - onsets) / sfreq
+
+
+def noisy_annotations(raw, threshold, min_duration, rms_threshold=None, rms_window=0.5, progress=None,
+                      description='bad_noise'):
+    """
+    Runs detect_noisy_runs on the Raw data (thresholds in volts) and returns the runs as Annotations.
+    """
+    onsets, durations = detect_noisy_runs(raw._data, raw.info['sfreq'], threshold, min_duration,
+                                          rms_threshold, rms_window, progress)
+    return mne.Annotations(onset=onsets, duration=durations, description=[description] * len(onsets))
@@ -0,0 +1,162 @@
+import os
+import sys
+import json
+import time
+import argparse
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import utils
+
+# Processing of visualisation.py with a single ICA pass (it runs a second, warm-started one),
+# used when no config file is given
+DEFAULT_CONFIG = {
+    'steps': [
+        {'step': 'filter_chain', 'l_freq': 0.1, 'h_freq': 45, 'notch_freqs': [50, 60, 100, 120]},
+        {'step': 'wavelet_denoising', 'wavelet': 'sym4', 'adaptive_threshold': True, 'level': 5},
+        {'step': 'ica', 'n_components': 15},
+    ],
+    'topomaps': True,
+    'render_preset': 'publication',
+    'save_fif': True,
+    'profile_dumps': False,
+    'features': True,
+    'features_name': 'features.h5',
+}
+
+
+def load_config(config_path):
+    """
+    Reads a json pipeline config:
+    {"steps": [{"step": "fir_filter", "l_freq": 0.1, "h_freq": 45}, ...],
+     "topomaps": true, "render_preset": "publication", "save_fif": true, "profile_dumps": false,
+     "features": true, "features_name": "features.h5"}
+    Every session gets <folder>/profile/profile.json and .csv, with profile_dumps
+    also cProfile and sampled stack dumps of each step. With features, the band
+    powers of every interval are written to <folder>/<features_name> ('.parquet' needs pyarrow).
+    """
+    import pipeline
+    if config_path is None:
+        return DEFAULT_CONFIG
+    with open(config_path, 'r') as file:
+        config = json.load(file)
+    import rendering
+    for step in config.get('steps', []):
+        if step.get('step') not in pipeline.STEPS:
+            raise ValueError(f"Unknown step '{step.get('step')}', expected one of {list(pipeline.STEPS)}")
+    config = {**DEFAULT_CONFIG, **config}
+    if config['render_preset'] not in rendering.PRESETS:
+        raise ValueError(f"Unknown render preset '{config['render_preset']}', expected one of {list(rendering.PRESETS)}")
+    return config
+
+
+def process_session(folder, config, cache_dir=None):
+    """
+    Runs the configured pipeline over one session folder, in its own process.
+    Returns a summary dict.
+    """
+    # Figures are only saved, never shown
+    import matplotlib
+    matplotlib.use('Agg')
+    import mne
+    import pipeline
+    from pipeline_cache import PipelineCache
+    from spectra import IntervalSpectra
+    import rendering
+    from profiling import Profiler
+    import features
+    import signal_export
+    import alignment
+    from interval_index import IntervalIndex
+    mne.set_log_level('WARNING')
+
+    start = time.time()
+    log_file, bdf_file_path = utils.search_files(folder)
+    summary = {'folder': folder, 'log_file': log_file, 'bdf_file': bdf_file_path}
+    profiler = Profiler(os.path.join(folder, 'profile') if config.get('profile_dumps') else None)
+    try:
+        cache = PipelineCache(cache_dir) if cache_dir else None
+        with profiler.measure('load'):
+            flag_intervals, _, _ = utils.extract_flag_intervals(log_file, fractional=True)
+            # Only the log keypresses and the bdf header are read to find the window
+            window = alignment.align(log_file, bdf_file_path)
+
+            base_steps = [dict(step='load', bdf_file=bdf_file_path, log_file=log_file, alignment=alignment.VERSION)]
+            hit = cache.get(base_steps) if cache is not None else None
+            if hit is not None:
+                raw = hit[0]
+            else:
+                raw = alignment.open_window(bdf_file_path, window)
+                if cache is not None:
+                    cache.put(base_steps, raw)
+
+        raw, results = pipeline.run_steps(raw, base_steps, config['steps'], cache=cache, profiler=profiler)
+        flag_intervals = IntervalIndex.from_raw(flag_intervals, raw)
+        # By position in the config, the same step may run more than once
+        summary['results'] = [{'position': i - len(base_steps), 'step': config['steps'][i - len(base_steps)]['step'],
+                               'result': result} for i, result in sorted(results.items())]
+
+        spectra = None
+        if config.get('save_fif'):
+            with profiler.measure('save_fif'):
+                exported = signal_export.export_range(os.path.join(folder, 'cleaned_eeg_raw.fif'), raw)
+            summary['fif_sha256'] = exported['sha256']
+        if config.get('topomaps'):
+            os.makedirs(os.path.join(folder, 'Images'), exist_ok=True)
+            with profiler.measure('topomaps'):
+                # Sessions already run in parallel, figures are rendered in this process
+                spectra = IntervalSpectra(raw)
+                rendered, skipped = rendering.render_figures(spectra, flag_intervals, folder,
+                                                             preset=config['render_preset'], n_jobs=1,
+                                                             profiler=profiler)
+            summary['figures'] = {'rendered': len(rendered), 'skipped': len(skipped)}
+        if config.get('features'):
+            with profiler.measure('features'):
+                if spectra is None:
+                    spectra = IntervalSpectra(raw)
+                table = features.compute_features(spectra, flag_intervals)
+                summary['features'] = features.write_features(os.path.join(folder, config['features_name']), table,
+                                                              session=os.path.basename(os.path.normpath(folder)))
+        summary['status'] = 'ok'
+    except Exception as e:
+        summary['status'] = 'error'
+        summary['error'] = f"{e}\n{traceback.format_exc()}"
+    summary['profile'] = {name: round(seconds, 2) for name, seconds in profiler.totals().items()}
+    profiler.export(os.path.join(folder, 'profile'))
+    summary['seconds'] = round(time.time() - start, 2)
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Process every session folder (.log and .bdf pair) below a root directory without the GUI.")
+    parser.add_argument('root', help="Root directory searched for session folders")
+    parser.add_argument('--config', help="Json pipeline config, defaults to the visualisation.py pipeline")
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help="Number of sessions processed at once")
+    parser.add_argument('--cache-dir', help="Reuse and store intermediate results in this cache directory")
+    parser.add_argument('--summary', help="Where to write the json summary (default: <root>/batch_summary.json)")
+    args = parser.parse_args(argv)
+
+    config = load_config(args.config)
+    sessions = utils.find_sessions(args.root)
+    print(f"Found {len(sessions)} session(s) in '{args.root}', processing with {args.workers} worker(s).")
+
+    summaries = []
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        futures = [executor.submit(process_session, folder, config, args.cache_dir) for folder in sessions]
+        for n, future in enumerate(as_completed(futures), start=1):
+            summary = future.result()
+            summaries.append(summary)
+            print(f"[{n}/{len(sessions)}] {summary['status']:5s} {summary['seconds']:8.1f} s  {summary['folder']}")
+            if summary['status'] == 'error':
+                print(summary['error'], file=sys.stderr)
+
+    summary_path = args.summary or os.path.join(args.root, 'batch_summary.json')
+    with open(summary_path, 'w') as file:
+        json.dump({'config': config, 'sessions': sorted(summaries, key=lambda s: s['folder'])}, file,
+                  indent=2, default=str)
+    print(f"Summary written to '{summary_path}'.")
+    return 0 if all(summary['status'] == 'ok' for summary in summaries) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,85 @@
+import re
+from datetime import datetime, timedelta
+
+# Fixed part of an EDF/BDF header, the signal fields follow, ns entries each
+FIXED_HEADER_BYTES = 256
+SIGNAL_FIELDS = [('label', 16), ('transducer', 80), ('physical_dimension', 8), ('physical_min', 8),
+                 ('physical_max', 8), ('digital_min', 8), ('digital_max', 8), ('prefiltering', 80),
+                 ('samples_per_record', 8), ('reserved', 32)]
+ANNOTATION_LABELS = ('BDF Annotations', 'EDF Annotations')
+_time_keeping = re.compile(rb'([+-]\d+(?:\.\d*)?)\x14\x14')
+
+
+def _field(raw, start, size):
+    return raw[start:start + size].decode('ascii', errors='replace').strip()
+
+
+def read_header(path):
+    """
+    Parses the header of an EDF/BDF(+) file without reading the samples.
+    Returns a dict with 'start' (datetime, with the sub-second part of EDF+/BDF+
+    files), 'duration' (seconds), 'n_records', 'record_duration', 'n_signals',
+    'signals' (list of dicts of the signal fields), 'header_bytes' and 'sample_bytes'.
+    """
+    with open(path, 'rb') as file:
+        fixed = file.read(FIXED_HEADER_BYTES)
+        if len(fixed) < FIXED_HEADER_BYTES:
+            raise ValueError(f"'{path}' is too short to be an EDF/BDF file.")
+        n_signals = int(_field(fixed, 252, 4))
+        signal_part = file.read(n_signals * sum(size for _, size in SIGNAL_FIELDS))
+
+        day, month, year = (int(value) for value in _field(fixed, 168, 8).split('.'))
+        hours, minutes, seconds = (int(value) for value in _field(fixed, 176, 8).split('.'))
+        # Two-digit years, 85-99 are 1985-1999 as in the EDF specification
+        year += 1900 if year >= 85 else 2000
+        start = datetime(year, month, day, hours, minutes, seconds)
+
+        signals = [{} for _ in range(n_signals)]
+        offset = 0
+        for name, size in SIGNAL_FIELDS:
+            for signal in signals:
+                signal[name] = _field(signal_part, offset, size)
+                offset += size
+        for signal in signals:
+            signal['samples_per_record'] = int(signal['samples_per_record'])
+
+        header = {
+            'start': start,
+            'n_records': int(_field(fixed, 236, 8)),
+            'record_duration': float(_field(fixed, 244, 8)),
+            'n_signals': n_signals,
+            'signals': signals,
+            'header_bytes': int(_field(fixed, 184, 8)),
+            # BDF stores 24-bit samples, its version field starts with byte 255
+            'sample_bytes': 3 if fixed[:1] == b'\xff' else 2,
+            'continuous': not _field(fixed, 192, 44).endswith('D'),
+        }
+        header['duration'] = header['n_records'] * header['record_duration']
+        header['start'] += timedelta(seconds=_subsecond_start(file, header))
+    return header
+
+
+def _subsecond_start(file, header):
+    # EDF+/BDF+ keep the fraction of a second of the start in the time-keeping
+    # annotation of the first data record
+    labels = [signal['label'] for signal in header['signals']]
+    annotation = next((i for i, label in enumerate(labels) if label in ANNOTATION_LABELS), None)
+    if annotation is None or header['n_records'] == 0:
+        return 0.0
+    sample_bytes = header['sample_bytes']
+    before = sum(signal['samples_per_record'] for signal in header['signals'][:annotation])
+    file.seek(header['header_bytes'] + before * sample_bytes)
+    raw = file.read(header['signals'][annotation]['samples_per_record'] * sample_bytes)
+    match = _time_keeping.match(raw)
+    if match is None:
+        return 0.0
+    onset = float(match.group(1))
+    return onset - int(onset)
+
+
+def sampling_rates(header):
+    """
+    Samples per second of every signal, by label.
+    """
+    return {signal['label']: signal['samples_per_record'] / header['record_duration']
+            for signal in header['signals'] if header['record_duration'] > 0}
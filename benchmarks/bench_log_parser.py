@@ -0,0 +1,129 @@
+import argparse
+import os
+import re
+import sys
+import time
+import tempfile
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import utils
+
+
+def reference_extract_flag_intervals(log_file):
+    # Previous implementation (readlines, two regexes and strptime per line), kept for comparison
+    with open(log_file, 'r') as file:
+        lines = file.readlines()
+
+    flag_intervals = []
+    current_flag = None
+    start_time = None
+    f1_base_time = None
+    last_event_time = None
+    time_pattern = re.compile(r'(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2})')
+    flag_pattern = re.compile(r'CRITICAL - Pressed (\w+\.\w+)')
+
+    def time_to_seconds(time_str):
+        dt = datetime.strptime(time_str, "%Y-%m-%d %H:%M:%S")
+        if f1_base_time is None:
+            return 0
+        return (dt - f1_base_time).total_seconds()
+
+    for line in lines:
+        time_match = time_pattern.search(line)
+        flag_match = flag_pattern.search(line)
+        if time_match and flag_match:
+            timestamp = time_match.group(1)
+            flag_key = flag_match.group(1)
+            if flag_key in utils.FLAG_MAPPING:
+                dt_timestamp = datetime.strptime(timestamp, "%Y-%m-%d %H:%M:%S")
+                if utils.FLAG_MAPPING[flag_key] == "F1" and f1_base_time is None:
+                    f1_base_time = dt_timestamp
+                if current_flag is None:
+                    current_flag = utils.FLAG_MAPPING[flag_key]
+                    start_time = timestamp
+                else:
+                    end_flag = utils.FLAG_MAPPING[flag_key]
+                    if not ((current_flag == "F3" and end_flag == "F4") or
+                            (current_flag == "F7" and end_flag == "F8")):
+                        flag_intervals.append((time_to_seconds(start_time), time_to_seconds(timestamp),
+                                               current_flag, end_flag))
+                    current_flag = utils.FLAG_MAPPING[flag_key]
+                    start_time = timestamp
+                last_event_time = dt_timestamp
+
+    total_duration_seconds = None
+    if f1_base_time and last_event_time:
+        total_duration_seconds = int((last_event_time - f1_base_time).total_seconds())
+    return flag_intervals, f1_base_time, total_duration_seconds
+
+
+def write_synthetic_log(path, size_mb, critical_every):
+    """
+    Writes a keypress log of about size_mb megabytes, one 'CRITICAL - Pressed Key.fN'
+    line every critical_every lines. Returns the number of lines.
+    """
+    keys = ['f1', 'f3', 'f4', 'f6', 'f7', 'f8']
+    start = datetime(2024, 5, 1, 9, 0, 0)
+    target = size_mb * 1024 * 1024
+    written = 0
+    n_lines = 0
+    second = None
+    with open(path, 'w') as file:
+        while written < target:
+            lines = []
+            for _ in range(10000):
+                # 100 lines per second, the timestamp is only formatted when it changes
+                if n_lines // 100 != second:
+                    second = n_lines // 100
+                    timestamp = (start + timedelta(seconds=second)).strftime('%Y-%m-%d %H:%M:%S')
+                if n_lines % critical_every == 0:
+                    key = keys[(n_lines // critical_every) % len(keys)]
+                    lines.append(f"{timestamp},000 - CRITICAL - Pressed Key.{key}\n")
+                else:
+                    lines.append(f"{timestamp},000 - INFO - Mouse moved to ({n_lines % 1920}, {n_lines % 1080})\n")
+                n_lines += 1
+            block = ''.join(lines)
+            file.write(block)
+            written += len(block)
+    return n_lines
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Throughput of the keypress log parser on a synthetic log.")
+    parser.add_argument('--size-mb', type=int, default=1024, help="Size of the synthetic log")
+    parser.add_argument('--critical-every', type=int, default=1000, help="One keypress event every N lines")
+    parser.add_argument('--log', help="Use an existing log file instead of generating one")
+    parser.add_argument('--skip-reference', action='store_true', help="Do not time the previous implementation")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = args.log
+        if path is None:
+            path = os.path.join(tmp, 'synthetic.log')
+            start = time.perf_counter()
+            write_synthetic_log(path, args.size_mb, args.critical_every)
+            print(f"Generated {path} in {time.perf_counter() - start:.1f} s")
+        with open(path, 'rb') as file:
+            n_lines = sum(1 for _ in file)
+        size_mb = os.path.getsize(path) / 1024 / 1024
+        print(f"Log: {n_lines} lines, {size_mb:.0f} MB")
+
+        start = time.perf_counter()
+        intervals, f1_base_time, total = utils.parse_flag_intervals(path)
+        elapsed = time.perf_counter() - start
+        print(f"streaming parser:   {elapsed:8.2f} s  {n_lines / elapsed:14,.0f} lines/s  {size_mb / elapsed:8.1f} MB/s  "
+              f"({len(intervals)} intervals)")
+
+        if not args.skip_reference:
+            start = time.perf_counter()
+            reference = reference_extract_flag_intervals(path)
+            elapsed_reference = time.perf_counter() - start
+            print(f"previous parser:    {elapsed_reference:8.2f} s  {n_lines / elapsed_reference:14,.0f} lines/s  "
+                  f"(x{elapsed_reference / elapsed:.1f} slower)")
+            same = reference == (intervals.tolist(), f1_base_time, total)
+            print(f"Same result: {same}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,218 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+import matplotlib
+matplotlib.use('Agg')
+import numpy as np
+import mne
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+import utils
+import alignment
+import pipeline
+import rendering
+import ica_service
+from spectra import IntervalSpectra
+from interval_index import IntervalIndex
+from profiling import Profiler
+from synthetic import make_session
+
+DEFAULT_RESULTS = os.path.join(BENCH_DIR, 'results.jsonl')
+
+
+def _parse_log(state):
+    state['intervals'], _, _ = utils.extract_flag_intervals(state['log'], fractional=True)
+
+
+def _load(state):
+    state['raw'] = alignment.open_window(state['bdf'], alignment.align(state['log'], state['bdf']))
+    state['intervals'] = IntervalIndex.from_raw(state['intervals'], state['raw'])
+
+
+def _spectra(state):
+    state['spectra'] = IntervalSpectra(state['raw'])
+    for interval in state['intervals']:
+        state['spectra'].spectrum(interval)
+
+
+def _topomaps(state):
+    with tempfile.TemporaryDirectory() as directory:
+        rendering.render_figures(state['spectra'], state['intervals'], directory, preset='preview', n_jobs=1)
+
+
+def _ica(state):
+    # pipeline.ica with an empty model cache, so the fit itself is timed
+    with tempfile.TemporaryDirectory() as cache_dir:
+        ica, _ = ica_service.fit_ica(state['raw'], 15, cache_dir=cache_dir)
+    ica.exclude, _ = ica.find_bads_eog(state['raw'], ch_name=['Fp1', 'Fp2'])
+    ica.apply(state['raw'])
+
+
+def _step(name, **params):
+    def run(state):
+        pipeline.STEPS[name](state['raw'], **params)
+    return run
+
+
+# (name, function of the shared state, modifies the signal) in pipeline order, each stage uses the previous results
+STAGES = [
+    ('parse_log', _parse_log, False),
+    ('load', _load, False),
+    ('fir_notch', lambda state: (_step('fir_filter')(state), _step('notch_filter')(state)), True),
+    ('filter_chain', _step('filter_chain'), True),
+    ('wavelet_denoising', _step('wavelet_denoising'), True),
+    ('remove_noise', _step('remove_noise'), True),
+    ('ica', _ica, True),
+    ('spectra', _spectra, False),
+    ('topomaps', _topomaps, False),
+]
+
+
+def git_commit():
+    # Commit of the benchmarked tree, '+dirty' when it has uncommitted changes
+    root = os.path.dirname(BENCH_DIR)
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=root, capture_output=True,
+                                text=True, check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=root,
+                               capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return commit + ('+dirty' if dirty else '')
+
+
+def run_stages(log_path, bdf_path, stages, repeat=1):
+    """
+    Runs the stages in pipeline order and returns {stage: record} with the best wall
+    time of repeat runs. A stage that modifies the signal is run on a copy each time
+    and the last copy is kept for the next stages, so every stage sees the same input.
+    """
+    profiler = Profiler()
+    state = {'log': log_path, 'bdf': bdf_path}
+    wanted = set(stages)
+    # Parsing and loading are needed by everything after them, the figures need the spectra
+    needed = wanted | {'parse_log', 'load'} | ({'spectra'} if 'topomaps' in wanted else set())
+    results = {}
+    for name, run, modifies in STAGES:
+        if name not in needed:
+            continue
+        best = None
+        source = state.get('raw')
+        for _ in range(repeat if name in wanted else 1):
+            if modifies:
+                state['raw'] = source.copy()
+            with profiler.measure(name) as record:
+                run(state)
+            if best is None or record['wall_s'] < best['wall_s']:
+                best = record
+        if name in wanted:
+            results[name] = best
+    return results, state
+
+
+def throughput(name, record, state):
+    # Samples (channels x times) per second, or log lines per second for the parser
+    if name == 'parse_log':
+        with open(state['log'], 'rb') as file:
+            return sum(1 for _ in file) / record['wall_s'], 'lines/s'
+    if name == 'topomaps':
+        return len(state['intervals']) / record['wall_s'], 'figures/s'
+    raw = state['raw']
+    return len(raw.ch_names) * raw.n_times / record['wall_s'], 'samples/s'
+
+
+def report(results_path, last=10):
+    """
+    Prints the wall time of every stage for the last runs in the results file, grouped by parameters.
+    """
+    with open(results_path) as file:
+        entries = [json.loads(line) for line in file if line.strip()]
+    groups = {}
+    for entry in entries:
+        groups.setdefault(json.dumps(entry['params'], sort_keys=True), []).append(entry)
+    for params, group in groups.items():
+        group = group[-last:]
+        names = [name for name, _, _ in STAGES if any(name in entry['stages'] for entry in group)]
+        print(f"\n{params}")
+        # Each stage shows its wall time and the memory it needed itself (peak minus RSS at its start)
+        print(f"{'commit':16s} {'date':16s} " + " ".join(f"{name[:18]:>18s}" for name in names))
+        for entry in group:
+            cells = []
+            for name in names:
+                stage = entry['stages'].get(name)
+                if stage is None:
+                    cells.append(f"{'-':>18s}")
+                else:
+                    growth = stage.get('peak_rss_delta')
+                    growth = f"+{growth / 1e6:.0f} MB" if growth is not None else "-"
+                    cells.append(f"{stage['wall_s']:9.3f} s {growth:>6s}")
+            print(f"{str(entry['commit']):16s} {entry['date'][:16]:16s} " + " ".join(cells))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Time every pipeline stage headlessly on a synthetic session and append the "
+                    "results, tagged with the git commit, to a jsonl file to follow them across commits.")
+    parser.add_argument('--channels', type=int, default=16, help="Channels of the synthetic recording (at least 16)")
+    parser.add_argument('--sfreq', type=int, default=256)
+    parser.add_argument('--duration', type=float, default=300, help="Recording length in seconds")
+    parser.add_argument('--intervals', type=int, default=40, help="Number of flag intervals in the log")
+    parser.add_argument('--stages', nargs='+', choices=[name for name, _, _ in STAGES],
+                        default=[name for name, _, _ in STAGES])
+    parser.add_argument('--repeat', type=int, default=1, help="Keep the best of N runs of every stage")
+    parser.add_argument('--session', help="Benchmark an existing session folder instead of a synthetic one")
+    parser.add_argument('--results', default=DEFAULT_RESULTS, help="jsonl file the results are appended to")
+    parser.add_argument('--no-save', action='store_true', help="Only print the results")
+    parser.add_argument('--report', action='store_true', help="Print the stored results and exit")
+    args = parser.parse_args()
+
+    if args.report:
+        report(args.results)
+        return
+    if args.session is None and args.channels < len(utils.CHANNELS):
+        parser.error(f"--channels must be at least {len(utils.CHANNELS)}, the pipeline reads {utils.CHANNELS}")
+    mne.set_log_level('WARNING')
+
+    with tempfile.TemporaryDirectory() as tmp:
+        if args.session:
+            log_path, bdf_path = utils.search_files(args.session)
+            params = {'session': os.path.abspath(args.session)}
+        else:
+            start = time.perf_counter()
+            log_path, bdf_path = make_session(tmp, args.channels, args.sfreq, args.duration, args.intervals)
+            params = {'channels': args.channels, 'sfreq': args.sfreq, 'duration': args.duration,
+                      'intervals': args.intervals}
+            print(f"Generated a {args.duration:g} s, {args.channels} channel, {args.sfreq} Hz session "
+                  f"in {time.perf_counter() - start:.1f} s")
+        results, state = run_stages(log_path, bdf_path, args.stages, args.repeat)
+
+        stages = {}
+        for name, record in results.items():
+            value, unit = throughput(name, record, state)
+            stages[name] = {'wall_s': round(record['wall_s'], 4), 'cpu_s': round(record['cpu_s'], 4),
+                            'peak_rss': record['peak_rss'], 'peak_rss_delta': record['peak_rss_delta'],
+                            'throughput': round(value, 1), 'unit': unit}
+            print(f"{name:18s} {record['wall_s']:9.3f} s  {record['cpu_s']:9.3f} s CPU  "
+                  f"{record['peak_rss_delta'] / 1e6:+7.0f} MB peak  {value:14,.0f} {unit}")
+
+    entry = {
+        'commit': git_commit(), 'date': time.strftime('%Y-%m-%dT%H:%M:%S'), 'params': params,
+        'repeat': args.repeat, 'stages': stages,
+        'host': {'machine': platform.machine(), 'cpus': os.cpu_count(), 'python': platform.python_version(),
+                 'numpy': np.__version__, 'mne': mne.__version__},
+    }
+    if not args.no_save:
+        with open(args.results, 'a') as file:
+            file.write(json.dumps(entry) + '\n')
+        print(f"Results appended to '{args.results}'.")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Run in a fresh interpreter per measurement, prints one json line
+CHILD = r"""
+import json, sys, time
+start = time.perf_counter()
+sys.path.insert(0, {root!r})
+if {eager!r}:
+    # What vis_app imported at module load before the lazy imports
+    import importlib
+    import vis_app
+    for name in vis_app.WARMUP_MODULES:
+        importlib.import_module(name)
+import vis_app
+from PyQt5.QtWidgets import QApplication
+from PyQt5.QtCore import QObject, QEvent
+imported = time.perf_counter()
+app = QApplication(sys.argv)
+painted = []
+
+class FirstPaint(QObject):
+    def eventFilter(self, obj, event):
+        if event.type() == QEvent.Paint and not painted:
+            painted.append(time.perf_counter())
+        return False
+
+first_paint = FirstPaint()
+app.installEventFilter(first_paint)
+window = vis_app.EEGProcessingApp()
+while not painted:
+    app.processEvents()
+shown = painted[0]
+# Until the background warm-up job is done
+while window.jobs.pending() or not all(name in sys.modules for name in vis_app.WARMUP_MODULES):
+    app.processEvents()
+    time.sleep(0.005)
+ready = time.perf_counter()
+window.close()
+print(json.dumps({{'import': imported - start, 'shown': shown - start, 'ready': ready - start}}))
+"""
+
+
+def measure(eager, runs):
+    results = []
+    env = dict(os.environ)
+    if not env.get('DISPLAY') and not env.get('WAYLAND_DISPLAY'):
+        env.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, '-c', CHILD.format(root=ROOT, eager=eager)], env=env,
+                                capture_output=True, text=True, check=True).stdout
+        results.append(json.loads(output.strip().splitlines()[-1]))
+    return {key: statistics.median(result[key] for result in results) for key in results[0]}
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Time from interpreter start to the first paint of the vis_app window and to the "
+                    "scientific modules being loaded, with lazy imports and with eager imports.")
+    parser.add_argument('--runs', type=int, default=5, help="Median of N fresh interpreters")
+    args = parser.parse_args()
+
+    print(f"{'':8s} {'imports':>9s} {'window':>9s} {'ready':>9s}   (median of {args.runs}, seconds)")
+    for label, eager in [('eager', True), ('lazy', False)]:
+        times = measure(eager, args.runs)
+        print(f"{label:8s} {times['import']:9.3f} {times['shown']:9.3f} {times['ready']:9.3f}")
+
+
+if __name__ == '__main__':
+    main()
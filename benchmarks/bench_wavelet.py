@@ -0,0 +1,56 @@
+import argparse
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import utils
+
+
+def timed(fn, repeat):
+    best = None
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare per-channel and batched wavelet denoising.")
+    parser.add_argument('--channels', type=int, default=16)
+    parser.add_argument('--sfreq', type=float, default=2048)
+    parser.add_argument('--duration', type=float, default=600, help="Signal length in seconds")
+    parser.add_argument('--wavelet', default='sym4')
+    parser.add_argument('--level', type=int, default=5)
+    parser.add_argument('--jobs', type=int, default=os.cpu_count())
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    data = rng.standard_normal((args.channels, int(args.sfreq * args.duration))) * 1e-5
+    print(f"Data: {data.shape[0]} channels x {data.shape[1]} samples ({data.nbytes / 1e6:.0f} MB)")
+
+    reference_time, reference = timed(lambda: np.apply_along_axis(
+        utils.wavelet_denoising, 1, data, wavelet=args.wavelet, adaptive_threshold=True, level=args.level
+    ), args.repeat)
+    print(f"apply_along_axis:        {reference_time:8.3f} s")
+
+    batch_time, batch = timed(lambda: utils.wavelet_denoising_batch(
+        data, wavelet=args.wavelet, adaptive_threshold=True, level=args.level
+    ), args.repeat)
+    print(f"batched:                 {batch_time:8.3f} s  (x{reference_time / batch_time:.2f}, "
+          f"max diff {np.max(np.abs(batch - reference)):.2e})")
+
+    pool_time, pooled = timed(lambda: utils.wavelet_denoising_batch(
+        data, wavelet=args.wavelet, adaptive_threshold=True, level=args.level, n_jobs=args.jobs
+    ), args.repeat)
+    print(f"chunked, {args.jobs:2d} processes:  {pool_time:8.3f} s  (x{reference_time / pool_time:.2f}, "
+          f"max diff {np.max(np.abs(pooled - reference)):.2e})")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,131 @@
+import argparse
+import os
+import sys
+from datetime import datetime, timedelta
+import numpy as np
+import pyedflib
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import utils
+
+# Keys pressed in turn, like the recorded sessions
+KEY_CYCLE = ['f1', 'f3', 'f4', 'f6', 'f7', 'f8']
+# Seconds written to the bdf at once, bounds the memory of long recordings
+CHUNK_SECONDS = 60
+
+
+def synthetic_eeg(n_channels, sfreq, n_samples, rng, start=0):
+    """
+    EEG-like test signal in microvolts: 1/f background, 10 Hz alpha stronger on the
+    back channels, 50 Hz line noise and blinks on the first two (frontal) channels.
+    start is the index of the first sample, so consecutive chunks join up.
+    """
+    times = (start + np.arange(n_samples)) / sfreq
+    # 1/f noise shaped in the frequency domain, one chunk at a time
+    spectrum = rng.standard_normal((n_channels, n_samples // 2 + 1)) + 1j * rng.standard_normal((n_channels, n_samples // 2 + 1))
+    freqs = np.fft.rfftfreq(n_samples, 1 / sfreq)
+    spectrum /= np.sqrt(np.maximum(freqs, 1.0))
+    data = np.fft.irfft(spectrum, n=n_samples, axis=-1)
+    data *= 10 / (data.std(axis=-1, keepdims=True) + 1e-12)
+
+    alpha_gain = np.linspace(5, 20, n_channels)[:, np.newaxis]
+    phases = np.arange(n_channels)[:, np.newaxis] * 0.3
+    data += alpha_gain * np.sin(2 * np.pi * 10 * times + phases)
+    data += 8 * np.sin(2 * np.pi * 50 * times)
+
+    # A 300 ms blink about every 4 s
+    blink = 150 * np.hanning(int(0.3 * sfreq))
+    for onset in np.flatnonzero(np.diff(np.floor(times / 4)) > 0):
+        stop = min(onset + len(blink), n_samples)
+        data[:min(2, n_channels), onset:stop] += blink[:stop - onset]
+    return data
+
+
+def write_synthetic_bdf(path, n_channels=16, sfreq=256, duration=300, start_time=datetime(2024, 5, 1, 12, 0, 0), seed=0):
+    """
+    Writes a BDF+ recording with channels 'A1'... 'A<n_channels>' like the Biosemi files.
+    sfreq must be an integer, the file has one second data records.
+    """
+    sfreq = int(sfreq)
+    rng = np.random.default_rng(seed)
+    writer = pyedflib.EdfWriter(path, n_channels, file_type=pyedflib.FILETYPE_BDFPLUS)
+    try:
+        writer.setSignalHeaders([dict(label=f'A{i + 1}', dimension='uV', sample_frequency=sfreq,
+                                      physical_max=5000, physical_min=-5000,
+                                      digital_max=8388607, digital_min=-8388608) for i in range(n_channels)])
+        writer.setStartdatetime(start_time)
+        n_samples = int(duration) * sfreq
+        for start in range(0, n_samples, CHUNK_SECONDS * sfreq):
+            chunk = synthetic_eeg(n_channels, sfreq, min(CHUNK_SECONDS * sfreq, n_samples - start), rng, start)
+            writer.writeSamples(list(chunk))
+    finally:
+        writer.close()
+
+
+def key_sequence(n_intervals):
+    """
+    Keys pressed in KEY_CYCLE order until the parser gets n_intervals intervals
+    (pairs in utils.SKIPPED_PAIRS do not count).
+    """
+    keys = [KEY_CYCLE[0]]
+    n = 0
+    while n < n_intervals:
+        key = KEY_CYCLE[len(keys) % len(KEY_CYCLE)]
+        if (utils.FLAG_MAPPING['Key.' + keys[-1]], utils.FLAG_MAPPING['Key.' + key]) not in utils.SKIPPED_PAIRS:
+            n += 1
+        keys.append(key)
+    return keys
+
+
+def write_synthetic_log(path, n_intervals, start_time, duration, filler_per_second=2):
+    """
+    Writes a keypress log whose 'CRITICAL - Pressed Key.fN' events delimit n_intervals
+    intervals evenly spread over duration seconds from start_time, with
+    filler_per_second INFO lines like the mouse events of the real logs.
+    """
+    keys = key_sequence(n_intervals)
+    step = duration / (len(keys) - 1)
+    with open(path, 'w') as file:
+        second = 0
+        for i, key in enumerate(keys):
+            pressed = i * step
+            while second < pressed:
+                for j in range(filler_per_second):
+                    stamp = start_time + timedelta(seconds=second + j / filler_per_second)
+                    file.write(f"{stamp:%Y-%m-%d %H:%M:%S},{stamp.microsecond // 1000:03d} - INFO - Mouse moved to ({j}, {second})\n")
+                second += 1
+            stamp = start_time + timedelta(seconds=pressed)
+            file.write(f"{stamp:%Y-%m-%d %H:%M:%S},{stamp.microsecond // 1000:03d} - CRITICAL - Pressed Key.{key}\n")
+
+
+def make_session(folder, n_channels=16, sfreq=256, duration=300, n_intervals=40, lead=10, seed=0):
+    """
+    Writes a session folder (rec.bdf and keys.log) where the log starts lead seconds
+    after the recording and ends lead seconds before it. Returns (log path, bdf path).
+    """
+    if duration <= 2 * lead:
+        raise ValueError(f"duration ({duration} s) must be longer than twice the lead ({lead} s).")
+    os.makedirs(folder, exist_ok=True)
+    start_time = datetime(2024, 5, 1, 12, 0, 0)
+    bdf_path = os.path.join(folder, 'rec.bdf')
+    log_path = os.path.join(folder, 'keys.log')
+    write_synthetic_bdf(bdf_path, n_channels, sfreq, duration, start_time, seed)
+    write_synthetic_log(log_path, n_intervals, start_time + timedelta(seconds=lead), int(duration - 2 * lead))
+    return log_path, bdf_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write a synthetic session folder (.bdf recording and keypress log).")
+    parser.add_argument('folder')
+    parser.add_argument('--channels', type=int, default=16)
+    parser.add_argument('--sfreq', type=int, default=256)
+    parser.add_argument('--duration', type=float, default=300, help="Recording length in seconds")
+    parser.add_argument('--intervals', type=int, default=40, help="Number of flag intervals in the log")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    log_path, bdf_path = make_session(args.folder, args.channels, args.sfreq, args.duration, args.intervals, seed=args.seed)
+    print(f"Wrote {bdf_path} ({os.path.getsize(bdf_path) / 1e6:.1f} MB) and {log_path}")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,65 +1,64 @@
+import sys
+import time
+import argparse
 from datetime import datetime, timedelta
-import visualisation
+import utils
+import alignment
 
-# Function to convert time string to seconds since start of the day
-def time_to_seconds(time_str):
-    t = datetime.strptime(time_str, '%H:%M:%S')
-    return t.hour * 3600 + t.minute * 60 + t.second
 
-# Function to convert seconds since start of the day to time string
-def seconds_to_time(seconds):
-    return str(timedelta(seconds=seconds))
+def clock_time(seconds):
+    # Time of day with milliseconds of seconds since 1970
+    return (datetime(1970, 1, 1) + timedelta(seconds=seconds)).strftime('%H:%M:%S.%f')[:-3]
 
-# Provided log details for log1
-log1_start_time = visualisation.f1_starting_time
-log1_duration = visualisation.total_duration_seconds  # in seconds
-log1_start_seconds = time_to_seconds(log1_start_time)
-log1_end_seconds = log1_start_seconds + log1_duration
 
-# Provided log details for log2
-bdf_start_time = visualisation.raw.info['meas_date'].time().strftime("%H:%M:%S")
-bdf_duration = visualisation.raw.times[-1]  # in seconds
-bdf_start_seconds = time_to_seconds(bdf_start_time)
-bdf_end_seconds = bdf_start_seconds + bdf_duration
+def find_pairs(root, use_index=True):
+    """
+    (log file, bdf file) of the sessions below root, from the session index or a walk of the folder.
+    """
+    if use_index:
+        from session_index import SessionIndex
+        index = SessionIndex()
+        try:
+            return [(session['log_file'], session['bdf_file']) for session in index.lookup(root)]
+        finally:
+            index.close()
+    log_file, bdf_file = utils.search_files(root)
+    return [(log_file, bdf_file)] if log_file and bdf_file else []
 
-# Initialize variables to hold the synchronized times
-sync_start_seconds = 0
-sync_end_seconds = 0
-cut_from_start = 0
-cut_from_end = 0
 
-# Determine the appropriate case and adjust times accordingly
-if bdf_start_seconds <= log1_start_seconds:
-    if bdf_end_seconds <= log1_end_seconds:
-        # log2 starts before or at the same time and ends before or at the same time
-        sync_start_seconds = log1_start_seconds
-        sync_end_seconds = log1_end_seconds
-        cut_from_start = log1_start_seconds - bdf_start_seconds
-        cut_from_end = bdf_end_seconds - log1_end_seconds
-    else:
-        # log2 starts before or at the same time and ends after log1
-        sync_start_seconds = log1_start_seconds
-        sync_end_seconds = log1_end_seconds
-        cut_from_start = log1_start_seconds - bdf_start_seconds
-        cut_from_end = bdf_end_seconds - log1_end_seconds
-else:
-    if bdf_end_seconds >= log1_end_seconds:
-        # log2 starts after or at the same time and ends after or at the same time
-        sync_start_seconds = bdf_start_seconds
-        sync_end_seconds = bdf_start_seconds + log1_duration
-        cut_from_end = bdf_end_seconds - sync_end_seconds
-    else:
-        # log2 starts after or at the same time and ends before log1
-        sync_start_seconds = bdf_start_seconds
-        sync_end_seconds = bdf_start_seconds + log1_duration
-        cut_from_end = bdf_end_seconds - sync_end_seconds
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Print the window of every recording synchronised with its log. Only the log "
+                    "keypresses and the bdf headers are read, no signal data is loaded.")
+    parser.add_argument('root', help="Session folder or data root")
+    parser.add_argument('--no-index', action='store_true',
+                        help="Search root itself for one .log/.bdf pair instead of using the session index")
+    args = parser.parse_args(argv)
 
-# Convert synchronized times back to time strings
-sync_start_time = seconds_to_time(sync_start_seconds)
-sync_end_time = seconds_to_time(sync_end_seconds)
+    pairs = find_pairs(args.root, use_index=not args.no_index)
+    if not pairs:
+        print(f"No session found in '{args.root}'.")
+        return 1
+    failed = 0
+    for log_file, bdf_file in pairs:
+        start = time.perf_counter()
+        try:
+            window = alignment.align(log_file, bdf_file)
+        except (OSError, ValueError) as e:
+            failed += 1
+            print(f"{bdf_file}: {e}")
+            continue
+        elapsed = time.perf_counter() - start
+        sfreq = window['sfreq']
+        print(bdf_file)
+        print(f"  Synchronized start time: {clock_time(window['bdf_start'] + window['tmin'])}")
+        print(f"  Synchronized end time: {clock_time(window['bdf_start'] + window['tmax'])}")
+        print(f"  Cut {window['cut_from_start']:.3f} seconds from the start of the recording.")
+        print(f"  Cut {window['cut_from_end']:.3f} seconds from the end of the recording.")
+        print(f"  Samples {window['start_sample']}-{window['stop_sample']} at {sfreq:g} Hz, "
+              f"aligned in {elapsed * 1000:.1f} ms")
+    return 1 if failed else 0
 
-print(f"Synchronized start time: {sync_start_time}")
-print(f"Synchronized end time: {sync_end_time}")
-print(f"Cut {cut_from_start} seconds from the start of the second log.")
-print(f"Cut {cut_from_end} seconds from the end of the second log.")
 
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,174 @@
+import os
+import json
+import numpy as np
+from pipeline import BANDS
+
+# Written next to the Images folder of a session
+FEATURES_NAME = 'features.h5'
+FEATURE_EXTENSIONS = ('.h5', '.parquet')
+
+# Columns shared by all bands, strings are stored as bytes on disk
+KEY_FIELDS = [('interval', 'i4'), ('start', 'f8'), ('end', 'f8'), ('label', 'U2'), ('end_flag', 'U2'), ('channel', 'U8')]
+
+
+def band_column(band):
+    # 'Low Gamma (30-59.9 Hz)' -> 'low_gamma'
+    return band.split(' (')[0].lower().replace(' ', '_')
+
+
+def feature_dtype(bands=BANDS):
+    """
+    One row per (interval, label, channel): absolute power (V^2, the PSD integrated
+    over the band) and relative power (share of the summed power of all bands).
+    """
+    columns = [band_column(band) for band in bands]
+    return np.dtype(KEY_FIELDS + [(f'abs_{column}', 'f8') for column in columns]
+                    + [(f'rel_{column}', 'f8') for column in columns])
+
+
+def compute_features(spectra, intervals, bands=BANDS):
+    """
+    Band powers of every interval from a spectra.IntervalSpectra, as a structured array of feature_dtype.
+    """
+    dtype = feature_dtype(bands)
+    columns = [band_column(band) for band in bands]
+    ch_names = spectra.info['ch_names']
+    table = np.zeros(len(intervals) * len(ch_names), dtype=dtype)
+    for i, interval in enumerate(intervals):
+        psd, freqs = spectra.interval_psd(interval)
+        # Intervals shorter than a segment have their own, coarser frequency step
+        step = freqs[1] - freqs[0] if len(freqs) > 1 else spectra.sfreq
+        absolute = np.array([psd[:, (freqs >= fmin) & (freqs <= fmax)].sum(axis=1) * step
+                             for fmin, fmax in bands.values()])
+        total = absolute.sum(axis=0)
+        relative = np.divide(absolute, total, out=np.zeros_like(absolute), where=total > 0)
+
+        rows = table[i * len(ch_names):(i + 1) * len(ch_names)]
+        rows['interval'] = i
+        rows['start'], rows['end'] = interval[0], interval[1]
+        rows['label'], rows['end_flag'] = interval[2], interval[3]
+        rows['channel'] = ch_names
+        for column, band_abs, band_rel in zip(columns, absolute, relative):
+            rows[f'abs_{column}'] = band_abs
+            rows[f'rel_{column}'] = band_rel
+    return table
+
+
+def write_features(path, table, session, bands=BANDS):
+    """
+    Writes a feature table to path: Parquet for '.parquet' (needs pyarrow), HDF5 otherwise.
+    The HDF5 file has one contiguous, uncompressed dataset per column under '/features',
+    so columns can be memory mapped. The file is replaced atomically.
+    """
+    tmp_path = path + '.tmp'
+    if path.endswith('.parquet'):
+        _write_parquet(tmp_path, table, session, bands)
+    else:
+        import h5py
+        with h5py.File(tmp_path, 'w') as file:
+            group = file.create_group('features')
+            for name in table.dtype.names:
+                column = table[name]
+                group.create_dataset(name, data=column.astype('S') if column.dtype.kind == 'U' else column)
+            group.attrs['session'] = session
+            group.attrs['bands'] = json.dumps(bands)
+    os.replace(tmp_path, path)
+    return path
+
+
+def _write_parquet(path, table, session, bands):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    arrays = {'session': pa.array([session] * len(table), pa.string()).dictionary_encode()}
+    arrays.update({name: pa.array(table[name]) for name in table.dtype.names})
+    arrow_table = pa.table(arrays).replace_schema_metadata({'bands': json.dumps(bands)})
+    # Column statistics let dataset readers skip row groups that cannot match a filter
+    pq.write_table(arrow_table, path, write_statistics=True)
+
+
+def find_feature_files(root_path):
+    # Feature tables of every session below root_path, in folder order
+    found = []
+    for root, dirs, files in os.walk(root_path):
+        dirs.sort()
+        found.extend(os.path.join(root, file) for file in sorted(files)
+                     if file.startswith('features') and file.endswith(FEATURE_EXTENSIONS))
+    return found
+
+
+def _mapped(path, dataset):
+    # Contiguous uncompressed datasets are memory mapped, only the selected rows are paged in
+    offset = dataset.id.get_offset()
+    if offset is None or dataset.chunks is not None:
+        return dataset[()]
+    return np.memmap(path, dtype=dataset.dtype, mode='r', offset=offset, shape=dataset.shape)
+
+
+def _read_hdf5(path, labels, channels, sessions, columns):
+    import h5py
+    with h5py.File(path, 'r') as file:
+        group = file['features']
+        session = group.attrs['session']
+        if sessions is not None and session not in sessions:
+            return None
+        # Filters only read the small key columns, the band columns are read for the matching rows
+        mask = np.ones(group['interval'].shape[0], dtype=bool)
+        if labels is not None:
+            mask &= np.isin(group['label'][()], np.array(labels, dtype='S'))
+        if channels is not None:
+            mask &= np.isin(group['channel'][()], np.array(channels, dtype='S'))
+        rows = np.flatnonzero(mask)
+        result = {'session': np.full(len(rows), session)}
+        for name in columns:
+            column = _mapped(path, group[name])[rows]
+            result[name] = column.astype('U') if column.dtype.kind == 'S' else np.array(column)
+    return result
+
+
+def _read_parquet(paths, labels, channels, sessions, columns):
+    import pyarrow.dataset as ds
+    from pyarrow import fs
+    dataset = ds.dataset(paths, format='parquet', filesystem=fs.LocalFileSystem(use_mmap=True))
+    condition = None
+    for name, values in [('label', labels), ('channel', channels), ('session', sessions)]:
+        if values is not None:
+            expression = ds.field(name).isin(list(values))
+            condition = expression if condition is None else condition & expression
+    table = dataset.to_table(columns=['session'] + list(columns), filter=condition)
+    return {name: table.column(name).to_numpy() for name in table.column_names}
+
+
+def read_features(paths, labels=None, channels=None, sessions=None, columns=None):
+    """
+    Reads the feature tables of many sessions at once (HDF5 and/or Parquet files)
+    as one structured array with a 'session' column. Rows are filtered by flag
+    label, channel and session before the band columns are read, and only the
+    requested columns (default: all) are read.
+    """
+    if isinstance(paths, str):
+        paths = find_feature_files(paths) if os.path.isdir(paths) else [paths]
+    parts = []
+    hdf5_paths = [path for path in paths if not path.endswith('.parquet')]
+    parquet_paths = [path for path in paths if path.endswith('.parquet')]
+    if columns is None:
+        columns = list(feature_dtype().names)
+    for path in hdf5_paths:
+        part = _read_hdf5(path, labels, channels, sessions, columns)
+        if part is not None:
+            parts.append(part)
+    if parquet_paths:
+        parts.append(_read_parquet(parquet_paths, labels, channels, sessions, columns))
+
+    fields = ['session'] + list(columns)
+    n_rows = sum(len(part['session']) for part in parts)
+    session_width = max([len(str(session)) for part in parts for session in np.unique(part['session'])] or [1])
+    reference = feature_dtype()
+    dtype = np.dtype([('session', f'U{session_width}')] + [(name, reference[name]) for name in columns])
+    table = np.empty(n_rows, dtype=dtype)
+    position = 0
+    for part in parts:
+        n = len(part['session'])
+        for name in fields:
+            table[name][position:position + n] = part[name]
+        position += n
+    return table
@@ -0,0 +1,97 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import mne
+from scipy.fft import rfft, irfft, next_fast_len
+
+
+def bandpass_kernel(sfreq, l_freq, h_freq):
+    # Same zero-phase firwin design as Raw.filter(l_freq, h_freq, fir_design='firwin')
+    return mne.filter.create_filter(None, sfreq, l_freq, h_freq, fir_design='firwin', verbose=False)
+
+
+def notch_kernel(sfreq, freqs, trans_bandwidth=1.0):
+    # Same band-stops as Raw.notch_filter(freqs, fir_design='firwin'): width freq / 200 plus the transition
+    freqs = np.atleast_1d(np.asarray(freqs, dtype=float))
+    widths = freqs / 200.0
+    lows = freqs - widths / 2 - trans_bandwidth / 2
+    highs = freqs + widths / 2 + trans_bandwidth / 2
+    return mne.filter.create_filter(None, sfreq, highs, lows, l_trans_bandwidth=trans_bandwidth / 2,
+                                    h_trans_bandwidth=trans_bandwidth / 2, fir_design='firwin', verbose=False)
+
+
+def chain_kernel(sfreq, l_freq=None, h_freq=None, notch_freqs=()):
+    """
+    Single zero-phase FIR with the response of the bandpass followed by the notches.
+    """
+    kernel = np.ones(1)
+    if l_freq is not None or h_freq is not None:
+        kernel = bandpass_kernel(sfreq, l_freq, h_freq)
+    if len(notch_freqs):
+        kernel = np.convolve(kernel, notch_kernel(sfreq, notch_freqs))
+    return kernel
+
+
+def _fft_length(n_kernel, n_samples):
+    # Smallest power of two block giving at least 4 x the kernel length of output, bounded by the signal
+    n_fft = 2 ** int(np.ceil(np.log2(4 * n_kernel)))
+    return min(n_fft, next_fast_len(n_samples + n_kernel - 1, True))
+
+
+def _filter_channel(row, kernel, kernel_fft, n_fft):
+    # Odd reflection of the edges like MNE's 'reflect_limited' padding, zeros past the signal length
+    n_kernel = len(kernel)
+    n_pad = (n_kernel - 1) // 2
+    reflect = min(n_pad, len(row) - 1)
+    padded = np.pad(row, reflect, mode='reflect', reflect_type='odd')
+    if reflect < n_pad:
+        padded = np.pad(padded, n_pad - reflect)
+
+    # Overlap-add of n_fft blocks with the kernel spectrum computed once
+    step = n_fft - n_kernel + 1
+    out = np.zeros(len(padded) + n_kernel - 1)
+    for start in range(0, len(padded), step):
+        block = irfft(rfft(padded[start:start + step], n_fft) * kernel_fft, n_fft)
+        stop = min(len(out), start + n_fft)
+        out[start:stop] += block[:stop - start]
+    # The 'valid' part is aligned with the input for an odd symmetric kernel
+    row[:] = out[n_kernel - 1:n_kernel - 1 + len(row)]
+
+
+def apply_kernel(data, kernel, picks=None, n_jobs=None):
+    """
+    Filters the rows of data (all or picks) in place with a zero-phase FIR kernel
+    of odd length using FFT overlap-add, channels in parallel threads (the FFTs release the GIL).
+    """
+    if len(kernel) % 2 == 0:
+        raise ValueError("Zero-phase filtering needs a kernel of odd length.")
+    # Integer indexing gives views, so the rows are filtered in place
+    rows = [data[p] for p in (range(len(data)) if picks is None else picks)]
+    n_fft = _fft_length(len(kernel), data.shape[-1] + len(kernel) - 1)
+    kernel_fft = rfft(kernel, n_fft)
+    n_jobs = n_jobs or min(len(rows), os.cpu_count() or 1)
+    if n_jobs == 1:
+        for row in rows:
+            _filter_channel(row, kernel, kernel_fft, n_fft)
+        return data
+    with ThreadPoolExecutor(max_workers=n_jobs) as executor:
+        # list() re-raises the errors of the workers
+        list(executor.map(lambda row: _filter_channel(row, kernel, kernel_fft, n_fft), rows))
+    return data
+
+
+def filter_chain(raw, l_freq=0.1, h_freq=45, notch_freqs=(50, 60, 100, 120), n_jobs=None):
+    """
+    Bandpass and notch filtering of raw in one pass over the data, matching
+    Raw.filter followed by Raw.notch_filter (firwin) up to their edge effects.
+    """
+    kernel = chain_kernel(raw.info['sfreq'], l_freq, h_freq, list(notch_freqs))
+    picks = mne.pick_types(raw.info, meg=True, eeg=True, seeg=True, ecog=True, dbs=True, fnirs=True, exclude=[])
+    apply_kernel(raw._data, kernel, picks, n_jobs)
+    # Recorded like Raw.filter does, the notches leave the passband edges unchanged
+    with raw.info._unlock():
+        if l_freq is not None and l_freq > raw.info['highpass']:
+            raw.info['highpass'] = float(l_freq)
+        if h_freq is not None and h_freq < raw.info['lowpass']:
+            raw.info['lowpass'] = float(h_freq)
+    return raw
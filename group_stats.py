@@ -0,0 +1,204 @@
+import os
+import sys
+import csv
+import argparse
+import numpy as np
+import features
+from pipeline import BANDS
+
+GROUP_DIR = 'Group'
+LEVELS = ('session', 'interval')
+
+
+class GroupStats:
+    """
+    Running count, mean and variance of feature columns per flag condition
+    (interval label) and channel. Batches are merged with Chan's parallel
+    update of Welford's algorithm, so sessions are added one at a time and
+    never kept in memory; two GroupStats can be merged the same way.
+    """
+    def __init__(self, columns):
+        self.columns = list(columns)
+        self.channels = []
+        self.sessions = {}  # Sessions contributing to each condition
+        self._state = {}  # label -> (n (channels), mean (columns x channels), m2 (columns x channels))
+
+    def _channel_indices(self, channels):
+        for channel in channels:
+            if channel not in self.channels:
+                self.channels.append(channel)
+        # Conditions seen before get room for new channels
+        for label, (n, mean, m2) in self._state.items():
+            missing = len(self.channels) - len(n)
+            if missing:
+                self._state[label] = (np.pad(n, (0, missing)), np.pad(mean, ((0, 0), (0, missing))),
+                                      np.pad(m2, ((0, 0), (0, missing))))
+        return np.array([self.channels.index(channel) for channel in channels])
+
+    def add_batch(self, label, channels, n, mean, m2, session=None):
+        """
+        Merges the statistics of a batch (n per channel, mean and m2 as
+        columns x channels) into the running statistics of label.
+        """
+        indices = self._channel_indices(list(channels))
+        if label not in self._state:
+            size = len(self.channels)
+            self._state[label] = (np.zeros(size), np.zeros((len(self.columns), size)),
+                                  np.zeros((len(self.columns), size)))
+        n_a, mean_a, m2_a = self._state[label]
+        n_b = np.asarray(n, dtype=float)
+        total = n_a[indices] + n_b
+        delta = np.asarray(mean) - mean_a[:, indices]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            weight = np.where(total > 0, n_b / total, 0.0)
+            mean_a[:, indices] += delta * weight
+            m2_a[:, indices] += np.asarray(m2) + delta ** 2 * n_a[indices] * weight
+        n_a[indices] = total
+        if session is not None:
+            self.sessions.setdefault(label, set()).add(session)
+
+    def add_table(self, table, level='session'):
+        """
+        Adds a feature table (features.read_features rows, one session or more).
+        With level 'session' each session contributes its mean per condition and
+        channel as one observation (grand average over subjects); with 'interval'
+        every interval is an observation.
+        """
+        if level not in LEVELS:
+            raise ValueError(f"Unknown level '{level}', expected one of {LEVELS}.")
+        for session in np.unique(table['session']):
+            rows = table[table['session'] == session]
+            for label in np.unique(rows['label']):
+                label_rows = rows[rows['label'] == label]
+                channels, inverse = np.unique(label_rows['channel'], return_inverse=True)
+                counts = np.bincount(inverse, minlength=len(channels)).astype(float)
+                values = np.array([label_rows[column] for column in self.columns])
+                mean = np.array([np.bincount(inverse, weights=column, minlength=len(channels)) for column in values]) / counts
+                if level == 'session':
+                    self.add_batch(str(label), channels, np.ones(len(channels)), mean,
+                                   np.zeros_like(mean), session=str(session))
+                else:
+                    m2 = np.array([np.bincount(inverse, weights=(column - column_mean[inverse]) ** 2,
+                                               minlength=len(channels)) for column, column_mean in zip(values, mean)])
+                    self.add_batch(str(label), channels, counts, mean, m2, session=str(session))
+
+    def merge(self, other):
+        for label in other.labels():
+            result = other.result(label)
+            indices = [other.columns.index(column) for column in self.columns]
+            self.add_batch(label, result['channels'], result['n'], result['mean'][indices], result['m2'][indices])
+            self.sessions.setdefault(label, set()).update(other.sessions.get(label, ()))
+
+    def labels(self):
+        return sorted(self._state)
+
+    def result(self, label):
+        """
+        Statistics of a condition: 'channels', 'n' (per channel), 'mean', 'var'
+        (sample variance), 'sem' and 'm2' as columns x channels arrays, and 'n_sessions'.
+        """
+        n, mean, m2 = self._state[label]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            var = np.where(n > 1, m2 / (n - 1), np.nan)
+            sem = np.sqrt(var / n)
+        return {'channels': list(self.channels), 'n': n.copy(), 'mean': mean.copy(), 'var': var, 'sem': sem,
+                'm2': m2.copy(), 'n_sessions': len(self.sessions.get(label, ()))}
+
+
+def aggregate(paths, labels=None, columns=None, level='session', progress=None):
+    """
+    Streams the feature tables of many sessions (paths or a root folder) into a
+    GroupStats, reading one file at a time and only the needed columns.
+    Columns default to all absolute and relative band powers.
+    """
+    if isinstance(paths, str):
+        paths = features.find_feature_files(paths) if os.path.isdir(paths) else [paths]
+    if columns is None:
+        columns = [name for name in features.feature_dtype().names if name.startswith(('abs_', 'rel_'))]
+    stats = GroupStats(columns)
+    for i, path in enumerate(paths, start=1):
+        stats.add_table(features.read_features([path], labels=labels, columns=['label', 'channel'] + list(columns)),
+                        level)
+        if progress is not None:
+            progress(i, len(paths))
+    return stats
+
+
+def write_group_stats(path, stats):
+    # One row per condition, channel and column
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(['label', 'channel', 'column', 'n', 'n_sessions', 'mean', 'std', 'sem'])
+        for label in stats.labels():
+            result = stats.result(label)
+            for j, channel in enumerate(result['channels']):
+                for i, column in enumerate(stats.columns):
+                    writer.writerow([label, channel, column, int(result['n'][j]), result['n_sessions'],
+                                     result['mean'][i, j], np.sqrt(result['var'][i, j]), result['sem'][i, j]])
+    return path
+
+
+def render_group_topomaps(stats, directory_path, kind='rel', preset='publication', progress=None):
+    """
+    One figure per condition with the group mean topomap of every band of
+    pipeline.BANDS ('rel' or 'abs' powers), written to '<directory>/Group'.
+    Returns the written file names.
+    """
+    # Figures without pyplot, the backend of a running GUI is left alone
+    from matplotlib.figure import Figure
+    import mne
+    from rendering import PRESETS
+    settings = PRESETS[preset]
+    group_path = os.path.join(directory_path, GROUP_DIR)
+    os.makedirs(group_path, exist_ok=True)
+
+    info = mne.create_info(stats.channels, 1.0, 'eeg')
+    info.set_montage('biosemi16')
+    rows = [stats.columns.index(f'{kind}_{features.band_column(band)}') for band in BANDS]
+    written = []
+    labels = stats.labels()
+    for i, label in enumerate(labels, start=1):
+        result = stats.result(label)
+        fig = Figure(figsize=(25, 5))
+        axes = fig.subplots(1, len(BANDS))
+        for ax, band, row in zip(axes, BANDS, rows):
+            mne.viz.plot_topomap(result['mean'][row], info, axes=ax, show=False, cmap='jet')
+            ax.set_title(band, fontsize=10)
+        fig.suptitle(f"{label}: group mean of {'relative' if kind == 'rel' else 'absolute'} band power "
+                     f"({result['n_sessions']} sessions)")
+        name = f'group_{kind}_{label}.{settings["format"]}'
+        fig.savefig(os.path.join(group_path, name), dpi=settings['topomap_dpi'], format=settings['format'])
+        written.append(name)
+        if progress is not None:
+            progress(i, len(labels))
+    return written
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Grand averages of the interval band powers of many sessions per flag condition and channel.")
+    parser.add_argument('root', help="Root folder searched for the feature tables of the sessions")
+    parser.add_argument('--labels', nargs='+', help="Conditions to keep (default: all)")
+    parser.add_argument('--level', choices=LEVELS, default='session',
+                        help="Observation unit: session means (default) or single intervals")
+    parser.add_argument('--kind', choices=['rel', 'abs'], default='rel', help="Band power shown in the topomaps")
+    parser.add_argument('--preset', default='publication', help="Output preset of the figures")
+    parser.add_argument('--out', help=f"Output folder, defaults to the root (figures in <out>/{GROUP_DIR})")
+    args = parser.parse_args(argv)
+
+    paths = features.find_feature_files(args.root)
+    if not paths:
+        print(f"No feature tables found below '{args.root}'.")
+        return 1
+    stats = aggregate(paths, labels=args.labels, level=args.level)
+    out = args.out or args.root
+    csv_path = write_group_stats(os.path.join(out, GROUP_DIR, 'group_stats.csv'), stats)
+    figures = render_group_topomaps(stats, out, kind=args.kind, preset=args.preset)
+    print(f"{len(paths)} session(s), {len(stats.labels())} condition(s): statistics in '{csv_path}', "
+          f"{len(figures)} topomap(s) in '{os.path.join(out, GROUP_DIR)}'.")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
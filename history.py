@@ -0,0 +1,254 @@
+import os
+import shutil
+import tempfile
+import itertools
+import numpy as np
+import mne
+
+# Snapshots kept in memory before the least recently used ones are spilled to disk
+DEFAULT_BUDGET_BYTES = 1024 ** 3
+# Spilled snapshots kept before the least recently used ones are dropped, they are then rebuilt from their parent
+DEFAULT_DISK_BYTES = 10 * 1024 ** 3
+
+
+class Snapshot:
+    """
+    A state of the working signal in the history tree: the step that produced it
+    from its parent and, while kept, a float64 copy of its samples in memory or
+    in a file of the spill directory. A dropped snapshot is rebuilt by replaying its
+    step on the nearest kept ancestor.
+    """
+    def __init__(self, id, parent, step, result=None):
+        self.id = id
+        self.parent = parent
+        self.step = step  # None for the loaded signal
+        self.steps = (parent.steps if parent is not None else []) + ([step] if step is not None else [])
+        self.result = result
+        self.children = []
+        self.redo_child = None  # Child that redo returns to, the last one visited
+        self.data = None
+        self.spill_path = None
+        self.info = None
+        self.annotations = None
+        self.first_samp = 0
+        self.nbytes = 0
+        self.last_used = 0
+
+    @property
+    def kept(self):
+        return self.data is not None or self.spill_path is not None
+
+    def label(self):
+        if self.step is None:
+            return 'load'
+        params = ', '.join(f'{name}={value}' for name, value in self.step.items() if name != 'step')
+        return f"{self.step['step']}({params})"
+
+
+class StepHistory:
+    """
+    Undo/redo history of the processing steps of a session as a tree: applying a
+    step after an undo starts a new branch, the old one stays reachable.
+    Moving in the tree only changes the current node; restore() rebuilds the Raw
+    of a node from its snapshot, which is exactly the signal the step produced.
+    Restoring copies the whole snapshot (steps change the signal in place, the
+    snapshot must stay intact), so undo and redo cost O(samples) time and one
+    signal of extra memory, not constant time. Snapshots above budget_bytes are
+    spilled to disk, above disk_bytes they are dropped and recomputed from the
+    step parameters when needed. The loaded signal is never dropped.
+    """
+    def __init__(self, budget_bytes=DEFAULT_BUDGET_BYTES, disk_bytes=DEFAULT_DISK_BYTES, spill_dir=None):
+        self.budget_bytes = budget_bytes
+        self.disk_bytes = disk_bytes
+        self.spill_dir = spill_dir
+        self._own_spill_dir = spill_dir is None
+        self.nodes = {}
+        self.root = None
+        self.current = None
+        self._ids = itertools.count()
+        self._clock = itertools.count()
+
+    def reset(self, raw, steps=()):
+        """
+        Starts a new history from raw, the signal after steps (the load step and
+        any steps restored with it).
+        """
+        self.clear()
+        node = Snapshot(next(self._ids), None, None)
+        node.steps = [dict(step) for step in steps]
+        self.nodes[node.id] = node
+        self.root = self.current = node
+        self._keep(node, raw)
+        return node
+
+    def push(self, raw, step, result=None):
+        """
+        Records raw as the result of step applied to the current node, which
+        becomes its child. Applying the same step again replaces that child.
+        """
+        parent = self.current
+        node = self.child(step)
+        if node is None:
+            node = Snapshot(next(self._ids), parent, dict(step), result)
+            parent.children.append(node)
+            self.nodes[node.id] = node
+        else:
+            self._discard(node)
+            node.result = result
+        parent.redo_child = node
+        self.current = node
+        self._keep(node, raw)
+        return node
+
+    def child(self, step):
+        # Child of the current node produced by the same step and parameters
+        for node in self.current.children:
+            if node.step == step:
+                return node
+        return None
+
+    def can_undo(self):
+        return self.current is not None and self.current.parent is not None
+
+    def can_redo(self):
+        return self.current is not None and self.current.redo_child is not None
+
+    def undo(self):
+        self.current = self.current.parent
+        return self.current
+
+    def redo(self):
+        self.current = self.current.redo_child
+        return self.current
+
+    def checkout(self, node_id):
+        """
+        Makes any node current, redo then follows the path to it.
+        """
+        node = self.nodes[node_id]
+        child = node
+        while child.parent is not None:
+            child.parent.redo_child = child
+            child = child.parent
+        self.current = node
+        return node
+
+    def restore(self, node=None):
+        """
+        New Raw of a node (the current one by default). Dropped snapshots on the
+        way are recomputed from the nearest kept ancestor and kept again.
+        """
+        node = node or self.current
+        chain = []
+        base = node
+        while not base.kept:
+            chain.append(base)
+            base = base.parent
+        raw = self._raw(base)
+        if chain:
+            import pipeline
+            for missing in reversed(chain):
+                params = dict(missing.step)
+                name = params.pop('step')
+                missing.result = pipeline.STEPS[name](raw, **params)
+                self._keep(missing, raw)
+        self._touch(node)
+        return raw
+
+    def tree(self):
+        """
+        (depth, node) of all nodes, depth first in the order they were created.
+        """
+        if self.root is None:
+            return []
+        ordered = []
+        stack = [(0, self.root)]
+        while stack:
+            depth, node = stack.pop()
+            ordered.append((depth, node))
+            stack.extend((depth + 1, child) for child in reversed(node.children))
+        return ordered
+
+    def usage(self):
+        nodes = list(self.nodes.values())
+        return {
+            'nodes': len(nodes),
+            'memory_bytes': sum(node.nbytes for node in nodes if node.data is not None),
+            'disk_bytes': sum(node.nbytes for node in nodes if node.spill_path is not None),
+            'dropped': sum(1 for node in nodes if not node.kept),
+        }
+
+    def set_budget(self, budget_bytes=None, disk_bytes=None):
+        if budget_bytes is not None:
+            self.budget_bytes = budget_bytes
+        if disk_bytes is not None:
+            self.disk_bytes = disk_bytes
+        self._enforce_budget()
+
+    def clear(self):
+        for node in self.nodes.values():
+            self._discard(node)
+        self.nodes = {}
+        self.root = self.current = None
+
+    def close(self):
+        self.clear()
+        if self._own_spill_dir and self.spill_dir is not None:
+            shutil.rmtree(self.spill_dir, ignore_errors=True)
+            self.spill_dir = None
+
+    def _touch(self, node):
+        node.last_used = next(self._clock)
+
+    def _keep(self, node, raw):
+        # Full precision, undo and redo give back the same samples
+        node.data = raw._data.copy()
+        node.data.flags.writeable = False
+        node.info = raw.info.copy()
+        node.annotations = raw.annotations.copy()
+        node.first_samp = raw.first_samp
+        node.nbytes = node.data.nbytes
+        self._touch(node)
+        self._enforce_budget()
+
+    def _raw(self, node):
+        data = node.data if node.data is not None else np.load(node.spill_path, mmap_mode='r')
+        raw = mne.io.RawArray(np.array(data, dtype=np.float64), node.info.copy(), first_samp=node.first_samp,
+                              verbose=False)
+        raw.set_annotations(node.annotations.copy())
+        return raw
+
+    def _discard(self, node):
+        node.data = None
+        if node.spill_path is not None and os.path.exists(node.spill_path):
+            os.remove(node.spill_path)
+        node.spill_path = None
+
+    def _spill(self, node):
+        if self.spill_dir is None:
+            self.spill_dir = tempfile.mkdtemp(prefix='eeg_history_')
+        os.makedirs(self.spill_dir, exist_ok=True)
+        path = os.path.join(self.spill_dir, f'{node.id}.npy')
+        np.save(path, node.data)
+        node.spill_path = path
+        node.data = None
+
+    def _enforce_budget(self):
+        usage = self.usage()
+        memory, disk = usage['memory_bytes'], usage['disk_bytes']
+        # The current node stays in memory, undo and redo are the likely next moves
+        in_memory = sorted((node for node in self.nodes.values() if node.data is not None and node is not self.current),
+                           key=lambda node: node.last_used)
+        for node in in_memory:
+            if memory <= self.budget_bytes:
+                break
+            self._spill(node)
+            memory -= node.nbytes
+            disk += node.nbytes
+        spilled = sorted((node for node in self.nodes.values() if node.spill_path is not None and node is not self.root),
+                         key=lambda node: node.last_used)
+        for node in spilled:
+            if disk <= self.disk_bytes:
+                break
+            self._discard(node)
+            disk -= node.nbytes
@@ -0,0 +1,132 @@
+import os
+import json
+import hashlib
+import warnings
+import numpy as np
+import mne
+from mne.preprocessing import ICA, read_ica
+from pipeline_cache import DEFAULT_CACHE_DIR, file_fingerprint
+
+DEFAULT_ICA_DIR = os.path.join(DEFAULT_CACHE_DIR, 'ica')
+
+# Fitting data defaults: segments of the recording, decimated and high-passed
+FIT_SFREQ = 256.0
+HIGHPASS = 1.0
+SEGMENT_SECONDS = 10.0
+MAX_SEGMENTS = 60
+
+
+def _bad_mask(raw):
+    # True for samples inside 'bad' annotations
+    mask = np.zeros(raw.n_times, dtype=bool)
+    for annotation in raw.annotations:
+        if not annotation['description'].lower().startswith('bad'):
+            continue
+        onset = raw.time_as_index(annotation['onset'], use_rounding=True, origin=raw.annotations.orig_time)[0]
+        stop = onset + int(round(annotation['duration'] * raw.info['sfreq']))
+        mask[max(0, onset):max(0, stop)] = True
+    return mask
+
+
+def fit_data(raw, fit_sfreq=FIT_SFREQ, highpass=HIGHPASS, segment_seconds=SEGMENT_SECONDS,
+             max_segments=MAX_SEGMENTS):
+    """
+    Returns the (segments x channels x times) array the ICA is fitted on and its sampling rate:
+    up to max_segments evenly spaced segments free of bad annotations, decimated to about fit_sfreq.
+    Decimating keeps the instantaneous mixing of the channels, which is all the ICA estimates.
+    The high-pass is applied later, per segment, by fit_ica.
+    """
+    sfreq = raw.info['sfreq']
+    decim = max(1, int(sfreq // fit_sfreq))
+    segment_samples = min(raw.n_times, int(round(segment_seconds * sfreq)))
+
+    starts = np.arange(0, raw.n_times - segment_samples + 1, segment_samples)
+    bad = np.concatenate([[0], np.cumsum(_bad_mask(raw))])
+    starts = starts[bad[starts + segment_samples] == bad[starts]]
+    if len(starts) == 0:
+        raise ValueError("No segment free of bad annotations is long enough to fit the ICA.")
+    if len(starts) > max_segments:
+        starts = starts[np.linspace(0, len(starts) - 1, max_segments).round().astype(int)]
+
+    data = np.stack([raw._data[:, start:start + segment_samples:decim] for start in starts])
+    return data, sfreq / decim
+
+
+def _fit_key(data, ch_names, params):
+    digest = hashlib.sha1(np.ascontiguousarray(data).tobytes())
+    digest.update(json.dumps([ch_names, params], sort_keys=True, default=str).encode())
+    return digest.hexdigest()
+
+
+def _sensor_unmixing(ica):
+    # Unmixing of the pre-whitened sensor data into the sources, (components x channels)
+    return ica.unmixing_matrix_ @ ica.pca_components_[:ica.n_components_]
+
+
+def warm_start_matrix(previous, whitening):
+    """
+    Initial FastICA unmixing in the PCA space of a new fit, from a previously fitted ICA
+    over the same channels. whitening is an ICA fitted on the new data (any number of
+    iterations), only its pre-whitener and PCA are used.
+    """
+    if previous.ch_names != whitening.ch_names or previous.n_components_ != whitening.n_components_:
+        raise ValueError("The warm start model was fitted on other channels or with another number of components.")
+    n_components = whitening.n_components_
+    # Sources of the previous model expressed from the new pre-whitened data, then in the new PCA space
+    unmixing = _sensor_unmixing(previous) * (whitening.pre_whitener_ / previous.pre_whitener_).T
+    w_init = unmixing @ whitening.pca_components_[:n_components].T
+    w_init *= np.sqrt(whitening.pca_explained_variance_[:n_components])
+    return w_init / np.linalg.norm(w_init, axis=1, keepdims=True)
+
+
+def fit_ica(raw, n_components=15, random_state=97, max_iter=800, fit_sfreq=FIT_SFREQ, highpass=HIGHPASS,
+            segment_seconds=SEGMENT_SECONDS, max_segments=MAX_SEGMENTS, warm_start=None,
+            cache_dir=DEFAULT_ICA_DIR, progress=None):
+    """
+    Fits a FastICA on a decimated, high-passed subsample of raw (see fit_data).
+    Fitted models are cached in cache_dir by the fitting data and the parameters.
+    warm_start is a fitted ICA or the path of a saved one (e.g. the model-ica.fif
+    of a previous session of the same subject) used as the starting unmixing matrix.
+    Returns (ica, from_cache).
+    """
+    data, sfreq = fit_data(raw, fit_sfreq, highpass, segment_seconds, max_segments)
+    if isinstance(warm_start, str):
+        warm_start_id = file_fingerprint(warm_start)
+        warm_start = read_ica(warm_start, verbose=False)
+    else:
+        warm_start_id = _fit_key(warm_start.unmixing_matrix_, warm_start.ch_names, []) if warm_start else None
+    params = dict(n_components=n_components, random_state=random_state, max_iter=max_iter, sfreq=sfreq,
+                  highpass=highpass, warm_start=warm_start_id)
+    key = _fit_key(data, raw.ch_names, params)
+    path = os.path.join(cache_dir, f'{key}-ica.fif')
+    if os.path.exists(path):
+        return read_ica(path, verbose=False), True
+
+    # Segments are filtered one by one so the gaps between them do not ring
+    info = mne.create_info(raw.ch_names, sfreq, raw.get_channel_types())
+    if raw.get_montage() is not None:
+        info.set_montage(raw.get_montage())
+    epochs = mne.EpochsArray(data, info, verbose=False)
+    epochs.filter(highpass, None, verbose=False)
+    if progress is not None:
+        progress(20)
+
+    fit_params = {}
+    if warm_start is not None:
+        # A single iteration gives the pre-whitener and PCA basis of this data
+        whitening = ICA(n_components=n_components, random_state=random_state, max_iter=1)
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            whitening.fit(epochs, verbose=False)
+        fit_params['w_init'] = warm_start_matrix(warm_start, whitening)
+
+    ica = ICA(n_components=n_components, random_state=random_state, max_iter=max_iter, fit_params=fit_params)
+    ica.fit(epochs, verbose=False)
+    if progress is not None:
+        progress(70)
+
+    # The starting matrix is not needed afterwards and cannot be saved with the model
+    ica.fit_params.pop('w_init', None)
+    os.makedirs(cache_dir, exist_ok=True)
+    ica.save(path, overwrite=True, verbose=False)
+    return ica, False
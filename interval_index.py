@@ -0,0 +1,123 @@
+from collections import namedtuple
+import numpy as np
+import utils
+
+# Same first four fields as the tuples of utils.extract_flag_intervals, plus the sample range [start_sample, stop_sample)
+Interval = namedtuple('Interval', ['start', 'end', 'start_flag', 'end_flag', 'start_sample', 'stop_sample'])
+
+
+class IntervalIndex:
+    """
+    The flag intervals of a session converted once into sample ranges of the
+    working signal (time 0 is the first sample, the last sample of an interval
+    is included like in Raw.crop). Iterating gives Interval tuples that can be
+    used wherever the (start, end, start_flag, end_flag) tuples were used.
+    Lookups by label, time and overlap work on the arrays, and data() returns
+    views of the signal instead of cropped copies.
+    """
+    def __init__(self, intervals, sfreq, n_times):
+        table = np.array([tuple(interval)[:4] for interval in intervals], dtype=utils.INTERVAL_DTYPE)
+        self.sfreq = sfreq
+        self.n_times = n_times
+        self.starts = table['start']
+        self.ends = table['end']
+        self.start_flags = table['start_flag']
+        self.end_flags = table['end_flag']
+        # Clipped to the signal, an interval past its end keeps an empty range
+        self.start_samples = np.clip(np.round(self.starts * sfreq).astype(np.int64), 0, n_times)
+        self.stop_samples = np.clip(np.round(self.ends * sfreq).astype(np.int64) + 1, self.start_samples, n_times)
+        self._positions = {}
+        for i, key in enumerate(zip(self.starts.tolist(), self.ends.tolist(), self.start_flags.tolist(),
+                                    self.end_flags.tolist())):
+            self._positions.setdefault(key, i)
+
+    @classmethod
+    def from_raw(cls, intervals, raw):
+        return cls(intervals, raw.info['sfreq'], raw.n_times)
+
+    def __len__(self):
+        return len(self.starts)
+
+    def __getitem__(self, i):
+        return Interval(float(self.starts[i]), float(self.ends[i]), str(self.start_flags[i]), str(self.end_flags[i]),
+                        int(self.start_samples[i]), int(self.stop_samples[i]))
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+    def tolist(self):
+        return list(self)
+
+    def labels(self):
+        return sorted(set(self.start_flags.tolist()))
+
+    def positions(self, labels=None, end_flags=None):
+        """
+        Positions of the intervals opened by one of labels (and closed by one of end_flags).
+        """
+        mask = np.ones(len(self), dtype=bool)
+        if labels is not None:
+            mask &= np.isin(self.start_flags, [labels] if isinstance(labels, str) else list(labels))
+        if end_flags is not None:
+            mask &= np.isin(self.end_flags, [end_flags] if isinstance(end_flags, str) else list(end_flags))
+        return np.flatnonzero(mask)
+
+    def select(self, labels=None, end_flags=None):
+        # e.g. index.select('F6') for all the intervals of type F6
+        return [self[i] for i in self.positions(labels, end_flags)]
+
+    def find(self, start, end, start_flag, end_flag):
+        """
+        Interval with exactly these times and flags, None when there is none.
+        """
+        i = self._positions.get((start, end, start_flag, end_flag))
+        return None if i is None else self[i]
+
+    def at(self, time):
+        # Intervals containing a time in seconds
+        return [self[i] for i in np.flatnonzero((self.starts <= time) & (self.ends >= time))]
+
+    def overlapping(self, tmin, tmax):
+        # Intervals sharing part of [tmin, tmax] (seconds)
+        return [self[i] for i in np.flatnonzero((self.starts <= tmax) & (self.ends >= tmin))]
+
+    def overlaps(self):
+        """
+        Pairs of positions (i, j), i < j, of intervals overlapping each other (not only touching).
+        Intervals are sorted by start, so each one is only compared with the following ones.
+        """
+        order = np.argsort(self.starts, kind='stable')
+        pairs = []
+        for k, i in enumerate(order):
+            for j in order[k + 1:]:
+                if self.starts[j] >= self.ends[i]:
+                    break
+                pairs.append((int(min(i, j)), int(max(i, j))))
+        return pairs
+
+    def data(self, signal, interval):
+        """
+        View (no copy) of the samples of an interval in signal, a Raw or a (channels x samples) array.
+        """
+        array = signal._data if hasattr(signal, '_data') else signal
+        return array[..., interval.start_sample:interval.stop_sample]
+
+    def views(self, signal, labels=None):
+        # (interval, view of its samples) of all or some labels
+        for i in self.positions(labels):
+            interval = self[i]
+            yield interval, self.data(signal, interval)
+
+    def events(self, first_samp=0, labels=None):
+        """
+        MNE events array (sample, 0, id) at the start of the intervals and the
+        event_id of the labels, for mne.Epochs(raw, events, event_id, ...).
+        first_samp is raw.first_samp when the events are used with the Raw.
+        """
+        positions = self.positions(labels)
+        event_id = {label: i + 1 for i, label in enumerate(self.labels())}
+        events = np.zeros((len(positions), 3), dtype=np.int64)
+        events[:, 0] = self.start_samples[positions] + first_samp
+        events[:, 2] = [event_id[label] for label in self.start_flags[positions]]
+        used = set(self.start_flags[positions].tolist())
+        return events, {label: value for label, value in event_id.items() if label in used}
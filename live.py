@@ -0,0 +1,299 @@
+import json
+import time
+import socket
+import struct
+import threading
+from collections import deque
+import numpy as np
+import pywt
+from scipy.signal import butter, iirnotch, tf2sos, sosfilt, sosfilt_zi, get_window
+import utils
+from pipeline import BANDS
+
+# Messages of the TCP stream: 4-byte big-endian header length, json header, payload.
+#   {'type': 'info', 'sfreq': float, 'ch_names': [...]}             once, first
+#   {'type': 'data', 'first_sample': int, 'n_channels': int, 'n_samples': int, 'sent_time': float}
+#       + float32 (n_channels x n_samples) payload in C order, 'sent_time' is the source wall clock
+#   {'type': 'flag', 'flag': 'F3', 'sample': int}                   keypress at a sample of the stream
+#   {'type': 'end'}
+HEADER = struct.Struct('!I')
+DEFAULT_ADDRESS = ('127.0.0.1', 5555)
+
+
+def send_message(sock, header, payload=b''):
+    encoded = json.dumps(header).encode()
+    sock.sendall(HEADER.pack(len(encoded)) + encoded + payload)
+
+
+def _recv_exact(sock, size):
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    received = 0
+    while received < size:
+        n = sock.recv_into(view[received:], size - received)
+        if n == 0:
+            return None
+        received += n
+    return buffer
+
+
+def recv_message(sock):
+    """
+    Returns (header, payload) of the next message, payload is None unless it is a data block,
+    or None once the source closed the connection.
+    """
+    raw_length = _recv_exact(sock, HEADER.size)
+    if raw_length is None:
+        return None
+    header = json.loads(bytes(_recv_exact(sock, HEADER.unpack(raw_length)[0])))
+    payload = None
+    if header['type'] == 'data':
+        payload = _recv_exact(sock, 4 * header['n_channels'] * header['n_samples'])
+        payload = np.frombuffer(payload, dtype=np.float32).reshape(header['n_channels'], header['n_samples'])
+    return header, payload
+
+
+class RingBuffer:
+    """
+    Last capacity samples of every channel, preallocated and overwritten in place.
+    """
+    def __init__(self, n_channels, capacity):
+        self.data = np.zeros((n_channels, capacity))
+        self.capacity = capacity
+        self.n_written = 0
+
+    def write(self, block):
+        n = block.shape[1]
+        if n >= self.capacity:
+            self.data[:] = block[:, -self.capacity:]
+            self.n_written += n
+            return
+        position = self.n_written % self.capacity
+        first = min(n, self.capacity - position)
+        self.data[:, position:position + first] = block[:, :first]
+        self.data[:, :n - first] = block[:, first:]
+        self.n_written += n
+
+    def latest(self, n):
+        """
+        Copy of the last n samples (at most what was written and the capacity), oldest first.
+        """
+        n = min(n, self.n_written, self.capacity)
+        end = self.n_written % self.capacity
+        if end >= n:
+            return self.data[:, end - n:end].copy()
+        return np.concatenate([self.data[:, self.capacity - (n - end):], self.data[:, :end]], axis=1)
+
+
+class CausalFilterChain:
+    """
+    Bandpass (Butterworth) and notch filters as one second-order-sections cascade
+    whose state is kept between blocks, so every sample is filtered once, causally.
+    """
+    def __init__(self, sfreq, l_freq=0.1, h_freq=45, notch_freqs=(50, 60, 100, 120), order=4):
+        sections = [butter(order, [l_freq, h_freq], btype='bandpass', fs=sfreq, output='sos')]
+        for freq in notch_freqs:
+            # Notches above the bandpass are already attenuated, and at or above Nyquist impossible
+            if freq < sfreq / 2:
+                sections.append(tf2sos(*iirnotch(freq, Q=30, fs=sfreq)))
+        self.sos = np.concatenate(sections)
+        # Steady state for a zero input, scaled by the first samples when they arrive
+        self.zi = None
+        self._zi_unit = sosfilt_zi(self.sos)[:, np.newaxis, :]
+
+    def process(self, block):
+        if self.zi is None:
+            self.zi = self._zi_unit * block[:, 0][np.newaxis, :, np.newaxis]
+        filtered, self.zi = sosfilt(self.sos, block, axis=-1, zi=self.zi)
+        return filtered
+
+
+class TrailingWaveletDenoiser:
+    """
+    Wavelet denoising of the newest samples using a trailing window of the
+    filtered signal as context, nothing after the newest sample is used.
+    """
+    def __init__(self, wavelet='sym4', level=5, adaptive_threshold=True, threshold=None, context=4096):
+        self.wavelet = wavelet
+        self.level = level
+        self.adaptive_threshold = adaptive_threshold
+        self.threshold = threshold
+        self.context = context
+
+    def process(self, ring, n_new):
+        window = ring.latest(self.context + n_new)
+        # Fewer levels while the buffer still holds less than the context
+        level = min(self.level, pywt.dwt_max_level(window.shape[1], self.wavelet))
+        if level == 0:
+            return window[:, -n_new:]
+        denoised = utils.wavelet_denoising_batch(window, wavelet=self.wavelet, adaptive_threshold=self.adaptive_threshold,
+                                                 level=level, threshold=self.threshold)
+        # waverec can return one extra sample for odd lengths
+        return denoised[:, :window.shape[1]][:, -n_new:]
+
+
+class LiveBandPowers:
+    """
+    Band powers of the current interval, updated segment by segment.
+
+    The signal is cut into non-overlapping n_fft segments (Hamming window, mean
+    removed, like spectra.IntervalSpectra) and every segment adds its band powers
+    to the interval opened by the last flag. A flag closes the interval; segments
+    already counted that start after its sample (the flag arrived late) move to
+    the new interval and segments straddling it are dropped.
+    """
+    def __init__(self, sfreq, n_channels, n_fft=None, bands=BANDS, history=64):
+        # One second segments by default, the 2048 of IntervalSpectra at 2048 Hz
+        n_fft = n_fft or int(round(sfreq))
+        self.sfreq = sfreq
+        self.n_fft = n_fft
+        self.bands = bands
+        self.window = get_window('hamming', n_fft)
+        freqs = np.fft.rfftfreq(n_fft, 1 / sfreq)
+        scale = np.full(len(freqs), 2.0 / (sfreq * np.sum(self.window ** 2)))
+        scale[0] /= 2
+        if n_fft % 2 == 0:
+            scale[-1] /= 2
+        self.scale = scale
+        self.band_masks = [(freqs >= fmin) & (freqs <= fmax) for fmin, fmax in bands.values()]
+
+        self.pending = np.zeros((n_channels, 0))
+        self.next_start = 0  # Stream sample of the first pending sample
+        self.recent = deque(maxlen=history)  # (start sample, band powers) of the last segments
+        self.flag = None
+        self.flag_sample = 0
+        self.total = np.zeros((len(bands), n_channels))
+        self.count = 0
+
+    def _segment_powers(self, segment):
+        segment = (segment - segment.mean(axis=-1, keepdims=True)) * self.window
+        psd = np.abs(np.fft.rfft(segment, axis=-1)) ** 2 * self.scale
+        return np.array([psd[:, mask].mean(axis=1) for mask in self.band_masks])
+
+    def add(self, block):
+        """
+        Adds newly processed samples, returns True when the interval got new segments.
+        """
+        self.pending = np.concatenate([self.pending, block], axis=1)
+        added = False
+        while self.pending.shape[1] >= self.n_fft:
+            powers = self._segment_powers(self.pending[:, :self.n_fft])
+            self.recent.append((self.next_start, powers))
+            if self.next_start >= self.flag_sample:
+                self.total += powers
+                self.count += 1
+                added = True
+            self.pending = self.pending[:, self.n_fft:]
+            self.next_start += self.n_fft
+        return added
+
+    def current(self):
+        # Mean band powers (bands x channels) of the open interval, None before its first segment
+        return self.total / self.count if self.count else None
+
+    def on_flag(self, flag, sample):
+        """
+        Starts a new interval at the flag, returns (label, band powers, n_segments) of the
+        interval it closes or None when the flag pair does not delimit one.
+        """
+        closed = None
+        late = [(start, powers) for start, powers in self.recent if start + self.n_fft > sample]
+        for start, powers in late:
+            if start >= self.flag_sample:
+                self.total -= powers
+                self.count -= 1
+        if self.flag is not None and (self.flag, flag) not in utils.SKIPPED_PAIRS and self.count:
+            closed = (self.flag, self.total / self.count, self.count)
+
+        self.flag = flag
+        self.flag_sample = sample
+        self.total = np.zeros_like(self.total)
+        self.count = 0
+        for start, powers in late:
+            if start >= sample:
+                self.total += powers
+                self.count += 1
+        return closed
+
+
+class LiveSession(threading.Thread):
+    """
+    Reads EEG blocks from a socket source and processes them causally as they arrive:
+    filter chain, trailing wavelet denoising in a ring buffer and band powers of
+    the interval opened by the last keypress flag.
+    Results are passed to callbacks from this thread:
+      on_info(sfreq, ch_names), on_block(latency_seconds, n_samples, stream_seconds),
+      on_powers(label, powers, n_segments, closed), on_flag(flag, stream_seconds),
+      on_error(message), on_end().
+    """
+    def __init__(self, address=DEFAULT_ADDRESS, l_freq=0.1, h_freq=45, notch_freqs=(50, 60, 100, 120),
+                 wavelet='sym4', level=5, buffer_seconds=30, callbacks=None):
+        super().__init__(daemon=True)
+        self.address = address
+        self.filter_params = dict(l_freq=l_freq, h_freq=h_freq, notch_freqs=notch_freqs)
+        self.wavelet_params = dict(wavelet=wavelet, level=level)
+        self.buffer_seconds = buffer_seconds
+        self.callbacks = callbacks or {}
+        self._stop_event = threading.Event()
+        self.sock = None
+
+    def _call(self, name, *args):
+        callback = self.callbacks.get(name)
+        if callback is not None:
+            callback(*args)
+
+    def stop(self):
+        self._stop_event.set()
+        if self.sock is not None:
+            # Unblocks the pending recv
+            try:
+                self.sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def run(self):
+        try:
+            self.sock = socket.create_connection(self.address, timeout=10)
+            self.sock.settimeout(None)
+            self._process()
+        except Exception as e:
+            if not self._stop_event.is_set():
+                self._call('on_error', str(e))
+        finally:
+            if self.sock is not None:
+                self.sock.close()
+            self._call('on_end')
+
+    def _process(self):
+        message = recv_message(self.sock)
+        if message is None or message[0]['type'] != 'info':
+            raise ValueError("The source did not start with an info message.")
+        sfreq = message[0]['sfreq']
+        ch_names = message[0]['ch_names']
+        self._call('on_info', sfreq, ch_names)
+
+        filter_chain = CausalFilterChain(sfreq, **self.filter_params)
+        ring = RingBuffer(len(ch_names), int(self.buffer_seconds * sfreq))
+        denoiser = TrailingWaveletDenoiser(**self.wavelet_params)
+        powers = LiveBandPowers(sfreq, len(ch_names))
+
+        while not self._stop_event.is_set():
+            message = recv_message(self.sock)
+            if message is None:
+                break
+            header, block = message
+            if header['type'] == 'end':
+                break
+            if header['type'] == 'flag':
+                closed = powers.on_flag(header['flag'], header['sample'])
+                self._call('on_flag', header['flag'], header['sample'] / sfreq)
+                if closed is not None:
+                    self._call('on_powers', closed[0], closed[1], closed[2], True)
+                continue
+
+            ring.write(filter_chain.process(block.astype(np.float64)))
+            denoised = denoiser.process(ring, block.shape[1])
+            if powers.add(denoised):
+                self._call('on_powers', powers.flag, powers.current(), powers.count, False)
+            # Source clock to processed result, both on this machine for the local stand-in
+            self._call('on_block', time.time() - header['sent_time'], block.shape[1], ring.n_written / sfreq)
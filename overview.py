@@ -0,0 +1,187 @@
+import numpy as np
+from PyQt5.QtWidgets import QApplication, QWidget, QVBoxLayout, QHBoxLayout, QPushButton, QScrollBar, QLabel
+from PyQt5.QtCore import Qt, QEventLoop
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg
+
+# Samples per bin of the first level and ratio between successive levels
+BASE_BIN = 16
+LEVEL_FACTOR = 4
+# The coarsest level has at most this many bins
+MIN_BINS = 1024
+# Samples reduced at once when building the first level, a multiple of BASE_BIN
+BLOCK_SAMPLES = 2 ** 20
+
+
+def _reduce(mins, maxs, factor):
+    # Min and max of consecutive groups of factor columns, the last group may be shorter
+    idx = np.arange(0, mins.shape[1], factor)
+    return np.minimum.reduceat(mins, idx, axis=1), np.maximum.reduceat(maxs, idx, axis=1)
+
+
+class MinMaxPyramid:
+    """
+    Min/max envelopes of a recording at bin sizes BASE_BIN * LEVEL_FACTOR**k,
+    so any time window can be drawn from about as many points as there are pixels.
+    Level 0 is a float32 copy of the signal taken when the pyramid is built, so
+    steps changing the signal in place do not alter what is drawn; the other
+    levels are float32 as well.
+    """
+    def __init__(self, raw):
+        self.data = raw._data.astype(np.float32)
+        self.sfreq = raw.info['sfreq']
+        self.ch_names = list(raw.ch_names)
+        self.n_times = self.data.shape[1]
+
+        mins = []
+        maxs = []
+        for start in range(0, self.n_times, BLOCK_SAMPLES):
+            block = self.data[:, start:start + BLOCK_SAMPLES]
+            block_mins, block_maxs = _reduce(block, block, BASE_BIN)
+            mins.append(block_mins.astype(np.float32))
+            maxs.append(block_maxs.astype(np.float32))
+        self.levels = [(1, None, None)]
+        bin_size = BASE_BIN
+        mins, maxs = np.concatenate(mins, axis=1), np.concatenate(maxs, axis=1)
+        self.levels.append((bin_size, mins, maxs))
+        while mins.shape[1] > MIN_BINS:
+            mins, maxs = _reduce(mins, maxs, LEVEL_FACTOR)
+            bin_size *= LEVEL_FACTOR
+            self.levels.append((bin_size, mins, maxs))
+
+        # Typical peak-to-peak of the channels over BASE_BIN samples, used to space the traces
+        _, mins, maxs = self.levels[1]
+        self.amplitude = float(np.median(maxs - mins)) or 1.0
+
+    @property
+    def duration(self):
+        return self.n_times / self.sfreq
+
+    def window(self, tmin, tmax, max_points=2000):
+        """
+        Returns (times, mins, maxs) of [tmin, tmax) seconds from the finest level
+        giving at most max_points per channel. At level 0 mins and maxs are the samples.
+        """
+        start = max(0, int(tmin * self.sfreq))
+        stop = min(self.n_times, int(np.ceil(tmax * self.sfreq)))
+        for bin_size, mins, maxs in self.levels:
+            if (stop - start) / bin_size <= max_points or bin_size == self.levels[-1][0]:
+                break
+        if bin_size == 1:
+            data = self.data[:, start:stop]
+            return np.arange(start, stop) / self.sfreq, data, data
+        first, last = start // bin_size, -(-stop // bin_size)
+        return np.arange(first, last) * bin_size / self.sfreq, mins[:, first:last], maxs[:, first:last]
+
+
+class OverviewViewer(QWidget):
+    """
+    Embedded, non-blocking browser of a MinMaxPyramid: channels stacked,
+    panned with the scroll bar or the mouse wheel, zoomed with the buttons.
+    """
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.pyramid = None
+        self.span = 10.0  # Seconds shown
+        self.gain = 1.0
+        self.lines = []
+
+        self.figure = Figure(figsize=(6, 3), tight_layout=True)
+        self.canvas = FigureCanvasQTAgg(self.figure)
+        self.ax = self.figure.add_subplot(111)
+        self.ax.set_xlabel('Time (s)')
+        self.canvas.mpl_connect('scroll_event', self.on_scroll)
+
+        # Scroll bar in milliseconds
+        self.scrollbar = QScrollBar(Qt.Horizontal, self)
+        self.scrollbar.valueChanged.connect(self.redraw)
+
+        controls = QHBoxLayout()
+        for text, handler in [('Zoom In', lambda: self.zoom(0.5)), ('Zoom Out', lambda: self.zoom(2.0)),
+                              ('Amplitude +', lambda: self.scale(2.0)), ('Amplitude -', lambda: self.scale(0.5))]:
+            button = QPushButton(text, self)
+            button.clicked.connect(handler)
+            controls.addWidget(button)
+        self.position_label = QLabel('No data', self)
+        controls.addWidget(self.position_label)
+        controls.addStretch()
+
+        layout = QVBoxLayout()
+        layout.setContentsMargins(0, 0, 0, 0)
+        layout.addWidget(self.canvas, 1)
+        layout.addWidget(self.scrollbar)
+        layout.addLayout(controls)
+        self.setLayout(layout)
+
+    def set_pyramid(self, pyramid):
+        """
+        Shows a new pyramid, keeping the current position and zoom when possible.
+        """
+        self.pyramid = pyramid
+        self.ax.clear()
+        self.ax.set_xlabel('Time (s)')
+        n_channels = len(pyramid.ch_names)
+        # Antialiasing the dense min-max strokes costs most of the drawing time
+        self.lines = [self.ax.plot([], [], color='k', linewidth=0.5, antialiased=False)[0] for _ in range(n_channels)]
+        self.ax.set_yticks(-np.arange(n_channels))
+        self.ax.set_yticklabels(pyramid.ch_names)
+        self.ax.set_ylim(-n_channels, 1)
+        self.span = min(self.span, pyramid.duration)
+        self.scrollbar.setMaximum(max(0, int((pyramid.duration - self.span) * 1000)))
+        self.scrollbar.setPageStep(int(self.span * 1000))
+        self.redraw()
+
+    def zoom(self, factor):
+        if self.pyramid is None:
+            return
+        center = self.scrollbar.value() / 1000 + self.span / 2
+        self.span = min(max(self.span * factor, 10 / self.pyramid.sfreq), self.pyramid.duration)
+        self.scrollbar.setMaximum(max(0, int((self.pyramid.duration - self.span) * 1000)))
+        self.scrollbar.setPageStep(int(self.span * 1000))
+        self.scrollbar.setValue(int(max(0.0, center - self.span / 2) * 1000))
+        self.redraw()
+
+    def scale(self, factor):
+        self.gain *= factor
+        self.redraw()
+
+    def on_scroll(self, event):
+        step = int(self.span * 100) * (-1 if event.button == 'up' else 1)
+        self.scrollbar.setValue(self.scrollbar.value() + step)
+
+    def redraw(self, *args):
+        if self.pyramid is None:
+            return
+        tmin = self.scrollbar.value() / 1000
+        tmax = tmin + self.span
+        width = max(200, self.canvas.width())
+        times, mins, maxs = self.pyramid.window(tmin, tmax, max_points=width)
+        # Vertical min-max strokes joined into one line per channel
+        x = np.repeat(times, 2)
+        unit = self.gain / (2 * self.pyramid.amplitude)
+        for i, line in enumerate(self.lines):
+            y = np.empty(2 * len(times))
+            y[0::2] = mins[i]
+            y[1::2] = maxs[i]
+            line.set_data(x, y * unit - i)
+        self.ax.set_xlim(tmin, tmax)
+        self.position_label.setText(f"{tmin:.1f}-{tmax:.1f} s of {self.pyramid.duration:.1f} s")
+        self.canvas.draw_idle()
+
+
+def browse(raw, title='Signal Overview'):
+    """
+    Opens the overview of raw in its own window and waits until it is closed,
+    for scripts that used raw.plot(block=True). The script creates the QApplication.
+    """
+    if QApplication.instance() is None:
+        raise RuntimeError("overview.browse needs a QApplication, create one before browsing.")
+    viewer = OverviewViewer()
+    viewer.setWindowTitle(title)
+    viewer.resize(1200, 600)
+    viewer.set_pyramid(MinMaxPyramid(raw))
+    viewer.setAttribute(Qt.WA_DeleteOnClose)
+    loop = QEventLoop()
+    viewer.destroyed.connect(loop.quit)
+    viewer.show()
+    loop.exec_()
@@ -0,0 +1,123 @@
+import numpy as np
+import utils
+import artifacts
+import filters
+import ica_service
+
+# Frequency bands shown in the topomaps
+BANDS = {
+    'Delta (0.1-3.9 Hz)': (0.1, 3.9),
+    'Theta (4-7.9 Hz)': (4, 7.9),
+    'Alpha (8-12.9 Hz)': (8, 12.9),
+    'Beta (13-29.9 Hz)': (13, 29.9),
+    'Low Gamma (30-59.9 Hz)': (30, 59.9),
+    'High Gamma (60-100 Hz)': (60, 100)
+}
+
+
+def _no_progress(done, total=100):
+    pass
+
+
+def fir_filter(raw, l_freq=0.1, h_freq=45, progress=_no_progress):
+    raw.filter(l_freq, h_freq, fir_design='firwin')
+
+
+def notch_filter(raw, freqs=(50, 60, 100, 120), progress=_no_progress):
+    raw.notch_filter(freqs=list(freqs), fir_design='firwin')
+
+
+def filter_chain(raw, l_freq=0.1, h_freq=45, notch_freqs=(50, 60, 100, 120), n_jobs=None,
+                 progress=_no_progress):
+    # fir_filter followed by notch_filter as a single FIR applied in one pass
+    filters.filter_chain(raw, l_freq, h_freq, notch_freqs, n_jobs=n_jobs)
+
+
+def wavelet_denoising(raw, wavelet='sym4', adaptive_threshold=True, level=5, threshold=None, n_jobs=1,
+                      progress=_no_progress):
+    denoised_data = utils.wavelet_denoising_batch(
+        raw._data, wavelet=wavelet, adaptive_threshold=adaptive_threshold, level=level,
+        threshold=threshold, n_jobs=n_jobs
+    )
+    progress(90)
+    # Written back in place, waverec can return one extra sample for odd lengths
+    raw._data[:] = denoised_data[:, :raw.n_times]
+
+
+def ica(raw, n_components=15, warm_start_file=None, progress=_no_progress):
+    # Returns the excluded (eye movement) components
+    # Fitted on a decimated subsample, reused from the ICA cache when the data and parameters match
+    ica, _ = ica_service.fit_ica(raw, n_components, warm_start=warm_start_file, progress=progress)
+    progress(80)
+    eog_indices, _ = ica.find_bads_eog(raw, ch_name=['Fp1', 'Fp2'])
+    ica.exclude = eog_indices
+    progress(90)
+    ica.apply(raw)
+    return [int(i) for i in eog_indices]
+
+
+def remove_noise(raw, threshold=100.0, min_duration=1.0, rms_threshold=None, rms_window=0.5,
+                 progress=_no_progress):
+    # Thresholds in µV (one value or one per channel), returns whether noisy segments were found
+    # Convert thresholds to volts as the raw data is in volts
+    threshold_v = np.asarray(threshold, dtype=float) * 1e-6
+    rms_threshold_v = np.asarray(rms_threshold, dtype=float) * 1e-6 if rms_threshold is not None else None
+
+    # Runs of over-threshold samples lasting at least min_duration, found in one pass
+    annotations = artifacts.noisy_annotations(raw, threshold_v, min_duration, rms_threshold_v, rms_window,
+                                              progress=lambda done, total: progress(int(80 * done / total)))
+    if len(annotations) == 0:
+        return False
+
+    # Mark these segments as bad
+    progress(90)
+    raw.set_annotations(annotations)
+
+    # Remove these segments by retaining only good parts of the data
+    raw.interpolate_bads(reset_bads=True)
+    return True
+
+
+# Steps that change the signal, by the name used in the step lists
+STEPS = {
+    'fir_filter': fir_filter,
+    'notch_filter': notch_filter,
+    'filter_chain': filter_chain,
+    'wavelet_denoising': wavelet_denoising,
+    'ica': ica,
+    'remove_noise': remove_noise,
+}
+
+
+def run_steps(raw, base_steps, steps, cache=None, progress=_no_progress, profiler=None):
+    """
+    Applies the steps (dicts with a 'step' name and its parameters) to raw.
+    With a cache, the longest already computed prefix is loaded instead of computed
+    and every new result is stored. With a profiling.Profiler every computed step is recorded.
+    Returns the processed raw and the step results.
+    """
+    all_steps = list(base_steps) + [dict(step) for step in steps]
+    results = {}
+    done = len(base_steps)
+    if cache is not None:
+        n_cached, cached_raw, cached_results = cache.lookup_prefix(all_steps)
+        if n_cached > done:
+            raw = cached_raw
+            # Results of the loaded steps come from the cache sidecars
+            results.update((i, cached_results[i]) for i in range(done, n_cached))
+            done = n_cached
+
+    for i in range(done, len(all_steps)):
+        params = dict(all_steps[i])
+        name = params.pop('step')
+        if profiler is not None:
+            with profiler.measure(name) as record:
+                record['data_in'] = raw._data.nbytes
+                results[i] = STEPS[name](raw, **params)
+                record['data_out'] = raw._data.nbytes
+        else:
+            results[i] = STEPS[name](raw, **params)
+        if cache is not None:
+            cache.put(all_steps[:i + 1], raw, results[i])
+        progress(i + 1, len(all_steps))
+    return raw, results
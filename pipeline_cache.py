@@ -0,0 +1,144 @@
+import os
+import glob
+import json
+import time
+import hashlib
+import mne
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.eeg_processing_cache')
+DEFAULT_MAX_BYTES = 10 * 1024 ** 3
+
+# Bytes read at once when hashing the input files
+HASH_BLOCK_SIZE = 1024 ** 2
+
+# Fingerprints of the files already hashed, by (path, size, mtime)
+_fingerprints = {}
+
+
+def file_fingerprint(path):
+    """
+    Content hash of a whole file, read once per process and then memoized per
+    (path, size, mtime), so two recordings only share cache entries when they are identical.
+    """
+    stat = os.stat(path)
+    memo_key = (os.path.abspath(path), stat.st_size, stat.st_mtime)
+    if memo_key not in _fingerprints:
+        digest = hashlib.sha1()
+        with open(path, 'rb') as file:
+            for block in iter(lambda: file.read(HASH_BLOCK_SIZE), b''):
+                digest.update(block)
+        _fingerprints[memo_key] = digest.hexdigest()
+    return _fingerprints[memo_key]
+
+
+def steps_key(steps):
+    # File parameters (bdf_file, log_file, ...) are replaced by their content fingerprint
+    normalised = []
+    for step in steps:
+        normalised.append({name: (file_fingerprint(value) if name.endswith('_file') and value is not None else value)
+                           for name, value in step.items()})
+    return hashlib.sha1(json.dumps(normalised, sort_keys=True, default=str).encode()).hexdigest()
+
+
+class PipelineCache:
+    """
+    Disk cache of intermediate pipeline results keyed by the input files and
+    the ordered list of steps with their parameters. Each entry is a FIF file
+    plus a small json sidecar; the sidecar mtime is the last access time used
+    for LRU eviction once the cache grows above max_bytes.
+    """
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def _meta_path(self, key):
+        return os.path.join(self.cache_dir, f'{key}.json')
+
+    def _raw_path(self, key):
+        return os.path.join(self.cache_dir, f'{key}_raw.fif')
+
+    def _raw_files(self, key):
+        # Large recordings are split by MNE into several files
+        return glob.glob(os.path.join(self.cache_dir, f'{key}_raw*.fif'))
+
+    def get(self, steps):
+        """
+        Returns (raw, result) for the exact list of steps or None.
+        """
+        key = steps_key(steps)
+        meta_path = self._meta_path(key)
+        if not os.path.exists(meta_path) or not os.path.exists(self._raw_path(key)):
+            return None
+        with open(meta_path, 'r') as file:
+            meta = json.load(file)
+        raw = mne.io.read_raw_fif(self._raw_path(key), preload=True)
+        os.utime(meta_path)
+        return raw, meta.get('result')
+
+    def get_result(self, steps):
+        # Result of the last of steps from its sidecar only, None when it is not cached
+        try:
+            with open(self._meta_path(steps_key(steps)), 'r') as file:
+                return json.load(file).get('result')
+        except (OSError, ValueError):
+            return None
+
+    def lookup_prefix(self, steps):
+        """
+        Finds the longest cached prefix of steps. Returns (n_steps, raw, results)
+        with the result of every step of the prefix (None for an evicted
+        intermediate entry), or (0, None, []) when nothing is cached.
+        """
+        for n_steps in range(len(steps), 0, -1):
+            hit = self.get(steps[:n_steps])
+            if hit is not None:
+                results = [self.get_result(steps[:i]) for i in range(1, n_steps)] + [hit[1]]
+                return n_steps, hit[0], results
+        return 0, None, []
+
+    def put(self, steps, raw, result=None):
+        key = steps_key(steps)
+        raw.save(self._raw_path(key), fmt='double', overwrite=True)
+        size = sum(os.path.getsize(path) for path in self._raw_files(key))
+        with open(self._meta_path(key), 'w') as file:
+            json.dump({'steps': steps, 'result': result, 'size': size, 'created': time.time()},
+                      file, indent=2, default=str)
+        self.evict()
+
+    def entries(self):
+        """
+        Lists cached entries, most recently used first.
+        """
+        entries = []
+        for meta_path in glob.glob(os.path.join(self.cache_dir, '*.json')):
+            try:
+                with open(meta_path, 'r') as file:
+                    meta = json.load(file)
+            except (OSError, ValueError):
+                continue
+            meta['key'] = os.path.basename(meta_path)[:-len('.json')]
+            meta['last_used'] = os.path.getmtime(meta_path)
+            entries.append(meta)
+        entries.sort(key=lambda entry: entry['last_used'], reverse=True)
+        return entries
+
+    def total_size(self):
+        return sum(entry['size'] for entry in self.entries())
+
+    def remove(self, key):
+        for path in self._raw_files(key) + [self._meta_path(key)]:
+            if os.path.exists(path):
+                os.remove(path)
+
+    def clear(self):
+        for entry in self.entries():
+            self.remove(entry['key'])
+
+    def evict(self):
+        entries = self.entries()
+        total = sum(entry['size'] for entry in entries)
+        while entries and total > self.max_bytes:
+            entry = entries.pop()
+            self.remove(entry['key'])
+            total -= entry['size']
@@ -0,0 +1,220 @@
+import os
+import sys
+import csv
+import json
+import time
+import cProfile
+import threading
+from collections import Counter
+from contextlib import contextmanager
+import psutil
+
+# Columns of the exported records, times in seconds and sizes in bytes
+# peak_rss is the highest sampled RSS during the block, peak_rss_delta that peak minus the RSS at its start,
+# the memory the block itself needed (the process high-water mark never goes down)
+FIELDS = ['index', 'name', 'kind', 'label', 'status', 'started', 'wall_s', 'cpu_s', 'peak_rss', 'peak_rss_delta',
+          'read_bytes', 'write_bytes', 'data_in', 'data_out', 'dump']
+
+
+def _cpu_seconds(process):
+    times = process.cpu_times()
+    # Children are the finished pool workers (figures rendering) of the step
+    return times.user + times.system + getattr(times, 'children_user', 0) + getattr(times, 'children_system', 0)
+
+
+def _io_bytes(process):
+    # Bytes passed through read/write calls, cached or not, where the platform reports them
+    if not hasattr(process, 'io_counters'):
+        return 0, 0
+    counters = process.io_counters()
+    return (getattr(counters, 'read_chars', counters.read_bytes),
+            getattr(counters, 'write_chars', counters.write_bytes))
+
+
+def _folded_stack(frame):
+    # Root first, 'function (file:line)' frames joined by ';' like py-spy's raw output
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+class _Sampler(threading.Thread):
+    """
+    Samples the resident memory of the process and, in dump mode, the stack of one thread.
+    """
+    def __init__(self, process, interval, thread_id=None):
+        super().__init__(daemon=True)
+        self.process = process
+        self.interval = interval
+        self.thread_id = thread_id
+        self.start_rss = process.memory_info().rss
+        self.peak_rss = self.start_rss
+        self.stacks = Counter()
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            self.peak_rss = max(self.peak_rss, self.process.memory_info().rss)
+            if self.thread_id is not None:
+                frame = sys._current_frames().get(self.thread_id)
+                if frame is not None:
+                    self.stacks[_folded_stack(frame)] += 1
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+        self.peak_rss = max(self.peak_rss, self.process.memory_info().rss)
+
+    def memory(self):
+        return {'peak_rss': self.peak_rss, 'peak_rss_delta': self.peak_rss - self.start_rss}
+
+
+@contextmanager
+def sample_memory(interval=0.01):
+    """
+    Samples the RSS of this process while the block runs and yields a dict that
+    gets its 'peak_rss' and 'peak_rss_delta' when the block ends, e.g. in worker processes.
+    """
+    sampler = _Sampler(psutil.Process(), interval)
+    memory = {}
+    sampler.start()
+    try:
+        yield memory
+    finally:
+        sampler.stop()
+        memory.update(sampler.memory())
+
+
+class Profiler:
+    """
+    Records wall time, CPU time, peak RSS and bytes read/written of pipeline steps
+    and per-interval operations of a session. With dump_dir, every step also writes
+    a cProfile dump (.prof, for pstats/snakeviz) and sampled stacks in the collapsed
+    format of py-spy/flamegraph (.folded) of the thread running it.
+    """
+    def __init__(self, dump_dir=None, sample_interval=0.01):
+        self.dump_dir = dump_dir
+        self.sample_interval = sample_interval
+        self.records = []
+        self._lock = threading.Lock()
+        self._process = psutil.Process()
+
+    def _new_record(self, name, kind, label):
+        with self._lock:
+            record = dict.fromkeys(FIELDS)
+            record.update(index=len(self.records), name=name, kind=kind, label=label, status='running',
+                          started=time.time())
+            self.records.append(record)
+        return record
+
+    @contextmanager
+    def measure(self, name, kind='step', label=None):
+        """
+        Measures the block run in the calling thread and yields its record, where the
+        caller can set 'data_in' and 'data_out'. The record is kept if the block raises.
+        """
+        record = self._new_record(name, kind, label)
+        dump = self.dump_dir is not None and kind == 'step'
+        sampler = _Sampler(self._process, self.sample_interval, threading.get_ident() if dump else None)
+        profile = cProfile.Profile() if dump else None
+        read_start, write_start = _io_bytes(self._process)
+        cpu_start = _cpu_seconds(self._process)
+        wall_start = time.perf_counter()
+        sampler.start()
+        if profile is not None:
+            profile.enable()
+        try:
+            yield record
+            record['status'] = 'ok'
+        except BaseException as e:
+            record['status'] = type(e).__name__
+            raise
+        finally:
+            if profile is not None:
+                profile.disable()
+            sampler.stop()
+            read_end, write_end = _io_bytes(self._process)
+            record.update(wall_s=time.perf_counter() - wall_start, cpu_s=_cpu_seconds(self._process) - cpu_start,
+                          read_bytes=read_end - read_start, write_bytes=write_end - write_start, **sampler.memory())
+            if dump:
+                record['dump'] = self._write_dump(record, profile, sampler.stacks)
+
+    def add(self, name, kind='interval', label=None, **values):
+        """
+        Adds a record measured elsewhere, e.g. in a worker process.
+        """
+        record = self._new_record(name, kind, label)
+        record.update(status='ok', **values)
+        return record
+
+    def _write_dump(self, record, profile, stacks):
+        os.makedirs(self.dump_dir, exist_ok=True)
+        base = os.path.join(self.dump_dir, f"{record['index']:03d}_{record['name'].replace(' ', '_')}")
+        profile.dump_stats(base + '.prof')
+        with open(base + '.folded', 'w') as file:
+            for stack, count in stacks.most_common():
+                file.write(f"{stack} {count}\n")
+        return base
+
+    def export(self, directory, basename='profile'):
+        """
+        Writes the records as <basename>.json and <basename>.csv in directory, returns both paths.
+        """
+        os.makedirs(directory, exist_ok=True)
+        json_path = os.path.join(directory, basename + '.json')
+        csv_path = os.path.join(directory, basename + '.csv')
+        with self._lock:
+            records = [dict(record) for record in self.records]
+        with open(json_path, 'w') as file:
+            json.dump(records, file, indent=2)
+        with open(csv_path, 'w', newline='') as file:
+            writer = csv.DictWriter(file, fieldnames=FIELDS)
+            writer.writeheader()
+            writer.writerows(records)
+        return json_path, csv_path
+
+    def totals(self, kind='step'):
+        # Wall seconds per name, e.g. to see which step dominates a session
+        totals = {}
+        for record in self.records:
+            if record['kind'] == kind and record['wall_s'] is not None:
+                totals[record['name']] = totals.get(record['name'], 0.0) + record['wall_s']
+        return totals
+
+
+def describe(record):
+    """
+    One line summary of a record for the action log.
+    """
+    parts = [f"{record['wall_s']:.2f} s wall"]
+    if record.get('cpu_s') is not None:
+        parts.append(f"{record['cpu_s']:.2f} s CPU")
+    if record.get('peak_rss') is not None:
+        growth = f" (+{record['peak_rss_delta'] / 1e6:.0f} MB)" if record.get('peak_rss_delta') is not None else ""
+        parts.append(f"peak RSS {record['peak_rss'] / 1e6:.0f} MB{growth}")
+    if record.get('read_bytes') is not None:
+        parts.append(f"read {record['read_bytes'] / 1e6:.1f} MB, written {record['write_bytes'] / 1e6:.1f} MB")
+    if record.get('data_in') is not None and record.get('data_out') is not None:
+        parts.append(f"signal {record['data_in'] / 1e6:.0f} -> {record['data_out'] / 1e6:.0f} MB")
+    label = f" [{record['label']}]" if record.get('label') else ""
+    return f"Profile '{record['name']}'{label}: " + ", ".join(parts)
+
+
+def describe_intervals(records):
+    """
+    One line per operation name summarising per-interval records for the action log.
+    """
+    by_name = {}
+    for record in records:
+        if record['kind'] == 'interval' and record['wall_s'] is not None:
+            by_name.setdefault(record['name'], []).append(record)
+    lines = []
+    for name, group in by_name.items():
+        slowest = max(group, key=lambda record: record['wall_s'])
+        mean = sum(record['wall_s'] for record in group) / len(group)
+        lines.append(f"Profile '{name}' per interval: {len(group)} x {mean:.3f} s mean, "
+                     f"slowest {slowest['wall_s']:.3f} s [{slowest['label']}]")
+    return lines
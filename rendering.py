@@ -0,0 +1,137 @@
+import os
+import json
+import time
+import hashlib
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+from pipeline import BANDS
+from profiling import sample_memory
+
+# Output settings, 'publication' matches the figures written so far
+PRESETS = {
+    'preview': {'format': 'png', 'topomap_dpi': 72, 'psd_dpi': 72},
+    'publication': {'format': 'png', 'topomap_dpi': 300, 'psd_dpi': 200},
+    'vector': {'format': 'pdf', 'topomap_dpi': 300, 'psd_dpi': 200},
+}
+
+# Channels of the two PSD figures
+PSD_PICKS = {
+    'PSD1': ['Fp1', 'Fp2', 'F3', 'Fz', 'F4', 'C3', 'Cz', 'C4'],
+    'PSD2': ['T7', 'T8', 'P3', 'Pz', 'P4', 'O1', 'Oz', 'O2'],
+}
+
+MANIFEST_NAME = '.render_manifest.json'
+
+
+def _init_worker():
+    # Figures are only saved, the Agg backend needs no display
+    import matplotlib
+    matplotlib.use('Agg')
+
+
+def _render(task):
+    # Returns the figure path and its timings measured in the process that drew it
+    import matplotlib.pyplot as plt
+    import mne
+    wall_start, cpu_start = time.perf_counter(), time.process_time()
+    with sample_memory() as memory:
+        spectrum = mne.time_frequency.SpectrumArray(task['psd'], task['info'], task['freqs'], verbose=False)
+        if task['kind'] == 'topomap':
+            fig = spectrum.plot_topomap(bands=BANDS, ch_type='eeg', show=False, **task['topomap_kw'])
+            # to change size first set width and height to assign right proportions, then set dpi value
+            fig.set_size_inches(25, 10)
+        else:
+            fig = spectrum.plot(picks=PSD_PICKS[task['kind']], show=False)
+        fig.savefig(task['path'], dpi=task['dpi'], format=task['format'])
+        plt.close(fig)
+    stats = dict(wall_s=time.perf_counter() - wall_start, cpu_s=time.process_time() - cpu_start,
+                 write_bytes=os.path.getsize(task['path']), **memory)
+    return task['path'], stats
+
+
+def _task_hash(task):
+    digest = hashlib.sha1()
+    digest.update(np.ascontiguousarray(task['psd']).tobytes())
+    digest.update(np.ascontiguousarray(task['freqs']).tobytes())
+    digest.update(json.dumps([task['kind'], task['dpi'], task['format'], task['topomap_kw'], task['info']['ch_names'],
+                              list(BANDS.items())], default=str).encode())
+    return digest.hexdigest()
+
+
+def figure_name(interval, kind, fmt):
+    tmin, tmax, label = interval[0], interval[1], interval[2]
+    suffix = '' if kind == 'topomap' else f'_{kind}'
+    return f'part_{tmin}_{tmax}_{label}{suffix}.{fmt}'
+
+
+def render_figures(spectra, intervals, directory_path, preset='publication', psd_figures=False,
+                   topomap_kw=None, n_jobs=None, progress=None, profiler=None):
+    """
+    Renders the topomap (and optionally the two PSD figures) of every interval
+    into '<directory>/Images' from precomputed spectra, in a process pool.
+    Figures whose inputs did not change since the last export are skipped.
+    With a profiling.Profiler, the spectrum and every figure of each interval are recorded.
+    Returns (rendered, skipped) file name lists.
+    """
+    settings = PRESETS[preset]
+    topomap_kw = dict(topomap_kw) if topomap_kw is not None else {'cmap': 'jet'}
+    images_path = os.path.join(directory_path, 'Images')
+    os.makedirs(images_path, exist_ok=True)
+
+    manifest_path = os.path.join(images_path, MANIFEST_NAME)
+    manifest = {}
+    if os.path.exists(manifest_path):
+        with open(manifest_path, 'r') as file:
+            manifest = json.load(file)
+
+    kinds = ['topomap'] + (list(PSD_PICKS) if psd_figures else [])
+    tasks = []
+    skipped = []
+    for interval in intervals:
+        if profiler is not None:
+            with profiler.measure('spectrum', kind='interval', label=f'{interval[0]}-{interval[1]} {interval[2]}'):
+                spectrum = spectra.spectrum(interval)
+        else:
+            spectrum = spectra.spectrum(interval)
+        for kind in kinds:
+            name = figure_name(interval, kind, settings['format'])
+            task = {
+                'psd': spectrum.get_data(), 'freqs': spectrum.freqs, 'info': spectrum.info,
+                'kind': kind, 'format': settings['format'], 'topomap_kw': topomap_kw,
+                'dpi': settings['topomap_dpi'] if kind == 'topomap' else settings['psd_dpi'],
+                'path': os.path.join(images_path, name),
+            }
+            task['hash'] = _task_hash(task)
+            if manifest.get(name) == task['hash'] and os.path.exists(task['path']):
+                skipped.append(name)
+            else:
+                tasks.append(task)
+
+    rendered = []
+    total = len(tasks)
+
+    def done(task, stats):
+        rendered.append(os.path.basename(task['path']))
+        manifest[rendered[-1]] = task['hash']
+        if profiler is not None:
+            profiler.add('render', kind='interval', label=rendered[-1], **stats)
+        if progress is not None:
+            progress(len(rendered), total)
+
+    try:
+        if n_jobs == 1:
+            for task in tasks:
+                done(task, _render(task)[1])
+        elif tasks:
+            executor = ProcessPoolExecutor(max_workers=n_jobs, initializer=_init_worker)
+            try:
+                futures = {executor.submit(_render, task): task for task in tasks}
+                for future in as_completed(futures):
+                    done(futures[future], future.result()[1])
+            finally:
+                # On errors or cancellation the figures not started yet are dropped
+                executor.shutdown(wait=True, cancel_futures=True)
+    finally:
+        with open(manifest_path, 'w') as file:
+            json.dump(manifest, file, indent=2)
+    return rendered, skipped
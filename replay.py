@@ -0,0 +1,87 @@
+import sys
+import time
+import socket
+import argparse
+import numpy as np
+import utils
+import alignment
+import live
+
+
+def open_session(folder):
+    """
+    Opens the session recording lazily, cropped to the window aligned with the log,
+    and returns (raw, flag events as (sample, flag) sorted by sample).
+    """
+    log_file, bdf_file_path = utils.search_files(folder)
+    if not log_file or not bdf_file_path:
+        raise FileNotFoundError(f"No .log and .bdf pair in '{folder}'.")
+    window = alignment.align(log_file, bdf_file_path)
+    raw = alignment.open_window(bdf_file_path, window, preload=False, verbose=False)
+
+    # The cropped recording starts at the first F1, to the millisecond of the log
+    f1_base = window['log_start']
+    sfreq = window['sfreq']
+    events = [(int(round((timestamp - f1_base) * sfreq)), flag)
+              for timestamp, flag in utils.iter_flag_events(log_file, fractional=True) if timestamp >= f1_base]
+    return raw, events
+
+
+def stream(conn, raw, events, block_seconds=0.0625, speed=1.0):
+    """
+    Sends the recording over conn at real-time speed (times speed) in blocks read from disk
+    on demand, each keypress right after the block containing its sample.
+    """
+    sfreq = raw.info['sfreq']
+    block = max(1, int(round(block_seconds * sfreq)))
+    live.send_message(conn, {'type': 'info', 'sfreq': sfreq, 'ch_names': raw.ch_names})
+
+    next_event = 0
+    start_clock = time.monotonic()
+    for start in range(0, raw.n_times, block):
+        stop = min(start + block, raw.n_times)
+        data = raw.get_data(start=start, stop=stop).astype(np.float32)
+        # The last sample of the block is "acquired" at its time in the recording
+        delay = start_clock + stop / sfreq / speed - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        live.send_message(conn, {'type': 'data', 'first_sample': start, 'n_channels': data.shape[0],
+                                 'n_samples': data.shape[1], 'sent_time': time.time()}, data.tobytes())
+        while next_event < len(events) and events[next_event][0] < stop:
+            sample, flag = events[next_event]
+            live.send_message(conn, {'type': 'flag', 'flag': flag, 'sample': sample})
+            next_event += 1
+    live.send_message(conn, {'type': 'end'})
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Stream a recorded session (.log and .bdf pair) over TCP at real-time speed, "
+                    "as a stand-in for the acquisition in the live mode of the GUI.")
+    parser.add_argument('folder', help="Session folder with one .log and one .bdf file")
+    parser.add_argument('--host', default=live.DEFAULT_ADDRESS[0])
+    parser.add_argument('--port', type=int, default=live.DEFAULT_ADDRESS[1])
+    parser.add_argument('--block', type=float, default=0.0625, help="Block duration in seconds")
+    parser.add_argument('--speed', type=float, default=1.0, help="Replay speed, 1 is real time")
+    parser.add_argument('--loop', action='store_true', help="Keep serving new clients after the first one")
+    args = parser.parse_args(argv)
+
+    raw, events = open_session(args.folder)
+    print(f"Replaying {raw.n_times / raw.info['sfreq']:.1f} s of {len(raw.ch_names)} channels at "
+          f"{raw.info['sfreq']:g} Hz with {len(events)} keypress(es) on {args.host}:{args.port}.")
+    with socket.create_server((args.host, args.port)) as server:
+        while True:
+            conn, address = server.accept()
+            print(f"Client {address[0]}:{address[1]} connected.")
+            with conn:
+                try:
+                    stream(conn, raw, events, args.block, args.speed)
+                    print("Replay finished.")
+                except (BrokenPipeError, ConnectionResetError):
+                    print("Client disconnected.")
+            if not args.loop:
+                return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
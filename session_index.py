@@ -0,0 +1,261 @@
+import os
+import sys
+import time
+import sqlite3
+import argparse
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import utils
+import bdf_header
+
+DEFAULT_INDEX_PATH = os.path.join(os.path.expanduser('~'), '.eeg_processing_cache', 'sessions.sqlite')
+# Directory listings and header reads are I/O bound, on network shares many can be in flight
+DEFAULT_WORKERS = 16
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    directory TEXT NOT NULL,
+    kind TEXT NOT NULL,          -- 'log' or 'bdf'
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    start REAL,                  -- seconds since 1970 (clock of the recording computer)
+    end REAL,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS files_directory ON files (directory);
+CREATE TABLE IF NOT EXISTS sessions (
+    log_path TEXT PRIMARY KEY,
+    bdf_path TEXT NOT NULL,
+    directory TEXT NOT NULL,
+    start REAL,
+    end REAL,
+    overlap REAL                 -- seconds of the log covered by the recording
+);
+CREATE INDEX IF NOT EXISTS sessions_directory ON sessions (directory);
+CREATE TABLE IF NOT EXISTS directories (
+    directory TEXT PRIMARY KEY,
+    mtime REAL NOT NULL          -- mtime of the directory when it was listed
+);
+"""
+
+
+def _scan_directory(path):
+    # mtime, log and bdf files (path, size, mtime) and subdirectories of one directory
+    files = []
+    subdirs = []
+    mtime = None
+    try:
+        # Taken before the listing, a change made while listing makes the directory stale
+        mtime = os.stat(path).st_mtime
+        with os.scandir(path) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.path)
+                elif entry.name.lower().endswith(('.log', '.bdf')):
+                    stat = entry.stat()
+                    files.append((entry.path, stat.st_size, stat.st_mtime))
+    except OSError:
+        # Unreadable directories are skipped like os.walk does
+        pass
+    return mtime, files, subdirs
+
+
+def scan_tree(root, workers=DEFAULT_WORKERS):
+    """
+    Lists the log and bdf files below root as (path, size, mtime) and the listed
+    directories as (path, mtime); directories are listed with os.scandir in a
+    thread pool as soon as they are found.
+    """
+    found = []
+    directories = []
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = {executor.submit(_scan_directory, root): root}
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                path = pending.pop(future)
+                mtime, files, subdirs = future.result()
+                found.extend(files)
+                if mtime is not None:
+                    directories.append((os.path.normpath(path), mtime))
+                pending.update({executor.submit(_scan_directory, subdir): subdir for subdir in subdirs})
+    return found, directories
+
+
+def _epoch_seconds(moment):
+    # Naive local times as seconds, the same convention as utils.parse_flag_intervals
+    return (moment - datetime(1970, 1, 1)).total_seconds()
+
+
+def file_time_range(path):
+    """
+    (start, end, error) of a file: the first and last keypress of a log,
+    the recording window from the header of a bdf file.
+    """
+    try:
+        if path.lower().endswith('.bdf'):
+            header = bdf_header.read_header(path)
+            start = _epoch_seconds(header['start'])
+            return start, start + header['duration'], None
+        start, end = utils.flag_event_range(path)
+        return start, end, None
+    except (OSError, ValueError) as e:
+        return None, None, str(e)
+
+
+def pair_directory(logs, bdfs):
+    """
+    Pairs the logs of a directory with its bdf files. logs and bdfs are lists of
+    (path, start, end); each log gets the recording overlapping most of it. A
+    directory with one log and one bdf is paired even without times, as before.
+    Returns [(log path, bdf path, overlap seconds)].
+    """
+    pairs = []
+    for log_path, log_start, log_end in logs:
+        best = None
+        for bdf_path, bdf_start, bdf_end in bdfs:
+            if None in (log_start, log_end, bdf_start, bdf_end):
+                continue
+            overlap = min(log_end, bdf_end) - max(log_start, bdf_start)
+            # A log with a single keypress has no length, it must fall inside the recording
+            if overlap >= 0 and (best is None or overlap > best[1]):
+                best = (bdf_path, overlap)
+        if best is None and len(logs) == 1 and len(bdfs) == 1:
+            best = (bdfs[0][0], 0.0)
+        if best is not None:
+            pairs.append((log_path, best[0], best[1]))
+    return pairs
+
+
+def _below(root):
+    # SQL condition and parameters for paths inside root (root itself included)
+    root = os.path.normpath(root)
+    prefix = root.rstrip(os.sep) + os.sep
+    return "(directory = ? OR (directory >= ? AND directory < ?))", (root, prefix, prefix[:-1] + chr(ord(os.sep) + 1))
+
+
+class SessionIndex:
+    """
+    SQLite index of the sessions (log and bdf pairs) below one or more roots.
+    update() rescans a root in parallel, only files whose size or mtime changed
+    are read again; opening a session is then a lookup instead of a walk.
+    """
+    def __init__(self, path=DEFAULT_INDEX_PATH):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript(SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def update(self, root, workers=DEFAULT_WORKERS, progress=None):
+        """
+        Rescans root and refreshes its files and sessions. Returns counts of the
+        scanned, read and removed files and of the sessions below root.
+        """
+        root = os.path.normpath(os.path.abspath(root))
+        started = time.perf_counter()
+        found, directories = scan_tree(root, workers)
+        condition, params = _below(root)
+        known = {path: (size, mtime) for path, size, mtime in self.connection.execute(
+            f"SELECT path, size, mtime FROM files WHERE {condition}", params)}
+
+        changed = [(path, size, mtime) for path, size, mtime in found if known.get(path) != (size, mtime)]
+        removed = set(known) - {path for path, _, _ in found}
+        rows = []
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for i, ((path, size, mtime), (start, end, error)) in enumerate(
+                    zip(changed, executor.map(lambda file: file_time_range(file[0]), changed)), start=1):
+                kind = 'bdf' if path.lower().endswith('.bdf') else 'log'
+                rows.append((path, os.path.dirname(path), kind, size, mtime, start, end, error))
+                if progress is not None:
+                    progress(i, len(changed))
+
+        with self.connection:
+            self.connection.executemany("DELETE FROM files WHERE path = ?", [(path,) for path in removed])
+            self.connection.executemany("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            self.connection.execute(f"DELETE FROM directories WHERE {condition}", params)
+            self.connection.executemany("INSERT INTO directories VALUES (?, ?)", directories)
+            # Pairs are recomputed from the stored times, no file is read for that
+            for directory in {os.path.dirname(path) for path in removed} | {row[1] for row in rows}:
+                self._pair(directory)
+        n_sessions = self.connection.execute(f"SELECT COUNT(*) FROM sessions WHERE {condition}", params).fetchone()[0]
+        return {'files': len(found), 'read': len(changed), 'removed': len(removed), 'sessions': n_sessions,
+                'seconds': time.perf_counter() - started}
+
+    def _pair(self, directory):
+        files = self.connection.execute(
+            "SELECT path, kind, start, end FROM files WHERE directory = ? ORDER BY path", (directory,)).fetchall()
+        logs = [(path, start, end) for path, kind, start, end in files if kind == 'log']
+        bdfs = {path: (start, end) for path, kind, start, end in files if kind == 'bdf'}
+        self.connection.execute("DELETE FROM sessions WHERE directory = ?", (directory,))
+        for log_path, bdf_path, overlap in pair_directory(logs, [(path, *times) for path, times in bdfs.items()]):
+            start, end = bdfs[bdf_path]
+            self.connection.execute("INSERT INTO sessions VALUES (?, ?, ?, ?, ?, ?)",
+                                    (log_path, bdf_path, directory, start, end, overlap))
+
+    def sessions(self, root=None):
+        """
+        Indexed sessions (below root if given) as dicts, sorted by directory and log.
+        """
+        query = "SELECT log_path, bdf_path, directory, start, end, overlap FROM sessions"
+        params = ()
+        if root is not None:
+            condition, params = _below(os.path.abspath(root))
+            query += f" WHERE {condition}"
+        keys = ['log_file', 'bdf_file', 'directory', 'start', 'end', 'overlap']
+        return [dict(zip(keys, row)) for row in self.connection.execute(query + " ORDER BY directory, log_path", params)]
+
+    def is_stale(self, folder):
+        """
+        True when folder was never listed or when it or one of its listed
+        subdirectories changed since (files or folders added, removed or renamed
+        change the mtime of their directory). Only the directories are stat'ed.
+        """
+        folder = os.path.normpath(os.path.abspath(folder))
+        condition, params = _below(folder)
+        listed = self.connection.execute(f"SELECT directory, mtime FROM directories WHERE {condition}", params).fetchall()
+        if folder not in {directory for directory, _ in listed}:
+            return True
+        for directory, mtime in listed:
+            try:
+                if os.stat(directory).st_mtime != mtime:
+                    return True
+            except OSError:
+                return True
+        return False
+
+    def lookup(self, folder, workers=DEFAULT_WORKERS):
+        """
+        Sessions inside folder, which is rescanned first when it is stale.
+        """
+        if self.is_stale(folder):
+            self.update(folder, workers)
+        return self.sessions(folder)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Index the sessions (log and bdf pairs) below a data root.")
+    parser.add_argument('root', help="Root directory scanned for .log and .bdf files")
+    parser.add_argument('--index', default=DEFAULT_INDEX_PATH, help="SQLite index file")
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help="Directories scanned at once")
+    parser.add_argument('--list', action='store_true', help="Print the sessions after the update")
+    args = parser.parse_args(argv)
+
+    index = SessionIndex(args.index)
+    try:
+        stats = index.update(args.root, args.workers)
+        print(f"{stats['files']} file(s) found, {stats['read']} read, {stats['removed']} removed, "
+              f"{stats['sessions']} session(s) in {stats['seconds']:.2f} s.")
+        if args.list:
+            for session in index.sessions(args.root):
+                print(f"{session['log_file']}  <->  {session['bdf_file']}  ({session['overlap']:.0f} s overlap)")
+    finally:
+        index.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,230 @@
+import os
+import math
+import time
+import hashlib
+import threading
+from datetime import timedelta
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import numpy as np
+
+FORMATS = {'.edf': 'edf', '.bdf': 'bdf', '.fif': 'fif'}
+# Digital sample range of the 16-bit EDF and 24-bit BDF formats
+DIGITAL_RANGE = {'edf': (-32768, 32767), 'bdf': (-8388608, 8388607)}
+# Seconds of signal converted and written at once
+BLOCK_SECONDS = 60
+CHECKSUMS_NAME = 'SHA256SUMS'
+
+# edflib keeps its open files in a global table, files are opened and closed one thread at a time
+_edf_lock = threading.Lock()
+
+
+def export_format(path):
+    fmt = FORMATS.get(os.path.splitext(path)[1].lower())
+    if fmt is None:
+        raise ValueError(f"Unsupported export format '{path}', expected one of {sorted(FORMATS)}.")
+    return fmt
+
+
+def sha256_file(path, block_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _blocks(start, stop, size):
+    for first in range(start, stop, size):
+        yield first, min(first + size, stop)
+
+
+def _header_number(value, up):
+    # Rounded outwards to a number that fits the 8 characters of an EDF header field unchanged
+    for decimals in range(6, -1, -1):
+        scale = 10 ** decimals
+        rounded = (math.ceil(value * scale) if up else math.floor(value * scale)) / scale
+        if len(f'{rounded:.{decimals}f}') <= 8:
+            return rounded
+    raise ValueError(f"{value} does not fit in an EDF header.")
+
+
+def physical_range(data, start, stop, block_samples):
+    """
+    Per-channel minimum and maximum in µV of data[:, start:stop], read block by
+    block, widened to header-representable values and never empty.
+    """
+    low = np.full(data.shape[0], np.inf)
+    high = np.full(data.shape[0], -np.inf)
+    for first, last in _blocks(start, stop, block_samples):
+        block = np.asarray(data[:, first:last], dtype=np.float64) * 1e6
+        np.minimum(low, block.min(axis=1), out=low)
+        np.maximum(high, block.max(axis=1), out=high)
+    low = np.where(np.isfinite(low), low, -1.0)
+    high = np.where(high > low, high, low + 1.0)
+    return (np.array([_header_number(value, False) for value in low]),
+            np.array([_header_number(value, True) for value in high]))
+
+
+def _annotations_in(raw, start, stop):
+    # (onset relative to the exported range, duration, description) of the annotations inside it
+    sfreq = raw.info['sfreq']
+    offset = (raw.first_time if raw.annotations.orig_time is not None else 0.0) + start / sfreq
+    end = (stop - start) / sfreq
+    return [(annotation['onset'] - offset, annotation['duration'], annotation['description'])
+            for annotation in raw.annotations if 0 <= annotation['onset'] - offset < end]
+
+
+def _prefilter(info):
+    return f"HP:{info['highpass']:g}Hz LP:{info['lowpass']:g}Hz"
+
+
+def write_edf(path, raw, start, stop, data=None, progress=None):
+    """
+    Writes samples [start, stop) of the working signal as EDF+ or BDF+ (by the
+    extension of path), one data record per second, converted to digital values
+    block by block. data is the (channels x samples) source, raw._data by default
+    or e.g. a memory-mapped array; raw gives the channel info and annotations.
+    """
+    import pyedflib
+    fmt = export_format(path)
+    data = raw._data if data is None else data
+    info = raw.info
+    sfreq = info['sfreq']
+    samples_per_record = int(round(sfreq))
+    if abs(samples_per_record - sfreq) > 1e-6:
+        raise ValueError(f"EDF/BDF export needs an integer sampling rate, got {sfreq} Hz.")
+    block_samples = BLOCK_SECONDS * samples_per_record
+
+    physical_min, physical_max = physical_range(data, start, stop, block_samples)
+    digital_min, digital_max = DIGITAL_RANGE[fmt]
+    scale = (digital_max - digital_min) / (physical_max - physical_min)
+
+    with _edf_lock:
+        writer = pyedflib.EdfWriter(path, data.shape[0],
+                                    file_type=pyedflib.FILETYPE_BDFPLUS if fmt == 'bdf' else pyedflib.FILETYPE_EDFPLUS)
+    try:
+        writer.setSignalHeaders([
+            {'label': name, 'dimension': 'uV', 'sample_frequency': sfreq, 'physical_min': low,
+             'physical_max': high, 'digital_min': digital_min, 'digital_max': digital_max,
+             'transducer': '', 'prefilter': _prefilter(info)}
+            for name, low, high in zip(info['ch_names'], physical_min, physical_max)])
+        if info['meas_date'] is not None:
+            writer.setStartdatetime(info['meas_date'].replace(tzinfo=None)
+                                    + timedelta(seconds=(raw.first_samp + start) / sfreq))
+
+        for first, last in _blocks(start, stop, block_samples):
+            block = np.asarray(data[:, first:last], dtype=np.float64) * 1e6
+            # The last record is completed with 0 µV
+            missing = -(last - first) % samples_per_record
+            if missing:
+                block = np.pad(block, ((0, 0), (0, missing)))
+            digital = np.rint((block - physical_min[:, np.newaxis]) * scale[:, np.newaxis] + digital_min)
+            digital = np.clip(digital, digital_min, digital_max).astype(np.int32)
+            for record in range(0, digital.shape[1], samples_per_record):
+                # A data record holds the samples of every channel one after the other
+                writer.blockWriteDigitalSamples(np.ascontiguousarray(digital[:, record:record + samples_per_record]).ravel())
+            if progress is not None:
+                progress(last - start, stop - start)
+
+        for onset, duration, description in _annotations_in(raw, start, stop):
+            writer.writeAnnotation(onset, duration if duration > 0 else -1, description)
+    finally:
+        with _edf_lock:
+            writer.close()
+
+
+def write_fif(path, raw, start, stop, progress=None):
+    """
+    Writes samples [start, stop) of raw as FIF. Raw.save reads the range in
+    buffers straight from the working signal, no cropped copy is made.
+    """
+    sfreq = raw.info['sfreq']
+    raw.save(path, tmin=start / sfreq, tmax=(stop - 1) / sfreq, buffer_size_sec=BLOCK_SECONDS,
+             overwrite=True, verbose=False)
+    if progress is not None:
+        progress(stop - start, stop - start)
+
+
+def export_range(path, raw, start=0, stop=None, data=None, progress=None):
+    """
+    Exports samples [start, stop) of the working signal to path (.edf, .bdf or
+    .fif). The file is written under a temporary name and renamed when complete.
+    Returns a dict with 'path', 'format', 'n_samples', 'bytes', 'seconds' and 'sha256'.
+    """
+    fmt = export_format(path)
+    stop = raw.n_times if stop is None else stop
+    if not 0 <= start < stop <= raw.n_times:
+        raise ValueError(f"Invalid sample range {start}-{stop} for a signal of {raw.n_times} samples.")
+    root, extension = os.path.splitext(path)
+    # MNE wants FIF names ending in raw.fif
+    tmp_path = f'{root}.part_raw{extension}' if fmt == 'fif' else f'{root}.part{extension}'
+    started = time.perf_counter()
+    try:
+        if fmt == 'fif':
+            write_fif(tmp_path, raw, start, stop, progress)
+        else:
+            write_edf(tmp_path, raw, start, stop, data, progress)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return {'path': path, 'format': fmt, 'n_samples': stop - start, 'bytes': os.path.getsize(path),
+            'seconds': time.perf_counter() - started, 'sha256': sha256_file(path)}
+
+
+def interval_file_name(interval, fmt):
+    # Named like the topomaps of the interval
+    return f'part_{interval[0]}_{interval[1]}_{interval[2]}.{fmt}'
+
+
+def write_checksums(directory, results):
+    """
+    Adds the files of results to the SHA256SUMS of directory (sha256sum -c format),
+    replacing older entries of the same names. Returns its path.
+    """
+    path = os.path.join(directory, CHECKSUMS_NAME)
+    entries = {}
+    if os.path.exists(path):
+        with open(path, 'r') as file:
+            for line in file:
+                digest, _, name = line.rstrip('\n').partition('  ')
+                if name:
+                    entries[name] = digest
+    for result in results:
+        entries[os.path.relpath(result['path'], directory)] = result['sha256']
+    with open(path, 'w') as file:
+        file.writelines(f'{digest}  {name}\n' for name, digest in sorted(entries.items()))
+    return path
+
+
+def export_intervals(directory, raw, intervals, fmt='edf', labels=None, data=None, n_jobs=None, progress=None):
+    """
+    Exports every interval (of labels, or all) of an interval_index.IntervalIndex
+    as a separate file in directory, in parallel threads sharing the working
+    signal. Checksums are added to the SHA256SUMS of directory.
+    progress(done samples, total samples) is called as the files are written.
+    Returns the results of export_range in interval order and the checksum file.
+    """
+    os.makedirs(directory, exist_ok=True)
+    selected = [interval for interval in (intervals.select(labels) if labels is not None else intervals)
+                if interval.stop_sample > interval.start_sample]
+    total = sum(interval.stop_sample - interval.start_sample for interval in selected)
+    done = {}
+    lock = threading.Lock()
+
+    def export(i, interval):
+        def report(samples, _):
+            with lock:
+                done[i] = samples
+                if progress is not None:
+                    progress(sum(done.values()), total)
+        return export_range(os.path.join(directory, interval_file_name(interval, fmt)), raw,
+                            interval.start_sample, interval.stop_sample, data, report)
+
+    results = [None] * len(selected)
+    n_jobs = n_jobs or min(len(selected), os.cpu_count() or 1) or 1
+    with ThreadPoolExecutor(max_workers=n_jobs) as executor:
+        futures = {executor.submit(export, i, interval): i for i, interval in enumerate(selected)}
+        for future in as_completed(futures):
+            results[futures[future]] = future.result()
+    return results, write_checksums(directory, results) if results else None
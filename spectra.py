@@ -0,0 +1,136 @@
+import numpy as np
+import mne
+from scipy.signal import get_window
+from pipeline import BANDS
+
+# Segments transformed at once, bounds the temporary memory of the FFT
+BLOCK_SEGMENTS = 512
+
+
+class IntervalSpectra:
+    """
+    Welch spectra of many intervals from one pass over the recording.
+
+    The recording is split once into non-overlapping n_fft segments (Hamming
+    window, mean removed, like Raw.compute_psd defaults). Their periodograms are
+    kept as a cumulative sum, so the PSD of any interval is the mean of the
+    segments inside it, obtained by index without copying the signal.
+    Intervals shorter than one segment get a single periodogram of their own
+    length, as Raw.compute_psd does.
+    Segments overlapping 'bad' annotations are left out like in MNE.
+    Spectra and band powers are cached per interval.
+    """
+    def __init__(self, raw, n_fft=2048, fmin=0, fmax=np.inf):
+        self.info = raw.info
+        self.sfreq = raw.info['sfreq']
+        self.n_fft = min(n_fft, raw.n_times)
+        self.raw = raw
+        self.fmin = fmin
+        self.fmax = fmax
+        self._spectra = {}
+        self._band_powers = {}
+
+        freqs = np.fft.rfftfreq(self.n_fft, 1 / self.sfreq)
+        freq_mask = (freqs >= fmin) & (freqs <= fmax)
+        self.freqs = freqs[freq_mask]
+
+        # One-sided PSD scaling as in scipy.signal.spectrogram(scaling='density')
+        window = get_window('hamming', self.n_fft)
+        scale = np.full(len(freqs), 2.0 / (self.sfreq * np.sum(window ** 2)))
+        scale[0] /= 2
+        if self.n_fft % 2 == 0:
+            scale[-1] /= 2
+        scale = scale[freq_mask]
+
+        data = raw._data
+        n_channels = data.shape[0]
+        self.n_segments = raw.n_times // self.n_fft
+        valid = self._valid_segments(raw)
+
+        # Cumulative sums over segments, index 0 is the empty sum
+        self._cumsum = np.zeros((n_channels, self.n_segments + 1, len(self.freqs)))
+        self._count = np.concatenate([[0], np.cumsum(valid)])
+
+        running = np.zeros((n_channels, len(self.freqs)))
+        for first in range(0, self.n_segments, BLOCK_SEGMENTS):
+            last = min(first + BLOCK_SEGMENTS, self.n_segments)
+            # View of the samples as (channels, segments, n_fft), no copy
+            segments = data[:, first * self.n_fft:last * self.n_fft].reshape(n_channels, last - first, self.n_fft)
+            segments = segments - segments.mean(axis=-1, keepdims=True)
+            segments *= window
+            power = np.abs(np.fft.rfft(segments, axis=-1)[..., freq_mask]) ** 2
+            power *= scale
+            power[:, ~valid[first:last]] = 0
+            np.cumsum(power, axis=1, out=power)
+            power += running[:, np.newaxis]
+            self._cumsum[:, first + 1:last + 1] = power
+            running = power[:, -1]
+
+    def _valid_segments(self, raw):
+        valid = np.ones(self.n_segments, dtype=bool)
+        for annotation in raw.annotations:
+            if not annotation['description'].lower().startswith('bad'):
+                continue
+            onset = raw.time_as_index(annotation['onset'], use_rounding=True, origin=raw.annotations.orig_time)[0]
+            stop = onset + int(round(annotation['duration'] * self.sfreq))
+            first = max(0, onset // self.n_fft)
+            last = min(self.n_segments, int(np.ceil(stop / self.n_fft)))
+            valid[first:last] = False
+        return valid
+
+    def _segment_range(self, start, stop):
+        first = int(np.ceil(start / self.n_fft))
+        last = min(stop // self.n_fft, self.n_segments)
+        return first, last
+
+    def psd(self, tmin, tmax):
+        """
+        Returns the (channels x freqs) PSD of the interval and its frequencies.
+        """
+        return self.psd_samples(int(round(tmin * self.sfreq)), int(round(tmax * self.sfreq)) + 1)
+
+    def interval_psd(self, interval):
+        # Intervals of an interval_index.IntervalIndex carry their sample range, other tuples are converted
+        if hasattr(interval, 'start_sample'):
+            return self.psd_samples(interval.start_sample, interval.stop_sample)
+        return self.psd(interval[0], interval[1])
+
+    def psd_samples(self, start, stop):
+        """
+        PSD of the samples [start, stop) and its frequencies.
+        """
+        first, last = self._segment_range(start, stop)
+        count = self._count[last] - self._count[first] if last > first else 0
+        if count == 0:
+            # Interval shorter than one segment, computed directly from a view of the data
+            start = max(0, start)
+            stop = min(self.raw.n_times, stop)
+            return mne.time_frequency.psd_array_welch(
+                self.raw._data[:, start:stop], self.sfreq, fmin=self.fmin, fmax=self.fmax,
+                n_fft=min(self.n_fft, stop - start), verbose=False)
+        return (self._cumsum[:, last] - self._cumsum[:, first]) / count, self.freqs
+
+    def spectrum(self, interval):
+        """
+        MNE Spectrum of an interval (start, end, ...), usable with plot_topomap and plot.
+        """
+        key = (interval[0], interval[1])
+        if key not in self._spectra:
+            psd, freqs = self.interval_psd(interval)
+            self._spectra[key] = mne.time_frequency.SpectrumArray(psd, self.info, freqs, verbose=False)
+        return self._spectra[key]
+
+    def band_powers(self, interval, bands=BANDS):
+        """
+        Mean PSD of every band, returned as (bands x channels) in the order of bands.
+        """
+        key = (interval[0], interval[1], tuple(bands.items()))
+        if key not in self._band_powers:
+            spectrum = self.spectrum(interval)
+            psd = spectrum.get_data()
+            powers = []
+            for fmin, fmax in bands.values():
+                mask = (spectrum.freqs >= fmin) & (spectrum.freqs <= fmax)
+                powers.append(psd[:, mask].mean(axis=1))
+            self._band_powers[key] = np.array(powers)
+        return self._band_powers[key]
@@ -0,0 +1,192 @@
+import os
+import sys
+import csv
+import time
+import shutil
+import argparse
+import tempfile
+import itertools
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+import pywt
+from scipy.signal import welch
+import utils
+import filters
+from pipeline import BANDS
+from features import band_column
+
+SWEEP_NAME = 'wavelet_sweep.csv'
+# Welch segment of the band powers, the same as the interval spectra
+N_FFT = 2048
+
+
+def parse_bandpass(text):
+    # 'none' keeps the signal as it is, '1-40' is a 1-40 Hz bandpass
+    text = text.strip().lower()
+    if text in ('', 'none'):
+        return None
+    l_freq, h_freq = (float(value) for value in text.split('-'))
+    return l_freq, h_freq
+
+
+def parse_threshold(text):
+    # 'adaptive' is the per-channel MAD threshold, None like in utils.wavelet_denoising_batch
+    text = text.strip().lower()
+    return None if text == 'adaptive' else float(text)
+
+
+def grid(wavelets, levels, thresholds=(None,), bandpasses=(None,)):
+    """
+    Configurations of the sweep as dicts, thresholds varying fastest so that
+    the configurations sharing a decomposition are next to each other.
+    """
+    return [dict(bandpass=bandpass, wavelet=wavelet, level=level, threshold=threshold)
+            for bandpass, wavelet, level, threshold in itertools.product(bandpasses, wavelets, levels, thresholds)]
+
+
+def band_powers(data, sfreq, n_fft=N_FFT):
+    """
+    Power of every band of pipeline.BANDS per channel (bands x channels), from a Welch PSD.
+    """
+    freqs, psd = welch(data, sfreq, window='hamming', nperseg=min(n_fft, data.shape[-1]), noverlap=0, axis=-1)
+    df = freqs[1] - freqs[0]
+    return np.array([psd[:, (freqs >= fmin) & (freqs <= fmax)].sum(axis=-1) * df for fmin, fmax in BANDS.values()])
+
+
+def _ratio(numerator, denominator):
+    # Channel mean of a ratio, bands without power (above Nyquist) are nan
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.nanmean(np.where(denominator > 0, numerator / denominator, np.nan), axis=-1)
+
+
+def _sweep_decomposition(args):
+    # One wavelet decomposition of a filtered signal, every threshold reconstructed from it
+    path, sfreq, bandpass, wavelet, level, thresholds, reference_powers = args
+    data = np.load(path, mmap_mode='r')
+    n_samples = data.shape[1]
+    started = time.perf_counter()
+    coeffs = pywt.wavedec(np.asarray(data), wavelet, level=level, axis=-1)
+    decomposition_s = time.perf_counter() - started
+
+    rows = []
+    for threshold in thresholds:
+        started = time.perf_counter()
+        # The approximation is not thresholded and waverec does not modify it
+        thresholded = [coeffs[0]] + [detail.copy() for detail in coeffs[1:]]
+        value = utils.mad_threshold(coeffs) if threshold is None else np.asarray(threshold)
+        denoised = utils.denoise_coefficients(thresholded, wavelet, threshold is None, threshold)[:, :n_samples]
+        residual = data - denoised
+        signal_power = np.mean(denoised ** 2, axis=-1)
+        residual_power = np.mean(residual ** 2, axis=-1)
+        with np.errstate(divide='ignore'):
+            snr_db = float(np.mean(10 * np.log10(signal_power / residual_power)))
+        row = {
+            'l_freq': bandpass[0] if bandpass else None, 'h_freq': bandpass[1] if bandpass else None,
+            'wavelet': wavelet, 'level': level, 'threshold': 'adaptive' if threshold is None else threshold,
+            'threshold_value': float(np.mean(value)), 'snr_db': snr_db,
+            'removed_power': float(_ratio(residual_power, signal_power + residual_power)),
+        }
+        # Share of the power of each band of the input taken out by the denoising
+        for band, fraction in zip(BANDS, _ratio(band_powers(residual, sfreq), reference_powers)):
+            row[f'removed_{band_column(band)}'] = float(fraction)
+        # The decomposition is shared, its time is counted once per group
+        row['seconds'] = time.perf_counter() - started + (decomposition_s if not rows else 0.0)
+        rows.append(row)
+    return rows
+
+
+def run_sweep(raw, wavelets, levels, thresholds=(None,), bandpasses=(None,), n_jobs=None, progress=None,
+              work_dir=None):
+    """
+    Denoises the signal of raw with every combination of bandpass, wavelet,
+    level and threshold and returns one row of quality metrics per configuration.
+    Each bandpass is applied once and shared through a temporary .npy file; each
+    (bandpass, wavelet, level) is decomposed once in a worker process and all
+    thresholds are reconstructed from that decomposition. raw is not modified.
+    progress(done, total) is called per decomposition.
+    """
+    for wavelet in wavelets:
+        # Raises ValueError for unknown names before any work is started
+        pywt.Wavelet(wavelet)
+    sfreq = raw.info['sfreq']
+    n_jobs = n_jobs or os.cpu_count() or 1
+    directory = tempfile.mkdtemp(prefix='eeg_sweep_', dir=work_dir)
+    try:
+        tasks = []
+        for i, bandpass in enumerate(bandpasses):
+            filtered = raw._data.copy()
+            if bandpass is not None:
+                filters.apply_kernel(filtered, filters.chain_kernel(sfreq, *bandpass))
+            path = os.path.join(directory, f'{i}.npy')
+            np.save(path, filtered)
+            reference_powers = band_powers(filtered, sfreq)
+            del filtered
+            for wavelet, level in itertools.product(wavelets, levels):
+                tasks.append((path, sfreq, bandpass, wavelet, level, list(thresholds), reference_powers))
+
+        results = {}
+        if n_jobs == 1:
+            for i, task in enumerate(tasks):
+                results[i] = _sweep_decomposition(task)
+                if progress is not None:
+                    progress(i + 1, len(tasks))
+        else:
+            with ProcessPoolExecutor(max_workers=min(n_jobs, len(tasks))) as executor:
+                futures = {executor.submit(_sweep_decomposition, task): i for i, task in enumerate(tasks)}
+                for done, future in enumerate(as_completed(futures), start=1):
+                    results[futures[future]] = future.result()
+                    if progress is not None:
+                        progress(done, len(tasks))
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+    # Back in grid order
+    return [row for i in range(len(tasks)) for row in results[i]]
+
+
+def write_sweep(path, rows):
+    with open(path, 'w', newline='') as file:
+        writer = csv.DictWriter(file, fieldnames=list(rows[0]))
+        writer.writeheader()
+        writer.writerows(rows)
+    return path
+
+
+def main(argv=None):
+    import mne
+    import alignment
+    parser = argparse.ArgumentParser(
+        description="Sweep wavelet denoising (and bandpass) settings over a session and report quality metrics.")
+    parser.add_argument('folder', help="Session folder with a .log and .bdf file")
+    parser.add_argument('--wavelets', nargs='+', default=['sym4', 'db4', 'coif3'])
+    parser.add_argument('--levels', nargs='+', type=int, default=[1, 3, 5])
+    parser.add_argument('--thresholds', nargs='+', default=['adaptive'],
+                        help="'adaptive' (MAD of the finest details) or manual values")
+    parser.add_argument('--bandpass', nargs='+', default=['none'], help="'none' or edges such as 1-40")
+    parser.add_argument('--jobs', type=int, default=os.cpu_count())
+    parser.add_argument('--out', help=f"CSV file, defaults to <folder>/{SWEEP_NAME}")
+    args = parser.parse_args(argv)
+    mne.set_log_level('WARNING')
+
+    log_file, bdf_file = utils.search_files(args.folder)
+    if not log_file or not bdf_file:
+        print(f"No .log and .bdf pair in '{args.folder}'.")
+        return 1
+    raw, _ = alignment.load_session(log_file, bdf_file)
+    started = time.perf_counter()
+    rows = run_sweep(raw, args.wavelets, args.levels, [parse_threshold(value) for value in args.thresholds],
+                     [parse_bandpass(value) for value in args.bandpass], n_jobs=args.jobs)
+    elapsed = time.perf_counter() - started
+
+    print(f"{'bandpass':>12s} {'wavelet':>8s} {'level':>5s} {'threshold':>10s} {'SNR dB':>7s} {'removed':>8s}")
+    for row in rows:
+        bandpass = f"{row['l_freq']:g}-{row['h_freq']:g}" if row['l_freq'] is not None else 'none'
+        threshold = row['threshold'] if row['threshold'] == 'adaptive' else f"{row['threshold']:g}"
+        print(f"{bandpass:>12s} {row['wavelet']:>8s} {row['level']:5d} {threshold:>10s} "
+              f"{row['snr_db']:7.2f} {row['removed_power']:8.2%}")
+    path = write_sweep(args.out or os.path.join(args.folder, SWEEP_NAME), rows)
+    print(f"{len(rows)} configuration(s) in {elapsed:.1f} s, written to '{path}'.")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -3,69 +3,168 @@ import re
 import os
 import pywt
 import numpy as np
+from concurrent.futures import ProcessPoolExecutor
 
-def extract_flag_intervals(log_file):
-    with open(log_file, 'r') as file:
-        lines = file.readlines()
+FLAG_MAPPING = {
+    "Key.f1": "F1",
+    "Key.f3": "F3",
+    "Key.f4": "F4",
+    "Key.f6": "F6",
+    "Key.f7": "F7",
+    "Key.f8": "F8"
+}
 
-    flag_intervals = []
+# One row per interval: (start, end, start_flag, end_flag), times in seconds from the first F1
+INTERVAL_DTYPE = np.dtype([('start', 'f8'), ('end', 'f8'), ('start_flag', 'U2'), ('end_flag', 'U2')])
+
+_FLAG_MARKER = b'CRITICAL - Pressed '
+_time_pattern = re.compile(rb'(\d{4})-(\d{2})-(\d{2}) (\d{2}):(\d{2}):(\d{2})')
+_flag_pattern = re.compile(rb'CRITICAL - Pressed (\w+\.\w+)')
+_EPOCH_ORDINAL = datetime(1970, 1, 1).toordinal()
+# Seconds since 1970 of the dates seen in the logs, a log spans only a few dates
+_day_cache = {}
+
+
+def _line_seconds(line):
+    # Timestamps are fixed width ("YYYY-MM-DD HH:MM:SS") at the line start, parsed without strptime
+    if len(line) >= 19 and line[4:5] == b'-' and line[10:11] == b' ' and line[13:14] == b':':
+        date, hours, minutes, seconds = line[:10], line[11:13], line[14:16], line[17:19]
+    else:
+        match = _time_pattern.search(line)
+        if match is None:
+            return None
+        date = match.group(1) + b'-' + match.group(2) + b'-' + match.group(3)
+        hours, minutes, seconds = match.group(4), match.group(5), match.group(6)
+    day = _day_cache.get(date)
+    if day is None:
+        day = (datetime(int(date[:4]), int(date[5:7]), int(date[8:10])).toordinal() - _EPOCH_ORDINAL) * 86400
+        _day_cache[date] = day
+    return day + int(hours) * 3600 + int(minutes) * 60 + int(seconds)
+
+
+# Consecutive flags that do not delimit an interval
+SKIPPED_PAIRS = {('F3', 'F4'), ('F7', 'F8')}
+
+
+def _line_milliseconds(line):
+    # Milliseconds after the seconds of the timestamp ("HH:MM:SS,mmm"), 0 when absent
+    if len(line) >= 23 and line[19:20] in (b',', b'.') and line[20:23].isdigit():
+        return int(line[20:23])
+    return 0
+
+
+def _flag_event(line, fractional=False):
+    # (timestamp in seconds, flag) of a keypress line, None for any other line
+    position = line.find(_FLAG_MARKER)
+    if position < 0:
+        return None
+    flag_match = _flag_pattern.match(line, position)
+    if flag_match is None:
+        return None
+    flag = FLAG_MAPPING.get(flag_match.group(1).decode())
+    if flag is None:
+        return None
+    timestamp = _line_seconds(line)
+    if timestamp is None:
+        return None
+    if fractional:
+        timestamp += _line_milliseconds(line) / 1000
+    return timestamp, flag
+
+
+def iter_flag_events(log_file, fractional=False):
+    """
+    Streams the mapped keypresses of a log as (timestamp in seconds, flag).
+    The file is read lazily, lines without a 'CRITICAL - Pressed' event are
+    skipped with a substring check and timestamps are parsed from their fixed-width fields.
+    Timestamps are whole seconds unless fractional, which adds the milliseconds.
+    """
+    with open(log_file, 'rb', buffering=1 << 20) as file:
+        for line in file:
+            event = _flag_event(line, fractional)
+            if event is not None:
+                yield event
+
+
+def flag_event_range(log_file, first_flag=None, fractional=False, block_size=1 << 16):
+    """
+    Timestamps (seconds) of the first keypress (of first_flag if given) and of the
+    last keypress of a log, (None, None) without any.
+    The last one is searched from the end of the file, block by block.
+    """
+    first = next((event for event in iter_flag_events(log_file, fractional)
+                  if first_flag is None or event[1] == first_flag), None)
+    if first is None:
+        return None, None
+    with open(log_file, 'rb') as file:
+        end = file.seek(0, os.SEEK_END)
+        tail = b''
+        while end > 0:
+            start = max(0, end - block_size)
+            file.seek(start)
+            tail = file.read(end - start) + tail
+            lines = tail.split(b'\n')
+            # The first line may be cut unless the block starts the file
+            complete, tail = (lines, b'') if start == 0 else (lines[1:], lines[0])
+            for line in reversed(complete):
+                event = _flag_event(line, fractional)
+                if event is not None:
+                    return first[0], event[0]
+            end = start
+    return first[0], first[0]
+
+
+def parse_flag_intervals(log_file, fractional=False):
+    """
+    Streaming parser of a keypress log, every flag closes the interval opened by
+    the previous one unless the pair is in SKIPPED_PAIRS.
+    Times are whole seconds from the first F1; with fractional they keep the
+    milliseconds of the log, matching the window of alignment.align that starts
+    at that press to the millisecond.
+    Returns (intervals as a structured array of INTERVAL_DTYPE, f1_base_time, total_duration_seconds).
+    """
+    starts = []
+    ends = []
+    start_flags = []
+    end_flags = []
     current_flag = None
     start_time = None
-    f1_base_time = None
-    last_event_time = None
-
-    flag_mapping = {
-        "Key.f1": "F1",
-        "Key.f3": "F3",
-        "Key.f4": "F4",
-        "Key.f6": "F6",
-        "Key.f7": "F7",
-        "Key.f8": "F8"
-    }
-
-    time_pattern = re.compile(r'(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2})')
-    flag_pattern = re.compile(r'CRITICAL - Pressed (\w+\.\w+)')
-
-    def time_to_seconds(time_str):
-        time_format = "%Y-%m-%d %H:%M:%S"
-        dt = datetime.strptime(time_str, time_format)
-        if f1_base_time is None:
-            return 0
-        delta = dt - f1_base_time
-        return delta.total_seconds()
-
-    for line in lines:
-        time_match = time_pattern.search(line)
-        flag_match = flag_pattern.search(line)
-
-        if time_match and flag_match:
-            timestamp = time_match.group(1)
-            flag_key = flag_match.group(1)
-
-            if flag_key in flag_mapping:
-                dt_timestamp = datetime.strptime(timestamp, "%Y-%m-%d %H:%M:%S")
-
-                if flag_mapping[flag_key] == "F1" and f1_base_time is None:
-                    f1_base_time = dt_timestamp
-
-                if current_flag is None:
-                    current_flag = flag_mapping[flag_key]
-                    start_time = timestamp
-                else:
-                    end_flag = flag_mapping[flag_key]
-                    if not ((current_flag == "F3" and end_flag == "F4") or 
-                            (current_flag == "F7" and end_flag == "F8")):
-                        flag_intervals.append((time_to_seconds(start_time), time_to_seconds(timestamp), current_flag, end_flag))
-                    current_flag = flag_mapping[flag_key]
-                    start_time = timestamp
-
-                last_event_time = dt_timestamp
+    f1_base = None
+    last_event = None
+
+    for timestamp, flag in iter_flag_events(log_file, fractional):
+        if flag == "F1" and f1_base is None:
+            f1_base = timestamp
 
+        if current_flag is not None and (current_flag, flag) not in SKIPPED_PAIRS:
+            # Times before the first F1 are reported as 0 like before
+            # Rounded to the millisecond of the log, float sums leave digits below it
+            starts.append(round(start_time - f1_base, 3) if f1_base is not None else 0)
+            ends.append(round(timestamp - f1_base, 3) if f1_base is not None else 0)
+            start_flags.append(current_flag)
+            end_flags.append(flag)
+        current_flag = flag
+        start_time = timestamp
+        last_event = timestamp
+
+    intervals = np.empty(len(starts), dtype=INTERVAL_DTYPE)
+    intervals['start'] = starts
+    intervals['end'] = ends
+    intervals['start_flag'] = start_flags
+    intervals['end_flag'] = end_flags
+
+    f1_base_time = None
     total_duration_seconds = None
-    if f1_base_time and last_event_time:
-        total_duration_seconds = int((last_event_time - f1_base_time).total_seconds())
+    if f1_base is not None:
+        f1_base_time = datetime(1970, 1, 1) + timedelta(seconds=f1_base)
+        total_duration_seconds = int(last_event - f1_base)
+
+    return intervals, f1_base_time, total_duration_seconds
+
 
-    return flag_intervals, f1_base_time, total_duration_seconds
+def extract_flag_intervals(log_file, fractional=False):
+    intervals, f1_base_time, total_duration_seconds = parse_flag_intervals(log_file, fractional)
+    return intervals.tolist(), f1_base_time, total_duration_seconds
 
 
 # Function to convert time string to seconds since start of the day
@@ -97,6 +196,38 @@ def search_files(folder_path):
     
     return log_file, bdf_file
 
+def find_sessions(root_path):
+    # Every folder holding both a .log and a .bdf file is one session
+    sessions = []
+    for root, dirs, files in os.walk(root_path):
+        dirs.sort()
+        if any(file.endswith('.log') for file in files) and any(file.endswith('.bdf') for file in files):
+            sessions.append(root)
+    return sessions
+
+# Only these 16 channels are used, renamed to match the biosemi16 layout
+CHANNELS = ['A1', 'A2', 'A3', 'A4', 'A5', 'A6', 'A7', 'A8',
+            'A9', 'A10', 'A11', 'A12', 'A13', 'A14', 'A15', 'A16']
+
+CHANNELS_DICT = {
+    'A1': 'Fp1',
+    'A2': 'Fp2',
+    'A3': 'F4',
+    'A4': 'Fz',
+    'A5': 'F3',
+    'A6': 'T7',
+    'A7': 'C3',
+    'A8': 'Cz',
+    'A9': 'C4',
+    'A10': 'T8',
+    'A11': 'P4',
+    'A12': 'Pz',
+    'A13': 'P3',
+    'A14': 'O1',
+    'A15': 'Oz',
+    'A16': 'O2'
+}
+
 def wavelet_denoising(data, wavelet='sym4', adaptive_threshold=True, level=5, threshold=None):
     # Perform wavelet decomposition
     coeffs = pywt.wavedec(data, wavelet, level=level)
@@ -110,4 +241,88 @@ def wavelet_denoising(data, wavelet='sym4', adaptive_threshold=True, level=5, th
     # Reconstruct the signal
     reconstructed_data = pywt.waverec(coeffs, wavelet)
     
-    return reconstructed_data
\ No newline at end of file
+    return reconstructed_data
+
+
+def wavelet_denoising_batch(data, wavelet='sym4', adaptive_threshold=True, level=5, threshold=None,
+                            n_jobs=1, chunk_size=None):
+    """
+    Denoises a (channels x samples) matrix in one call, same result as applying
+    wavelet_denoising to every channel (each channel gets its own MAD threshold).
+    With n_jobs > 1 or chunk_size set, the samples are split into overlapping
+    chunks which are denoised in a process pool.
+    """
+    data = np.asarray(data)
+    if data.ndim == 1:
+        return wavelet_denoising_batch(data[np.newaxis], wavelet, adaptive_threshold, level, threshold,
+                                       n_jobs, chunk_size)[0]
+
+    if n_jobs == 1 and chunk_size is None:
+        return _denoise_block((data, wavelet, level, adaptive_threshold, threshold))
+
+    # Chunks need the thresholds of the whole signal, the finest detail level of wavedec is the first dwt level
+    if adaptive_threshold:
+        detail = pywt.dwt(data, wavelet, axis=-1)[1]
+        threshold = np.median(np.abs(detail), axis=-1, keepdims=True) / 0.6745
+
+    if chunk_size is None:
+        chunk_size = int(np.ceil(data.shape[1] / n_jobs))
+    # Chunk borders must fall on a multiple of 2**level to keep the decimation phase,
+    # the padding covers the support of the filters at the coarsest level
+    step = 2 ** level
+    chunk_size = max(step, int(np.ceil(chunk_size / step)) * step)
+    pad = pywt.Wavelet(wavelet).dec_len * 2 * step
+
+    tasks = []
+    borders = []
+    n_samples = data.shape[1]
+    for start in range(0, n_samples, chunk_size):
+        stop = min(start + chunk_size, n_samples)
+        left = max(0, start - pad)
+        right = min(n_samples, stop + pad)
+        tasks.append((data[:, left:right], wavelet, level, False, threshold))
+        borders.append((start - left, stop - start, stop == n_samples))
+
+    if n_jobs == 1:
+        results = map(_denoise_block, tasks)
+    else:
+        with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+            results = list(executor.map(_denoise_block, tasks))
+
+    parts = []
+    for block, (offset, length, is_last) in zip(results, borders):
+        # waverec may return one extra sample at the end of the signal, keep it like the full transform does
+        parts.append(block[:, offset:] if is_last else block[:, offset:offset + length])
+    return np.concatenate(parts, axis=1)
+
+
+def _denoise_block(args):
+    data, wavelet, level, adaptive_threshold, threshold = args
+    coeffs = pywt.wavedec(data, wavelet, level=level, axis=-1)
+    return denoise_coefficients(coeffs, wavelet, adaptive_threshold, threshold)
+
+
+def denoise_coefficients(coeffs, wavelet, adaptive_threshold=True, threshold=None):
+    """
+    Soft-thresholds the detail coefficients of a wavedec(..., axis=-1) in place
+    and reconstructs the signal, the second half of wavelet_denoising_batch.
+    """
+    if adaptive_threshold:
+        threshold = mad_threshold(coeffs)
+    if threshold is not None:
+        for i in coeffs[1:]:
+            _soft_threshold(i, threshold)
+    return pywt.waverec(coeffs, wavelet, axis=-1)
+
+
+def mad_threshold(coeffs):
+    # Per-channel threshold from the median absolute deviation of the finest details
+    return np.median(np.abs(coeffs[-1]), axis=-1, keepdims=True) / 0.6745
+
+
+def _soft_threshold(coeffs, threshold):
+    # Same as pywt.threshold(mode='soft') but in place, without its temporaries
+    magnitude = np.abs(coeffs)
+    magnitude -= threshold
+    np.maximum(magnitude, 0, out=magnitude)
+    np.copysign(magnitude, coeffs, out=coeffs)
@@ -1,15 +1,22 @@
 import sys
 import os
-import numpy as np
-import mne
-from mne.preprocessing import ICA
-import utils
+import time
+import importlib
+from collections import deque
 from PyQt5.QtWidgets import (
     QApplication, QWidget, QVBoxLayout, QHBoxLayout, QPushButton, QLabel,
-    QFileDialog, QInputDialog, QMessageBox, QTextEdit, QLineEdit
+    QFileDialog, QInputDialog, QMessageBox, QTextEdit, QLineEdit, QProgressBar, QCheckBox,
+    QDialog, QListWidget, QListWidgetItem, QSpinBox, QTableWidget, QTableWidgetItem
 )
-from PyQt5.QtCore import Qt
-import edfio
+from PyQt5.QtCore import Qt, QObject, QTimer, pyqtSignal
+import workers
+import profiling
+
+# The scientific modules (mne, scipy, pywt, matplotlib) take seconds to import, the
+# window is shown first and they are imported where used, warmed up in the background
+WARMUP_MODULES = ['numpy', 'mne', 'utils', 'pipeline', 'spectra', 'overview', 'working_store',
+                  'pipeline_cache', 'rendering', 'features', 'session_index', 'alignment', 'history', 'sweep',
+                  'group_stats', 'interval_index', 'signal_export']
 
 class EEGProcessingApp(QWidget):
     def __init__(self):
@@ -18,7 +25,23 @@ class EEGProcessingApp(QWidget):
         self.raw = None
         self.flag_intervals = None
         self.directory_path = None
-        self.cut_raw = None  # Variable to store the cut portion of the signal
+        self.cut_range = None  # Sample range [start, stop) of the working signal to save
+        self.bdf_file_path = None
+        self.steps = []  # Applied processing steps with their parameters
+        self.pyramid = None  # Min/max overview of the working signal, rebuilt after every step
+        self.profiler = profiling.Profiler()  # Timings of the jobs of the current session
+        self.profile_dumps = False
+        self.store = None  # Optional on-disk snapshot of the working signal, to resume the session
+        self.use_store = False
+        self.use_cache = False
+        self.cache = None  # Disk cache of intermediate results, created when enabled
+        self.spectra = None  # Interval spectra of the current signal, built on first use
+        self.history = None  # Undo/redo tree of the processing steps, snapshots of the working signal
+        self.history_budget_mb = 1024  # Snapshot memory before spilling to disk
+
+        # Background job queue, every processing step runs off the GUI thread
+        self.jobs = workers.JobQueue(self)
+        self.jobs.queue_changed.connect(self.update_queue_status)
 
         self.initUI()
 
@@ -40,6 +63,11 @@ class EEGProcessingApp(QWidget):
         self.load_button.clicked.connect(self.load_data)
         button_layout.addWidget(self.load_button)
 
+        # Session index of a data share, Load Data then looks sessions up instead of walking folders
+        self.index_button = QPushButton('Index Data Share', self)
+        self.index_button.clicked.connect(self.index_sessions)
+        button_layout.addWidget(self.index_button)
+
         # FIR Filter Button
         self.fir_button = QPushButton('Apply FIR Filter', self)
         self.fir_button.setDisabled(True)
@@ -52,12 +80,24 @@ class EEGProcessingApp(QWidget):
         self.notch_button.clicked.connect(self.apply_notch_filter)
         button_layout.addWidget(self.notch_button)
 
+        # Filter Chain Button (bandpass and notch in one pass)
+        self.chain_button = QPushButton('Apply Filter Chain', self)
+        self.chain_button.setDisabled(True)
+        self.chain_button.clicked.connect(self.apply_filter_chain)
+        button_layout.addWidget(self.chain_button)
+
         # Wavelet Denoising Button
         self.wavelet_button = QPushButton('Apply Wavelet Denoising', self)
         self.wavelet_button.setDisabled(True)
         self.wavelet_button.clicked.connect(self.apply_wavelet_denoising)
         button_layout.addWidget(self.wavelet_button)
 
+        # Wavelet/bandpass parameter sweep, every configuration is scored in one run
+        self.sweep_button = QPushButton('Sweep Wavelet Settings', self)
+        self.sweep_button.setDisabled(True)
+        self.sweep_button.clicked.connect(self.sweep_wavelet_settings)
+        button_layout.addWidget(self.sweep_button)
+
         # ICA Button
         self.ica_button = QPushButton('Apply ICA', self)
         self.ica_button.setDisabled(True)
@@ -70,6 +110,11 @@ class EEGProcessingApp(QWidget):
         self.topomap_button.clicked.connect(self.generate_topomap)
         button_layout.addWidget(self.topomap_button)
 
+        # Grand averages per flag condition over the feature tables of many sessions
+        self.group_button = QPushButton('Group Statistics', self)
+        self.group_button.clicked.connect(self.group_statistics)
+        button_layout.addWidget(self.group_button)
+
         # Cut Signal Button
         self.cut_button = QPushButton('Cut Signal', self)
         self.cut_button.setDisabled(True)
@@ -82,6 +127,12 @@ class EEGProcessingApp(QWidget):
         self.save_button.clicked.connect(self.save_signal)
         button_layout.addWidget(self.save_button)
 
+        # Every flag interval as a separate EDF/BDF/FIF file
+        self.export_button = QPushButton('Export Intervals', self)
+        self.export_button.setDisabled(True)
+        self.export_button.clicked.connect(self.export_intervals)
+        button_layout.addWidget(self.export_button)
+
         # Remove Noise Button
         self.remove_noise_button = QPushButton('Remove Noise', self)
         self.remove_noise_button.setDisabled(True)
@@ -94,6 +145,63 @@ class EEGProcessingApp(QWidget):
         self.plot_button.clicked.connect(self.plot_data)
         button_layout.addWidget(self.plot_button)
 
+        # Undo/Redo of the processing steps, restored from snapshots instead of reprocessing
+        history_layout = QHBoxLayout()
+        self.undo_button = QPushButton('Undo', self)
+        self.undo_button.setDisabled(True)
+        self.undo_button.clicked.connect(self.undo_step)
+        history_layout.addWidget(self.undo_button)
+        self.redo_button = QPushButton('Redo', self)
+        self.redo_button.setDisabled(True)
+        self.redo_button.clicked.connect(self.redo_step)
+        history_layout.addWidget(self.redo_button)
+        button_layout.addLayout(history_layout)
+
+        # Step history tree, to go back to another branch and set the snapshot budget
+        self.history_button = QPushButton('Step History', self)
+        self.history_button.setDisabled(True)
+        self.history_button.clicked.connect(self.show_history)
+        button_layout.addWidget(self.history_button)
+
+        # Working store toggle, snapshots the signal after every step to resume the session later
+        self.store_checkbox = QCheckBox('Keep working store to resume sessions', self)
+        self.store_checkbox.toggled.connect(self.toggle_store)
+        button_layout.addWidget(self.store_checkbox)
+
+        # Result cache toggle and management
+        self.cache_checkbox = QCheckBox('Use result cache', self)
+        self.cache_checkbox.toggled.connect(self.toggle_cache)
+        button_layout.addWidget(self.cache_checkbox)
+
+        self.cache_button = QPushButton('Manage Cache', self)
+        self.cache_button.clicked.connect(self.manage_cache)
+        button_layout.addWidget(self.cache_button)
+
+        # cProfile and sampled stack dumps of every step, for deep dives
+        self.dump_checkbox = QCheckBox('Write profile dumps', self)
+        self.dump_checkbox.toggled.connect(self.toggle_profile_dumps)
+        button_layout.addWidget(self.dump_checkbox)
+
+        # Live Mode Button (stream source instead of a finished recording)
+        self.live_button = QPushButton('Start Live Mode', self)
+        self.live_button.clicked.connect(self.start_live_mode)
+        button_layout.addWidget(self.live_button)
+        self.live_dialog = None
+
+        # Job status and progress
+        self.status_label = QLabel('Idle', self)
+        button_layout.addWidget(self.status_label)
+        self.progress_bar = QProgressBar(self)
+        self.progress_bar.setRange(0, 100)
+        self.progress_bar.setValue(0)
+        button_layout.addWidget(self.progress_bar)
+
+        # Cancel Button
+        self.cancel_button = QPushButton('Cancel Running Steps', self)
+        self.cancel_button.setDisabled(True)
+        self.cancel_button.clicked.connect(self.cancel_jobs)
+        button_layout.addWidget(self.cancel_button)
+
         # Exit Button
         self.exit_button = QPushButton('Exit', self)
         self.exit_button.clicked.connect(self.close)
@@ -113,7 +221,22 @@ class EEGProcessingApp(QWidget):
         self.log_text = QTextEdit(self)
         self.log_text.setReadOnly(True)
         self.log_text.setStyleSheet("background-color: #F0F0F0;")
-        log_layout.addWidget(self.log_text)
+        log_layout.addWidget(self.log_text, 1)
+
+        # Embedded signal overview, browsing does not block the processing.
+        # The viewer (matplotlib) is created with the first loaded signal
+        overview_label = QLabel('Signal Overview', self)
+        overview_label.setAlignment(Qt.AlignCenter)
+        overview_label.setStyleSheet("font-size: 16px; font-weight: bold;")
+        log_layout.addWidget(overview_label)
+        self.overview = None
+        self.overview_area = QWidget(self)
+        overview_layout = QVBoxLayout(self.overview_area)
+        overview_layout.setContentsMargins(0, 0, 0, 0)
+        self.overview_placeholder = QLabel('Load data to browse the signal.', self.overview_area)
+        self.overview_placeholder.setAlignment(Qt.AlignCenter)
+        overview_layout.addWidget(self.overview_placeholder)
+        log_layout.addWidget(self.overview_area, 2)
 
         # Combine layouts
         main_layout.addLayout(button_layout, 1)
@@ -121,8 +244,30 @@ class EEGProcessingApp(QWidget):
 
         self.setLayout(main_layout)
         self.setWindowTitle('EEG Signal Processing')
-        self.setGeometry(300, 300, 800, 400)
+        self.setGeometry(300, 300, 1200, 800)
         self.show()
+        # After the first paint of the window
+        QTimer.singleShot(200, self.warm_up)
+
+    def warm_up(self):
+        """
+        Imports the scientific modules on the worker thread, steps queued meanwhile wait for it.
+        """
+        def job_fn(job):
+            for i, name in enumerate(WARMUP_MODULES):
+                importlib.import_module(name)
+                job.report_progress(int(100 * (i + 1) / len(WARMUP_MODULES)))
+
+        self.run_job("Load Modules", job_fn, lambda result: None,
+                     "An error occurred while loading the processing modules", "Error loading modules")
+
+    def show_overview(self, pyramid):
+        if self.overview is None:
+            from overview import OverviewViewer
+            self.overview = OverviewViewer(self.overview_area)
+            self.overview_placeholder.hide()
+            self.overview_area.layout().addWidget(self.overview)
+        self.overview.set_pyramid(pyramid)
 
     def log_action(self, message):
         """
@@ -132,6 +277,223 @@ class EEGProcessingApp(QWidget):
         timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
         self.log_text.append(f"[{timestamp}] {message}")
 
+    def toggle_store(self, checked):
+        self.use_store = checked
+        if checked and self.raw is not None:
+            # Steps applied while the store was off are missing from it
+            def job_fn(job):
+                self.store.write(self.raw, self.bdf_file_path, self.steps)
+
+            def on_done(result):
+                self.log_action(f"Working store '{self.store.path}' updated with steps: {self.steps}.")
+
+            self.run_job("Write Working Store", job_fn, on_done,
+                         "An error occurred while writing the working store", "Error writing working store")
+
+    def record_step(self, raw, steps, result=None):
+        """
+        Snapshots raw, the signal after the last of steps, in the history and
+        returns the new signal state (see signal_state).
+        Called from the worker thread right after the step was applied to raw.
+        """
+        if self.history is not None:
+            self.history.push(raw, steps[-1], result)
+        return self.signal_state(raw, steps)
+
+    def signal_state(self, raw, steps):
+        """
+        Builds the overview of a new working signal and, if enabled, writes it to
+        the store. Returns the attributes to set once the job is done, the
+        worker thread leaves the ones the GUI reads untouched.
+        """
+        from overview import MinMaxPyramid
+        if self.use_store and self.store is not None:
+            self.store.write(raw, self.bdf_file_path, steps)
+        # Derived data of the previous signal is dropped,
+        # a cut refers to the signal it was made on, it has to be made again
+        return dict(raw=raw, steps=steps, pyramid=MinMaxPyramid(raw), spectra=None, cut_range=None)
+
+    def apply_state(self, state):
+        # Runs on the GUI thread, before the next job is started
+        if self.history is not None and state.get('history', self.history) is not self.history:
+            # Spilled snapshots of the replaced history are removed
+            self.history.close()
+        for name, value in state.items():
+            setattr(self, name, value)
+
+    def toggle_profile_dumps(self, checked):
+        self.profile_dumps = checked
+        self.profiler.dump_dir = self.profile_dir() if checked else None
+
+    def profile_dir(self):
+        return os.path.join(self.directory_path, 'profile') if self.directory_path else None
+
+    def export_profile(self, profiler):
+        """
+        Writes the session timings to <session>/profile/profile.json and .csv.
+        """
+        if self.directory_path is None:
+            return
+        try:
+            profiler.export(self.profile_dir())
+        except OSError as e:
+            self.log_action(f"Error writing profile: {e}")
+
+    def toggle_cache(self, checked):
+        if checked and self.cache is None:
+            from pipeline_cache import PipelineCache
+            self.cache = PipelineCache()
+        self.use_cache = checked
+
+    def run_step(self, job, name, params, compute):
+        """
+        Runs compute(raw) on a copy of the working signal for a step that changes
+        it, unless the history or the cache already holds the result of the
+        current steps followed by this one. The new signal is set as job.state.
+        Returns the value returned by compute(raw).
+        """
+        steps = self.steps + [dict(step=name, **params)]
+        job.profile['data_in'] = self.raw._data.nbytes
+        # The same step was applied from here before and undone, its snapshot is still there
+        node = self.history.child(steps[-1]) if self.history is not None else None
+        if node is not None and node.kept:
+            self.history.checkout(node.id)
+            raw = self.history.restore()
+            job.state = self.signal_state(raw, [dict(step) for step in node.steps])
+            job.from_history = True
+            job.profile['data_out'] = raw._data.nbytes
+            return node.result
+
+        if self.use_cache:
+            hit = self.cache.get(steps)
+            if hit is not None:
+                job.check_cancelled()
+                raw, result = hit
+                job.from_cache = True
+                job.state = self.record_step(raw, steps, result)
+                job.profile['data_out'] = raw._data.nbytes
+                return result
+
+        # The GUI keeps showing the current signal until the step is done, Cancel drops the copy
+        raw = self.raw.copy()
+        result = compute(raw)
+        job.check_cancelled()
+        job.state = self.record_step(raw, steps, result)
+        job.profile['data_out'] = raw._data.nbytes
+        if self.use_cache:
+            self.cache.put(steps, raw, result)
+        return result
+
+    def manage_cache(self):
+        if self.cache is None:
+            from pipeline_cache import PipelineCache
+            self.cache = PipelineCache()
+        CacheDialog(self.cache, self).exec_()
+
+    def run_job(self, name, fn, on_done, error_message, error_log, on_partial=None):
+        """
+        Queues a processing step on the background worker thread.
+        on_done runs on the GUI thread with the value returned by fn.
+        The job is profiled, its timings are logged and exported when it ends.
+        """
+        # pocketfft must be initialised on the GUI thread, imported first from a worker
+        # later FFTs run from other threads crash (double free)
+        importlib.import_module('scipy.fft')
+        profiler = self.profiler
+
+        def profiled(job):
+            with profiler.measure(name) as record:
+                job.profile = record
+                return fn(job)
+
+        job = workers.Job(name, profiled)
+        job.from_cache = False
+        job.from_history = False
+        # Attributes the job sets on the window, applied on the GUI thread when it is done
+        job.state = None
+        job.signals.started.connect(self.job_started)
+        job.signals.progress.connect(self.job_progress)
+        job.signals.cancelled.connect(self.job_cancelled)
+
+        def on_error(message, details):
+            QMessageBox.critical(self, "Error", f"{error_message}:\n{message}")
+            # The traceback goes to the action log, the dialog only shows the message
+            self.log_action(f"{error_log}: {message}\n{details.rstrip()}")
+            self.export_profile(profiler)
+
+        def on_finished(result):
+            if job.state is not None:
+                self.apply_state(job.state)
+            on_done(result)
+            if self.pyramid is not None and (self.overview is None or self.pyramid is not self.overview.pyramid):
+                self.show_overview(self.pyramid)
+            if job.from_cache:
+                self.log_action(f"'{name}' result loaded from cache.")
+            if job.from_history:
+                self.log_action(f"'{name}' result restored from the step history.")
+            self.update_history_buttons()
+            self.save_button.setEnabled(self.cut_range is not None)
+            self.log_action(profiling.describe(job.profile))
+            for line in profiling.describe_intervals(profiler.records[job.profile['index'] + 1:]):
+                self.log_action(line)
+            self.export_profile(profiler)
+
+        self.jobs.submit(job, on_done=on_finished, on_error=on_error, on_partial=on_partial)
+        if self.jobs.pending() > 1:
+            self.log_action(f"Queued '{name}' ({self.jobs.pending() - 1} step(s) ahead).")
+        return job
+
+    def job_started(self, name):
+        self.status_label.setText(f"Running: {name}")
+        self.progress_bar.setValue(0)
+
+    def job_progress(self, name, percent):
+        self.progress_bar.setValue(percent)
+
+    def job_cancelled(self, name):
+        self.log_action(f"Cancelled '{name}'.")
+
+    def update_queue_status(self, pending):
+        self.cancel_button.setEnabled(pending > 0)
+        if pending == 0:
+            self.status_label.setText('Idle')
+            self.progress_bar.setValue(0)
+        elif pending > 1:
+            self.status_label.setText(f"{self.status_label.text().split(' (')[0]} ({pending - 1} queued)")
+
+    def cancel_jobs(self):
+        self.jobs.cancel_all()
+        self.log_action("Cancellation requested, running step stops at its next checkpoint.")
+
+    def start_live_mode(self):
+        if self.live_dialog is not None and self.live_dialog.isVisible():
+            self.live_dialog.raise_()
+            return
+        import live
+        default = f"{live.DEFAULT_ADDRESS[0]}:{live.DEFAULT_ADDRESS[1]}"
+        address, ok = QInputDialog.getText(self, "Live Mode", "Stream source (host:port):", text=default)
+        if not ok or not address:
+            return
+        try:
+            host, port = address.rsplit(':', 1)
+            port = int(port)
+        except ValueError:
+            QMessageBox.critical(self, "Error", f"Invalid stream source '{address}', expected host:port.")
+            return
+        self.live_dialog = LiveDialog((host, port), self)
+        self.live_dialog.show()
+        self.log_action(f"Live mode started on {host}:{port} (causal filter chain 0.1-45 Hz with notches, wavelet sym4).")
+
+    def closeEvent(self, event):
+        if self.live_dialog is not None:
+            self.live_dialog.close()
+        self.jobs.cancel_all()
+        self.jobs.wait()
+        # Spilled snapshots are removed with the history
+        if self.history is not None:
+            self.history.close()
+        super().closeEvent(event)
+
     def remove_noise(self):
         if self.raw is None:
             QMessageBox.warning(self, "Warning", "Please load data first!")
@@ -139,131 +501,199 @@ class EEGProcessingApp(QWidget):
 
         threshold, ok1 = QInputDialog.getDouble(self, "Remove Noise", "Enter amplitude threshold (µV):", 100.0, 0.1, 1000.0, 1)
         min_duration, ok2 = QInputDialog.getDouble(self, "Remove Noise", "Enter minimum duration of noise (seconds):", 1.0, 0.1, 10.0, 1)
-        if ok1 and ok2:
-            try:
-                # Convert threshold to volts as the raw data is in volts
-                threshold *= 1e-6
+        rms_threshold, ok3 = QInputDialog.getDouble(self, "Remove Noise", "Enter sliding RMS threshold (µV, 0 disables):", 0.0, 0.0, 1000.0, 1)
+        rms_window = 0.5
+        if ok3 and rms_threshold > 0:
+            rms_window, ok3 = QInputDialog.getDouble(self, "Remove Noise", "Enter sliding RMS window (seconds):", 0.5, 0.01, 10.0, 2)
+        if ok1 and ok2 and ok3:
+            params = dict(threshold=threshold, min_duration=min_duration)
+            if rms_threshold > 0:
+                params.update(rms_threshold=rms_threshold, rms_window=rms_window)
 
-                # Calculate amplitude and detect noisy segments
-                amplitude = np.abs(self.raw._data)
-                noisy_segments = np.any(amplitude > threshold, axis=0)
+            def job_fn(job):
+                import pipeline
 
-                # Find continuous noisy segments
-                sfreq = self.raw.info['sfreq']
-                min_samples = int(min_duration * sfreq)
-                noisy_segments = np.convolve(noisy_segments, np.ones(min_samples, dtype=int), 'same') >= min_samples
+                def compute(raw):
+                    return pipeline.remove_noise(raw, progress=job.report_progress, **params)
 
-                # Find the start and end of noisy segments
-                onsets = np.where(np.diff(noisy_segments.astype(int)) == 1)[0] / sfreq
-                offsets = np.where(np.diff(noisy_segments.astype(int)) == -1)[0] / sfreq
-                durations = offsets - onsets
+                return self.run_step(job, 'remove_noise', params, compute)
 
-                if len(onsets) == 0 or len(offsets) == 0:
+            def on_done(found):
+                if not found:
                     QMessageBox.information(self, "Info", "No noisy segments found with the given threshold and duration.")
                     self.log_action("No noisy segments detected.")
                     return
+                QMessageBox.information(self, "Success", f"Noise removed with threshold {threshold} µV and minimum duration {min_duration} seconds.")
+                rms_text = f", RMS threshold={rms_threshold} µV over {rms_window} s" if rms_threshold > 0 else ""
+                self.log_action(f"Removed noisy segments with threshold={threshold} µV and min_duration={min_duration} seconds{rms_text}.")
 
-                # Mark these segments as bad
-                annotations = mne.Annotations(onset=onsets, duration=durations, description=['bad_noise'] * len(onsets))
-                self.raw.set_annotations(annotations)
+            self.run_job("Remove Noise", job_fn, on_done,
+                         "An error occurred while removing noise", "Error removing noise")
 
-                # Remove these segments by retaining only good parts of the data
-                self.raw = self.raw.copy().interpolate_bads(reset_bads=True)
-                cleaned_raw = self.raw.copy().crop(tmin=0, tmax=None)
 
-                QMessageBox.information(self, "Success", f"Noise removed with threshold {threshold*1e6} µV and minimum duration {min_duration} seconds.")
-                self.log_action(f"Removed noisy segments with threshold={threshold*1e6} µV and min_duration={min_duration} seconds.")
-            except Exception as e:
-                QMessageBox.critical(self, "Error", f"An error occurred while removing noise:\n{e}")
-                self.log_action(f"Error removing noise: {e}")
+    def index_sessions(self):
+        root = QFileDialog.getExistingDirectory(self, "Select Data Share Root")
+        if not root:
+            return
+
+        def job_fn(job):
+            from session_index import SessionIndex
+            # The connection belongs to the worker thread
+            index = SessionIndex()
+            try:
+                return index.update(root, progress=lambda done, total: job.report_progress(int(100 * done / total)))
+            finally:
+                index.close()
+
+        def on_done(stats):
+            self.log_action(f"Indexed '{root}': {stats['sessions']} session(s), {stats['files']} file(s), "
+                            f"{stats['read']} read, {stats['removed']} removed in {stats['seconds']:.1f} s.")
 
+        self.run_job("Index Sessions", job_fn, on_done,
+                     "An error occurred while indexing the sessions", "Error indexing sessions")
+
+    def find_sessions(self, folder_path):
+        """
+        Sessions (dicts with 'log_file' and 'bdf_file') inside folder_path from the
+        session index, which rescans the folder when it changed since it was indexed.
+        Runs on the worker thread; the message tells when the index was unavailable.
+        """
+        import sqlite3
+        from session_index import SessionIndex
+        try:
+            index = SessionIndex()
+            try:
+                return index.lookup(folder_path), None
+            finally:
+                index.close()
+        except sqlite3.Error as e:
+            import utils
+            log_file, bdf_file_path = utils.search_files(folder_path)
+            sessions = [dict(log_file=log_file, bdf_file=bdf_file_path)] if log_file and bdf_file_path else []
+            return sessions, f"Session index unavailable ({e}), searched the folder."
+
+    def choose_session(self, folder_path, sessions):
+        """
+        Returns the (log, bdf) pair of one of the sessions, asking which one when
+        there are several, or None.
+        """
+        if not sessions:
+            QMessageBox.critical(self, "Error", "Could not find the required .log or .bdf file in the selected directory.")
+            return None
+        session = sessions[0]
+        if len(sessions) > 1:
+            # Logs are paired with the recording their keypresses fall in
+            names = [f"{os.path.relpath(session['log_file'], folder_path)} + "
+                     f"{os.path.relpath(session['bdf_file'], folder_path)}" for session in sessions]
+            choice, ok = QInputDialog.getItem(self, "Load Data", "Several sessions found, choose one:", names, 0, False)
+            if not ok:
+                return None
+            session = sessions[names.index(choice)]
+        return session['log_file'], session['bdf_file']
 
     def load_data(self):
         folder_path = QFileDialog.getExistingDirectory(self, "Select EEG Data Directory")
         if not folder_path:
             QMessageBox.critical(self, "Error", "Please select a valid directory!")
             return
-        
-        log_file, bdf_file_path = utils.search_files(folder_path)
-        
-        if not log_file or not bdf_file_path:
-            QMessageBox.critical(self, "Error", "Could not find the required .log or .bdf file in the selected directory.")
-            return
-        
-        try:
-            self.flag_intervals, f1_base_time, total_duration_seconds = utils.extract_flag_intervals(log_file)
-            self.raw = mne.io.read_raw_bdf(bdf_file_path, preload=True)
-            self.raw.load_data()
+
+        # The folder may be rescanned, that is done on the worker thread
+        def job_fn(job):
+            return self.find_sessions(folder_path)
+
+        def on_done(result):
+            sessions, message = result
+            if message is not None:
+                self.log_action(message)
+            session = self.choose_session(folder_path, sessions)
+            if session is not None:
+                self.open_session(*session)
+
+        self.run_job("Find Session", job_fn, on_done,
+                     "An error occurred while searching the session", "Error searching session")
+
+    def open_session(self, log_file, bdf_file_path):
+        import utils
+        from working_store import WorkingStore
+
+        store = WorkingStore(os.path.dirname(bdf_file_path))
+        # Each session gets its own timings, written next to its data
+        self.profiler = profiling.Profiler(
+            os.path.join(os.path.dirname(bdf_file_path), 'profile') if self.profile_dumps else None)
+        restore = False
+        if self.use_store and store.has_snapshot(bdf_file_path):
+            restore = QMessageBox.question(
+                self, "Load Data", "A working store with processed data exists for this session. Restore it?",
+                QMessageBox.Yes | QMessageBox.No) == QMessageBox.Yes
+
+        def job_fn(job):
+            from overview import MinMaxPyramid
+            import alignment
+            flag_intervals, _, _ = utils.extract_flag_intervals(log_file, fractional=True)
+            # Only the log keypresses and the bdf header are read to find the window
+            window = alignment.align(log_file, bdf_file_path)
+            job.report_progress(5)
+            steps = [dict(step='load', bdf_file=bdf_file_path, log_file=log_file, alignment=alignment.VERSION)]
+            hit = self.cache.get(steps) if self.use_cache and not restore else None
+            if restore:
+                raw, steps = store.open()
+            elif hit is not None:
+                raw = hit[0]
+                job.from_cache = True
+            else:
+                # Only the 16 used channels inside the log window are read
+                raw = alignment.open_window(bdf_file_path, window)
+                if self.use_cache:
+                    self.cache.put(steps, raw)
+            if self.use_store and not restore:
+                store.write(raw, bdf_file_path, steps)
+            # Undo goes back to the loaded (or restored) signal at most
+            from history import StepHistory
+            history = StepHistory(self.history_budget_mb * 1024 ** 2)
+            history.reset(raw, steps)
+            job.report_progress(80)
 
             # Create needed directories
-            self.directory_path = os.path.dirname(bdf_file_path)
-            os.makedirs(os.path.join(self.directory_path, 'Images'), exist_ok=True)
+            directory_path = os.path.dirname(bdf_file_path)
+            os.makedirs(os.path.join(directory_path, 'Images'), exist_ok=True)
+
+            # Intervals as sample ranges of the working signal, no step changes its length
+            from interval_index import IntervalIndex
+            flag_intervals = IntervalIndex.from_raw(flag_intervals, raw)
 
             # Describe data
-            self.raw.describe()
-
-            #Pick only 16 channels
-            channels = ['A1', 'A2', 'A3', 'A4', 'A5', 'A6', 'A7', 'A8',
-                        'A9', 'A10', 'A11', 'A12', 'A13', 'A14', 'A15', 'A16']
-            self.raw.pick_channels(channels)
-
-            # Channel names dict to match predefined layout
-            channels_dict = {
-                'A1': 'Fp1',
-                'A2': 'Fp2',
-                'A3': 'F4',
-                'A4': 'Fz',
-                'A5': 'F3',
-                'A6': 'T7',
-                'A7': 'C3',
-                'A8': 'Cz',
-                'A9': 'C4',
-                'A10': 'T8',
-                'A11': 'P4',
-                'A12': 'Pz',
-                'A13': 'P3',
-                'A14': 'O1',
-                'A15': 'Oz',
-                'A16': 'O2'
-            }
-
-            # Rename channels
-            self.raw.rename_channels(mapping=channels_dict)
-            self.raw.set_montage('biosemi16')
-
-            # Crop the data based on the calculated intervals
-            log1_start_seconds = utils.time_to_seconds(f1_base_time.strftime('%H:%M:%S'))
-            bdf_start_seconds = utils.time_to_seconds(self.raw.info['meas_date'].time().strftime("%H:%M:%S"))
-            bdf_duration = self.raw.times[-1]  # in seconds
-
-            #Compute crop boundaries based on start and end times
-            if bdf_start_seconds <= log1_start_seconds:
-                cut_from_start = log1_start_seconds - bdf_start_seconds
-                cut_from_end = bdf_duration - total_duration_seconds - cut_from_start
-            else:
-                cut_from_start = 0
-                cut_from_end = bdf_duration - total_duration_seconds
+            raw.describe()
+            pyramid = MinMaxPyramid(raw)
+            job.check_cancelled()
 
-            # Apply crop
-            self.raw.crop(tmin=cut_from_start, tmax=(bdf_duration - cut_from_end))
+            job.state = dict(raw=raw, flag_intervals=flag_intervals, directory_path=directory_path,
+                             bdf_file_path=bdf_file_path, store=store, steps=steps, spectra=None,
+                             pyramid=pyramid, cut_range=None, history=history)
 
+        def on_done(result):
             QMessageBox.information(self, "Success", "Data loaded and cropped successfully!")
             self.log_text.clear()
-            self.log_action("Loaded and preprocessed data successfully.")
+            if restore:
+                self.log_action(f"Restored working signal from '{store.path}' with steps: {self.steps}.")
+            else:
+                self.log_action("Loaded and preprocessed data successfully.")
 
             # Enable all processing buttons
             self.fir_button.setEnabled(True)
             self.notch_button.setEnabled(True)
+            self.chain_button.setEnabled(True)
             self.wavelet_button.setEnabled(True)
+            self.sweep_button.setEnabled(True)
             self.ica_button.setEnabled(True)
             self.topomap_button.setEnabled(True)
             self.plot_button.setEnabled(True)
             self.cut_button.setEnabled(True)
+            self.export_button.setEnabled(True)
             self.remove_noise_button.setEnabled(True)
+            self.history_button.setEnabled(True)
 
-        except Exception as e:
-            QMessageBox.critical(self, "Error", f"An error occurred while loading data:\n{e}")
-            self.log_action(f"Error loading data: {e}")
+        self.run_job("Load Data", job_fn, on_done,
+                     "An error occurred while loading data", "Error loading data")
 
     def apply_fir_filter(self):
         if self.raw is None:
@@ -273,13 +703,20 @@ class EEGProcessingApp(QWidget):
         l_freq, ok1 = QInputDialog.getDouble(self, "FIR Filter", "Enter low frequency (Hz):", 0.1, 0, 1000, 1)
         h_freq, ok2 = QInputDialog.getDouble(self, "FIR Filter", "Enter high frequency (Hz):", 45, 0, 1000, 1)
         if ok1 and ok2:
-            try:
-                self.raw.filter(l_freq, h_freq, fir_design='firwin')
+            def job_fn(job):
+                import pipeline
+
+                def compute(raw):
+                    pipeline.fir_filter(raw, l_freq, h_freq)
+
+                self.run_step(job, 'fir_filter', dict(l_freq=l_freq, h_freq=h_freq), compute)
+
+            def on_done(result):
                 QMessageBox.information(self, "Success", f"FIR filter applied: {l_freq}-{h_freq} Hz")
                 self.log_action(f"Applied FIR filter with low_freq={l_freq} Hz and high_freq={h_freq} Hz.")
-            except Exception as e:
-                QMessageBox.critical(self, "Error", f"An error occurred while applying FIR filter:\n{e}")
-                self.log_action(f"Error applying FIR filter: {e}")
+
+            self.run_job("FIR Filter", job_fn, on_done,
+                         "An error occurred while applying FIR filter", "Error applying FIR filter")
 
     def apply_notch_filter(self):
         if self.raw is None:
@@ -290,12 +727,56 @@ class EEGProcessingApp(QWidget):
         if ok and freqs_str:
             try:
                 freqs_list = [float(freq.strip()) for freq in freqs_str.split(',')]
-                self.raw.notch_filter(freqs=freqs_list, fir_design='firwin')
-                QMessageBox.information(self, "Success", f"Notch filter applied at frequencies: {freqs_list} Hz")
-                self.log_action(f"Applied Notch filter at frequencies: {freqs_list} Hz.")
-            except Exception as e:
+            except ValueError as e:
                 QMessageBox.critical(self, "Error", f"An error occurred while applying Notch filter:\n{e}")
                 self.log_action(f"Error applying Notch filter: {e}")
+                return
+
+            def job_fn(job):
+                import pipeline
+
+                def compute(raw):
+                    pipeline.notch_filter(raw, freqs_list)
+
+                self.run_step(job, 'notch_filter', dict(freqs=freqs_list), compute)
+
+            def on_done(result):
+                QMessageBox.information(self, "Success", f"Notch filter applied at frequencies: {freqs_list} Hz")
+                self.log_action(f"Applied Notch filter at frequencies: {freqs_list} Hz.")
+
+            self.run_job("Notch Filter", job_fn, on_done,
+                         "An error occurred while applying Notch filter", "Error applying Notch filter")
+
+    def apply_filter_chain(self):
+        if self.raw is None:
+            QMessageBox.warning(self, "Warning", "Please load data first!")
+            return
+
+        l_freq, ok1 = QInputDialog.getDouble(self, "Filter Chain", "Enter low frequency (Hz):", 0.1, 0, 1000, 1)
+        h_freq, ok2 = QInputDialog.getDouble(self, "Filter Chain", "Enter high frequency (Hz):", 45, 0, 1000, 1)
+        freqs_str, ok3 = QInputDialog.getText(self, "Filter Chain", "Enter notch frequencies (Hz, comma separated):", text="50, 60, 100, 120")
+        if ok1 and ok2 and ok3:
+            try:
+                freqs_list = [float(freq.strip()) for freq in freqs_str.split(',') if freq.strip()]
+            except ValueError as e:
+                QMessageBox.critical(self, "Error", f"An error occurred while applying the filter chain:\n{e}")
+                self.log_action(f"Error applying filter chain: {e}")
+                return
+
+            def job_fn(job):
+                import pipeline
+
+                def compute(raw):
+                    pipeline.filter_chain(raw, l_freq, h_freq, freqs_list, progress=job.report_progress)
+
+                self.run_step(job, 'filter_chain', dict(l_freq=l_freq, h_freq=h_freq, notch_freqs=freqs_list), compute)
+
+            def on_done(result):
+                QMessageBox.information(self, "Success", f"Filter chain applied: {l_freq}-{h_freq} Hz, notches at {freqs_list} Hz")
+                self.log_action(f"Applied filter chain with low_freq={l_freq} Hz, high_freq={h_freq} Hz and notches at {freqs_list} Hz in one pass.")
+
+            self.run_job("Filter Chain", job_fn, on_done,
+                         "An error occurred while applying the filter chain", "Error applying filter chain")
 
     def apply_wavelet_denoising(self):
         if self.raw is None:
@@ -323,23 +804,98 @@ class EEGProcessingApp(QWidget):
         else:
             threshold = None
 
-        try:
-            denoised_data = np.apply_along_axis(
-                utils.wavelet_denoising, 1, self.raw.get_data(),
-                wavelet=wavelet, adaptive_threshold=adaptive_threshold, level=level, threshold=threshold
-            )
-            self.raw = mne.io.RawArray(denoised_data, self.raw.info)
+        def job_fn(job):
+            import pipeline
+
+            def compute(raw):
+                pipeline.wavelet_denoising(raw, wavelet, adaptive_threshold, level, threshold,
+                                           n_jobs=os.cpu_count(), progress=job.report_progress)
+
+            params = dict(wavelet=wavelet, adaptive_threshold=adaptive_threshold, level=level, threshold=threshold)
+            self.run_step(job, 'wavelet_denoising', params, compute)
+
+        def on_done(result):
             if adaptive_threshold:
                 QMessageBox.information(self, "Success", f"Wavelet denoising applied using {wavelet} wavelet with level {level} and adaptive thresholding.")
                 self.log_action(f"Applied Wavelet Denoising with wavelet='{wavelet}', level={level}, and adaptive thresholding.")
             else:
                 QMessageBox.information(self, "Success", f"Wavelet denoising applied using {wavelet} wavelet with level {level} and manual threshold of {threshold}.")
                 self.log_action(f"Applied Wavelet Denoising with wavelet='{wavelet}', level={level}, and manual threshold={threshold}.")
-        except Exception as e:
-            QMessageBox.critical(self, "Error", f"An error occurred while applying Wavelet Denoising:\n{e}")
-            self.log_action(f"Error applying Wavelet Denoising: {e}")
 
+        self.run_job("Wavelet Denoising", job_fn, on_done,
+                     "An error occurred while applying Wavelet Denoising", "Error applying Wavelet Denoising")
+
+
+
+    def sweep_wavelet_settings(self):
+        if self.raw is None:
+            QMessageBox.warning(self, "Warning", "Please load data first!")
+            return
+
+        wavelets_str, ok1 = QInputDialog.getText(self, "Wavelet Sweep", "Wavelets (comma separated):", text="sym4, db4, coif3")
+        levels_str, ok2 = QInputDialog.getText(self, "Wavelet Sweep", "Decomposition levels (comma separated):", text="1, 3, 5")
+        thresholds_str, ok3 = QInputDialog.getText(self, "Wavelet Sweep", "Thresholds ('adaptive' or values, comma separated):", text="adaptive")
+        bandpass_str, ok4 = QInputDialog.getText(self, "Wavelet Sweep", "Bandpass edges ('none' or low-high Hz, comma separated):", text="none, 0.1-45, 1-40")
+        if not (ok1 and ok2 and ok3 and ok4):
+            return
+        import sweep
+        try:
+            wavelets = [wavelet.strip() for wavelet in wavelets_str.split(',') if wavelet.strip()]
+            levels = [int(level) for level in levels_str.split(',') if level.strip()]
+            thresholds = [sweep.parse_threshold(value) for value in thresholds_str.split(',') if value.strip()]
+            bandpasses = [sweep.parse_bandpass(value) for value in bandpass_str.split(',') if value.strip()]
+        except ValueError as e:
+            QMessageBox.critical(self, "Error", f"An error occurred while reading the sweep settings:\n{e}")
+            self.log_action(f"Error reading sweep settings: {e}")
+            return
+        n_configs = len(wavelets) * len(levels) * len(thresholds) * len(bandpasses)
+
+        def job_fn(job):
+            rows = sweep.run_sweep(self.raw, wavelets, levels, thresholds, bandpasses, n_jobs=os.cpu_count(),
+                                   progress=lambda done, total: job.report_progress(int(100 * done / total)))
+            job.profile['data_in'] = self.raw._data.nbytes
+            return rows, sweep.write_sweep(os.path.join(self.directory_path, sweep.SWEEP_NAME), rows)
+
+        def on_done(result):
+            rows, path = result
+            self.log_action(f"Swept {n_configs} wavelet configuration(s), results written to '{path}'.")
+            SweepDialog(rows, self, self).exec_()
+
+        self.run_job("Wavelet Sweep", job_fn, on_done,
+                     "An error occurred during the wavelet sweep", "Error during wavelet sweep")
 
+    def queue_step(self, title, name, params, message, **options):
+        """
+        Queues a pipeline step with the given parameters, options are passed to
+        the step without being part of its recorded parameters.
+        """
+        def job_fn(job):
+            import pipeline
+
+            def compute(raw):
+                return pipeline.STEPS[name](raw, progress=job.report_progress, **params, **options)
+
+            return self.run_step(job, name, params, compute)
+
+        def on_done(result):
+            self.log_action(message)
+
+        self.run_job(title, job_fn, on_done,
+                     f"An error occurred while applying {title}", f"Error applying {title}")
+
+    def apply_sweep_config(self, row):
+        # The bandpass and wavelet denoising of a sweep configuration, as regular (undoable) steps
+        if row['l_freq'] is not None:
+            self.queue_step("Filter Chain", 'filter_chain',
+                            dict(l_freq=row['l_freq'], h_freq=row['h_freq'], notch_freqs=[]),
+                            f"Applied filter chain with low_freq={row['l_freq']} Hz and high_freq={row['h_freq']} Hz from the sweep.")
+        adaptive_threshold = row['threshold'] == 'adaptive'
+        threshold = None if adaptive_threshold else row['threshold']
+        self.queue_step("Wavelet Denoising", 'wavelet_denoising',
+                        dict(wavelet=row['wavelet'], adaptive_threshold=adaptive_threshold, level=row['level'],
+                             threshold=threshold),
+                        f"Applied Wavelet Denoising with wavelet='{row['wavelet']}', level={row['level']} and "
+                        f"threshold={row['threshold']} from the sweep.", n_jobs=os.cpu_count())
 
     def apply_ica(self):
         if self.raw is None:
@@ -348,51 +904,107 @@ class EEGProcessingApp(QWidget):
 
         n_components, ok = QInputDialog.getInt(self, "ICA", "Enter number of components:", 15, 1, 100, 1)
         if ok:
-            try:
-                ica = ICA(n_components=n_components, random_state=97, max_iter=800)
-                ica.fit(self.raw)
-                eog_indices, _ = ica.find_bads_eog(self.raw, ch_name=['Fp1', 'Fp2'])
-                ica.exclude = eog_indices
-                self.raw = ica.apply(self.raw.copy())
+            params = dict(n_components=n_components)
+            # A model of a previous session of the same subject makes the fit converge in a few iterations
+            warm_start = QMessageBox.question(self, "ICA", "Warm-start from a previous session's ICA model?",
+                                              QMessageBox.Yes | QMessageBox.No, QMessageBox.No) == QMessageBox.Yes
+            if warm_start:
+                warm_start_file, _ = QFileDialog.getOpenFileName(self, "Select ICA Model", self.directory_path or "",
+                                                                 "ICA models (*-ica.fif)")
+                if warm_start_file:
+                    params['warm_start_file'] = warm_start_file
+
+            def job_fn(job):
+                import pipeline
+
+                def compute(raw):
+                    return pipeline.ica(raw, progress=job.report_progress, **params)
+
+                return self.run_step(job, 'ica', params, compute)
+
+            def on_done(eog_indices):
                 QMessageBox.information(self, "Success", f"ICA applied with {n_components} components.")
-                self.log_action(f"Applied ICA with n_components={n_components}. Excluded components: {eog_indices}.")
-            except Exception as e:
-                QMessageBox.critical(self, "Error", f"An error occurred while applying ICA:\n{e}")
-                self.log_action(f"Error applying ICA: {e}")
+                warm_start_text = f" warm-started from '{params['warm_start_file']}'" if 'warm_start_file' in params else ""
+                self.log_action(f"Applied ICA with n_components={n_components}{warm_start_text}. Excluded components: {eog_indices}.")
+
+            self.run_job("ICA", job_fn, on_done,
+                         "An error occurred while applying ICA", "Error applying ICA")
 
     def generate_topomap(self):
         if self.raw is None or self.flag_intervals is None:
             QMessageBox.warning(self, "Warning", "Please load data first!")
             return
 
-        try:
-            for interval in self.flag_intervals:
-                tmin = interval[0]
-                tmax = interval[1]
-                label = interval[2]
-                raw_copy = self.raw.copy().crop(tmin=tmin, tmax=tmax).compute_psd()
-                fig = raw_copy.plot_topomap(
-                    bands={
-                        'Delta (0.1-3.9 Hz)': (0.1, 3.9), 
-                        'Theta (4-7.9 Hz)': (4, 7.9),
-                        'Alpha (8-12.9 Hz)': (8, 12.9), 
-                        'Beta (13-29.9 Hz)': (13, 29.9),
-                        'Low Gamma (30-59.9 Hz)': (30, 59.9), 
-                        'High Gamma (60-100 Hz)': (60, 100)
-                    },
-                    ch_type='eeg',
-                    cmap='jet',
-                    show=False
-                )
-                fig.set_size_inches(25, 10)
-                filename = f'part_{tmin}_{tmax}_{label}.png'
-                save_path = os.path.join(self.directory_path, 'Images', filename)
-                fig.savefig(save_path, dpi=300)
-                self.log_action(f"Generated Topomap for interval {tmin}-{tmax} seconds labeled '{label}'. Saved as '{filename}'.")
+        import rendering
+        preset, ok = QInputDialog.getItem(self, "Generate Topomap Plots", "Output preset:",
+                                          list(rendering.PRESETS), 1, False)
+        if not ok:
+            return
+
+        def job_fn(job):
+            from spectra import IntervalSpectra
+            import features
+            # One pass over the signal, reused until the next step changes it
+            spectra = self.spectra if self.spectra is not None else IntervalSpectra(self.raw)
+            job.state = dict(spectra=spectra)
+            job.report_progress(0)
+            # Figures are rendered in worker processes with the Agg backend
+            rendered, skipped = rendering.render_figures(spectra, self.flag_intervals, self.directory_path,
+                                                         preset=preset, progress=job.report_progress,
+                                                         profiler=self.profiler)
+            # Band powers for the group statistics, from the same spectra
+            features_path = features.write_features(os.path.join(self.directory_path, features.FEATURES_NAME),
+                                                    features.compute_features(spectra, self.flag_intervals),
+                                                    session=os.path.basename(self.directory_path))
+            return rendered, skipped, features_path
+
+        def on_done(result):
+            rendered, skipped, features_path = result
+            for filename in rendered:
+                self.log_action(f"Generated Topomap '{filename}'.")
+            if skipped:
+                self.log_action(f"Skipped {len(skipped)} unchanged Topomap(s).")
+            self.log_action(f"Band-power features written to '{features_path}'.")
             QMessageBox.information(self, "Success", "Topomap plots generated successfully!")
-        except Exception as e:
-            QMessageBox.critical(self, "Error", f"An error occurred while generating Topomap plots:\n{e}")
-            self.log_action(f"Error generating Topomap plots: {e}")
+
+        self.run_job("Generate Topomaps", job_fn, on_done,
+                     "An error occurred while generating Topomap plots", "Error generating Topomap plots")
+
+    def group_statistics(self):
+        root = QFileDialog.getExistingDirectory(self, "Select Study Root")
+        if not root:
+            return
+        level, ok1 = QInputDialog.getItem(self, "Group Statistics", "Observation unit:",
+                                          ['session', 'interval'], 0, False)
+        kind, ok2 = QInputDialog.getItem(self, "Group Statistics", "Band power shown in the topomaps:",
+                                         ['rel', 'abs'], 0, False)
+        if not (ok1 and ok2):
+            return
+
+        def job_fn(job):
+            import group_stats
+            import features
+            paths = features.find_feature_files(root)
+            if not paths:
+                raise FileNotFoundError(f"No feature tables found below '{root}', generate the topomaps of the sessions first.")
+            # Sessions are streamed one at a time into the running statistics
+            stats = group_stats.aggregate(paths, level=level,
+                                          progress=lambda done, total: job.report_progress(int(80 * done / total)))
+            job.check_cancelled()
+            csv_path = group_stats.write_group_stats(os.path.join(root, group_stats.GROUP_DIR, 'group_stats.csv'), stats)
+            figures = group_stats.render_group_topomaps(
+                stats, root, kind=kind, progress=lambda done, total: job.report_progress(80 + int(20 * done / total)))
+            return len(paths), stats.labels(), csv_path, figures
+
+        def on_done(result):
+            n_sessions, labels, csv_path, figures = result
+            self.log_action(f"Group statistics of {n_sessions} session(s) for conditions {labels} written to '{csv_path}'.")
+            for name in figures:
+                self.log_action(f"Generated group Topomap '{name}'.")
+            QMessageBox.information(self, "Success", f"Group statistics of {n_sessions} session(s) generated successfully!")
+
+        self.run_job("Group Statistics", job_fn, on_done,
+                     "An error occurred while computing the group statistics", "Error computing group statistics")
 
     def cut_signal(self):
         if self.raw is None:
@@ -403,19 +1015,26 @@ class EEGProcessingApp(QWidget):
         tmax, ok2 = QInputDialog.getDouble(self, "Cut Signal", "Enter end time (seconds):", self.raw.times[-1], 0.0, self.raw.times[-1])
 
         if ok1 and ok2 and tmin < tmax:
-            try:
-                self.cut_raw = self.raw.copy().crop(tmin=tmin, tmax=tmax)
-                QMessageBox.information(self, "Success", f"Signal cut from {tmin} to {tmax} seconds.")
-                self.log_action(f"Cut signal from {tmin} to {tmax} seconds.")
-                self.save_button.setEnabled(True)  # Enable the save button after a cut is made
-            except Exception as e:
-                QMessageBox.critical(self, "Error", f"An error occurred while cutting the signal:\n{e}")
-                self.log_action(f"Error cutting signal: {e}")
+            # Only the range is kept, the samples are read from the working signal when saving
+            start, stop = self.raw.time_as_index([tmin, tmax], use_rounding=True)
+            self.cut_range = (int(start), int(stop) + 1)
+            QMessageBox.information(self, "Success", f"Signal cut from {tmin} to {tmax} seconds.")
+            self.log_action(f"Cut signal from {tmin} to {tmax} seconds.")
+            self.save_button.setEnabled(True)  # Enable the save button after a cut is made
         else:
             QMessageBox.warning(self, "Warning", "Invalid cut range specified!")
 
+    def log_export(self, results, checksums_path, seconds):
+        # Throughput over the wall time of the job, the files of an interval export are written in parallel
+        total_bytes = sum(result['bytes'] for result in results)
+        for result in results:
+            self.log_action(f"Exported '{result['path']}' ({result['n_samples']} samples, "
+                            f"{result['bytes'] / 1024 ** 2:.1f} MB), sha256 {result['sha256']}.")
+        self.log_action(f"Exported {len(results)} file(s), {total_bytes / 1024 ** 2:.1f} MB at "
+                        f"{total_bytes / 1024 ** 2 / max(seconds, 1e-9):.1f} MB/s; checksums in '{checksums_path}'.")
+
     def save_signal(self):
-        if self.cut_raw is None:
+        if self.cut_range is None:
             QMessageBox.warning(self, "Warning", "Please cut the signal first!")
             return
 
@@ -425,26 +1044,449 @@ class EEGProcessingApp(QWidget):
             return
 
         save_name, ok = QInputDialog.getText(self, "Save Signal", "Enter the filename (without extension):")
-        if ok and save_name:
-            try:
-                save_path = os.path.join(save_folder, f"{save_name}.edf")
-                mne.export.export_raw(save_path, self.cut_raw, fmt='auto')
+        fmt, ok2 = QInputDialog.getItem(self, "Save Signal", "Format:", ['edf', 'bdf', 'fif'], 0, False)
+        if ok and ok2 and save_name:
+            save_path = os.path.join(save_folder, f"{save_name}.{fmt}")
+            cut_range = self.cut_range
+
+            def job_fn(job):
+                import signal_export
+                # A step queued before the save may have changed the signal since the cut
+                if self.cut_range is not cut_range:
+                    raise RuntimeError("The signal changed since it was cut, cut it again before saving.")
+                start, stop = cut_range
+                result = signal_export.export_range(
+                    save_path, self.raw, start, stop,
+                    progress=lambda done, total: job.report_progress(int(100 * done / total)))
+                return result, signal_export.write_checksums(save_folder, [result])
+
+            def on_done(result):
+                self.log_export([result[0]], result[1], result[0]['seconds'])
                 QMessageBox.information(self, "Success", f"Signal saved as '{save_path}'.")
-                self.log_action(f"Saved signal as '{save_path}'.")
-            except Exception as e:
-                QMessageBox.critical(self, "Error", f"An error occurred while saving the signal:\n{e}")
-                self.log_action(f"Error saving signal: {e}")
+
+            self.run_job("Save Signal", job_fn, on_done,
+                         "An error occurred while saving the signal", "Error saving signal")
+
+    def export_intervals(self):
+        if self.raw is None:
+            QMessageBox.warning(self, "Warning", "Please load data first!")
+            return
+
+        export_folder = QFileDialog.getExistingDirectory(self, "Select Export Directory")
+        if not export_folder:
+            return
+        fmt, ok1 = QInputDialog.getItem(self, "Export Intervals", "Format:", ['edf', 'bdf', 'fif'], 0, False)
+        labels, ok2 = QInputDialog.getText(self, "Export Intervals",
+                                           f"Flags to export, comma separated (empty for all of {self.flag_intervals.labels()}):")
+        if not (ok1 and ok2):
+            return
+        labels = [label.strip() for label in labels.split(',') if label.strip()] or None
+
+        def job_fn(job):
+            import signal_export
+            started = time.perf_counter()
+            results, checksums_path = signal_export.export_intervals(
+                export_folder, self.raw, self.flag_intervals, fmt, labels,
+                progress=lambda done, total: job.report_progress(int(100 * done / total)))
+            return results, checksums_path, time.perf_counter() - started
+
+        def on_done(result):
+            results, checksums_path, seconds = result
+            if not results:
+                QMessageBox.warning(self, "Warning", "No intervals to export!")
+                return
+            self.log_export(results, checksums_path, seconds)
+            QMessageBox.information(self, "Success", f"Exported {len(results)} interval(s) to '{export_folder}'.")
+
+        self.run_job("Export Intervals", job_fn, on_done,
+                     "An error occurred while exporting the intervals", "Error exporting intervals")
+
+    def update_history_buttons(self):
+        self.undo_button.setEnabled(self.history is not None and self.history.can_undo())
+        self.redo_button.setEnabled(self.history is not None and self.history.can_redo())
+
+    def move_in_history(self, name, move):
+        """
+        Queues a move in the step history, move(history) returns the new current
+        node or None when there is nowhere to go. The working signal is restored
+        from the snapshot of that node.
+        """
+        def job_fn(job):
+            if self.history is None:
+                return None
+            node = move(self.history)
+            if node is None:
+                return None
+            job.profile['data_in'] = self.raw._data.nbytes
+            raw = self.history.restore(node)
+            job.state = self.signal_state(raw, [dict(step) for step in node.steps])
+            job.profile['data_out'] = raw._data.nbytes
+            return node
+
+        def on_done(node):
+            if node is None:
+                self.log_action(f"{name}: nothing to do.")
+                return
+            self.log_action(f"{name}: working signal is now {' -> '.join(step['step'] for step in node.steps)}.")
+
+        self.run_job(name, job_fn, on_done,
+                     f"An error occurred during {name.lower()}", f"Error during {name.lower()}")
+
+    def undo_step(self):
+        self.move_in_history("Undo", lambda history: history.undo() if history.can_undo() else None)
+
+    def redo_step(self):
+        self.move_in_history("Redo", lambda history: history.redo() if history.can_redo() else None)
+
+    def show_history(self):
+        if self.history is None:
+            QMessageBox.warning(self, "Warning", "Please load data first!")
+            return
+        HistoryDialog(self, self).exec_()
+
+    def set_history_budget(self, budget_mb):
+        self.history_budget_mb = budget_mb
+
+        # Snapshots may be spilled, done on the worker thread like every change of the history
+        def job_fn(job):
+            if self.history is not None:
+                self.history.set_budget(budget_mb * 1024 ** 2)
+                return self.history.usage()
+
+        def on_done(usage):
+            if usage is not None:
+                self.log_action(f"Step history budget set to {budget_mb} MB: {usage['memory_bytes'] / 1e6:.0f} MB "
+                                f"in memory, {usage['disk_bytes'] / 1e6:.0f} MB on disk.")
+
+        self.run_job("History Budget", job_fn, on_done,
+                     "An error occurred while changing the history budget", "Error changing history budget")
 
     def plot_data(self):
         if self.raw is None:
             QMessageBox.warning(self, "Warning", "Please load data first!")
             return
+
+        # Queued like any other step so the plot shows the result of pending steps
+        def job_fn(job):
+            return self.raw
+
+        def on_done(raw):
+            try:
+                # Non-blocking, the embedded overview is the fast way to browse long recordings
+                raw.plot(block=False)
+                self.log_action("Plotted current EEG data.")
+            except Exception as e:
+                QMessageBox.critical(self, "Error", f"An error occurred while plotting data:\n{e}")
+                self.log_action(f"Error plotting data: {e}")
+
+        self.run_job("Plot Data", job_fn, on_done,
+                     "An error occurred while plotting data", "Error plotting data")
+
+class CacheDialog(QDialog):
+    """
+    Lists the entries of the result cache and lets the user remove them.
+    """
+    def __init__(self, cache, parent=None):
+        super().__init__(parent)
+        self.cache = cache
+
+        layout = QVBoxLayout()
+        self.info_label = QLabel(self)
+        layout.addWidget(self.info_label)
+
+        self.entry_list = QListWidget(self)
+        self.entry_list.setSelectionMode(QListWidget.ExtendedSelection)
+        layout.addWidget(self.entry_list)
+
+        buttons = QHBoxLayout()
+        remove_button = QPushButton('Remove Selected', self)
+        remove_button.clicked.connect(self.remove_selected)
+        buttons.addWidget(remove_button)
+        clear_button = QPushButton('Clear All', self)
+        clear_button.clicked.connect(self.clear_all)
+        buttons.addWidget(clear_button)
+        close_button = QPushButton('Close', self)
+        close_button.clicked.connect(self.accept)
+        buttons.addWidget(close_button)
+        layout.addLayout(buttons)
+
+        self.setLayout(layout)
+        self.setWindowTitle('Result Cache')
+        self.resize(700, 400)
+        self.refresh()
+
+    def refresh(self):
+        from datetime import datetime
+        self.entry_list.clear()
+        entries = self.cache.entries()
+        for entry in entries:
+            steps = ' -> '.join(step['step'] for step in entry['steps'])
+            last_used = datetime.fromtimestamp(entry['last_used']).strftime('%Y-%m-%d %H:%M:%S')
+            item = QListWidgetItem(f"{steps}  |  {entry['size'] / 1e6:.1f} MB  |  last used {last_used}")
+            item.setData(Qt.UserRole, entry['key'])
+            item.setToolTip(str(entry['steps']))
+            self.entry_list.addItem(item)
+        total = sum(entry['size'] for entry in entries)
+        self.info_label.setText(f"{len(entries)} entries, {total / 1e6:.1f} MB of {self.cache.max_bytes / 1e6:.0f} MB "
+                                f"in '{self.cache.cache_dir}'")
+
+    def remove_selected(self):
+        for item in self.entry_list.selectedItems():
+            self.cache.remove(item.data(Qt.UserRole))
+        self.refresh()
+
+    def clear_all(self):
+        self.cache.clear()
+        self.refresh()
+
+class SweepDialog(QDialog):
+    """
+    Table of the wavelet sweep results, sortable by any metric; the selected
+    configuration can be applied to the working signal.
+    """
+    def __init__(self, rows, app, parent=None):
+        super().__init__(parent)
+        self.rows = rows
+        self.app = app
+
+        layout = QVBoxLayout()
+        layout.addWidget(QLabel("SNR: denoised against removed power. removed_*: share of the power of each band "
+                                "taken out by the denoising.", self))
+        columns = [column for column in rows[0] if column not in ('threshold_value',)]
+        self.table = QTableWidget(len(rows), len(columns), self)
+        self.table.setHorizontalHeaderLabels(columns)
+        self.table.setSelectionBehavior(QTableWidget.SelectRows)
+        self.table.setSelectionMode(QTableWidget.SingleSelection)
+        self.table.setEditTriggers(QTableWidget.NoEditTriggers)
+        for i, row in enumerate(rows):
+            for j, column in enumerate(columns):
+                value = row[column]
+                item = QTableWidgetItem()
+                # Numbers are sorted as numbers
+                item.setData(Qt.DisplayRole, round(value, 4) if isinstance(value, float) else
+                             ('' if value is None else value))
+                item.setData(Qt.UserRole, i)
+                self.table.setItem(i, j, item)
+        self.table.setSortingEnabled(True)
+        self.table.resizeColumnsToContents()
+        layout.addWidget(self.table)
+
+        buttons = QHBoxLayout()
+        apply_button = QPushButton('Apply Selected', self)
+        apply_button.clicked.connect(self.apply_selected)
+        buttons.addWidget(apply_button)
+        close_button = QPushButton('Close', self)
+        close_button.clicked.connect(self.accept)
+        buttons.addWidget(close_button)
+        layout.addLayout(buttons)
+
+        self.setLayout(layout)
+        self.setWindowTitle('Wavelet Sweep')
+        self.resize(1100, 500)
+
+    def apply_selected(self):
+        items = self.table.selectedItems()
+        if not items:
+            QMessageBox.warning(self, "Warning", "Please select a configuration first!")
+            return
+        self.app.apply_sweep_config(self.rows[items[0].data(Qt.UserRole)])
+        self.accept()
+
+
+class HistoryDialog(QDialog):
+    """
+    Shows the step history tree of the session; any state can be made current,
+    which restores its working signal. The snapshot memory budget is set here.
+    """
+    def __init__(self, app, parent=None):
+        super().__init__(parent)
+        self.app = app
+        history = app.history
+
+        layout = QVBoxLayout()
+        usage = history.usage()
+        layout.addWidget(QLabel(f"{usage['nodes']} states, {usage['memory_bytes'] / 1e6:.1f} MB in memory, "
+                                f"{usage['disk_bytes'] / 1e6:.1f} MB spilled to disk, "
+                                f"{usage['dropped']} recomputed on demand", self))
+
+        self.node_list = QListWidget(self)
+        for depth, node in history.tree():
+            storage = 'memory' if node.data is not None else 'disk' if node.spill_path is not None else 'recompute'
+            marker = '* ' if node is history.current else '  '
+            item = QListWidgetItem(f"{marker}{'    ' * depth}{node.label()}  [{storage}]")
+            item.setData(Qt.UserRole, node.id)
+            self.node_list.addItem(item)
+            if node is history.current:
+                self.node_list.setCurrentItem(item)
+        layout.addWidget(self.node_list)
+
+        budget_layout = QHBoxLayout()
+        budget_layout.addWidget(QLabel('Snapshot memory budget (MB):', self))
+        self.budget_spin = QSpinBox(self)
+        self.budget_spin.setRange(0, 1024 * 1024)
+        self.budget_spin.setValue(app.history_budget_mb)
+        budget_layout.addWidget(self.budget_spin)
+        layout.addLayout(budget_layout)
+
+        buttons = QHBoxLayout()
+        go_button = QPushButton('Go To Selected', self)
+        go_button.clicked.connect(self.go_to_selected)
+        buttons.addWidget(go_button)
+        close_button = QPushButton('Close', self)
+        close_button.clicked.connect(self.accept)
+        buttons.addWidget(close_button)
+        layout.addLayout(buttons)
+
+        self.setLayout(layout)
+        self.setWindowTitle('Step History')
+        self.resize(700, 400)
+
+    def go_to_selected(self):
+        item = self.node_list.currentItem()
+        if item is not None:
+            node_id = item.data(Qt.UserRole)
+            self.app.move_in_history("Go To Step", lambda history: history.checkout(node_id))
+        self.accept()
+
+    def done(self, result):
+        if self.budget_spin.value() != self.app.history_budget_mb:
+            self.app.set_history_budget(self.budget_spin.value())
+        super().done(result)
+
+
+class LiveSignals(QObject):
+    """
+    Carries the live session callbacks from its thread to the GUI thread.
+    """
+    info = pyqtSignal(float, list)
+    block = pyqtSignal(float, int, float)
+    powers = pyqtSignal(str, object, int, bool)
+    flag = pyqtSignal(str, float)
+    error = pyqtSignal(str)
+    ended = pyqtSignal()
+
+
+class LiveDialog(QDialog):
+    """
+    Live mode: processes the blocks of a stream source causally and shows the
+    band-power topomaps of the interval opened by the last keypress flag,
+    with the latency from acquisition to processed result and to display.
+    """
+    def __init__(self, address, parent=None):
+        import live
+        import pipeline
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg
+        super().__init__(parent)
+        self.app = parent
+        self.info = None
+        self.latencies = deque(maxlen=200)
+        self.latest_powers = None
+        self.powers_time = None
+        self.display_latency = None
+        self.stream_seconds = 0.0
+
+        layout = QVBoxLayout()
+        self.status_label = QLabel(f"Connecting to {address[0]}:{address[1]}...", self)
+        layout.addWidget(self.status_label)
+        self.interval_label = QLabel('Waiting for the first flag', self)
+        layout.addWidget(self.interval_label)
+        self.latency_label = QLabel('Latency: -', self)
+        layout.addWidget(self.latency_label)
+
+        self.figure = Figure(figsize=(12, 3), tight_layout=True)
+        self.axes = self.figure.subplots(1, len(pipeline.BANDS))
+        self.canvas = FigureCanvasQTAgg(self.figure)
+        layout.addWidget(self.canvas, 1)
+
+        stop_button = QPushButton('Stop', self)
+        stop_button.clicked.connect(self.close)
+        layout.addWidget(stop_button)
+        self.setLayout(layout)
+        self.setWindowTitle('Live Mode')
+        self.resize(1200, 400)
+
+        self.signals = LiveSignals()
+        self.signals.info.connect(self.on_info)
+        self.signals.block.connect(self.on_block)
+        self.signals.powers.connect(self.on_powers)
+        self.signals.flag.connect(self.on_flag)
+        self.signals.error.connect(self.on_error)
+        self.signals.ended.connect(self.on_end)
+        self.session = live.LiveSession(address, callbacks={
+            'on_info': self.signals.info.emit, 'on_block': self.signals.block.emit,
+            'on_powers': self.signals.powers.emit, 'on_flag': self.signals.flag.emit,
+            'on_error': self.signals.error.emit, 'on_end': self.signals.ended.emit,
+        })
+
+        # Topomaps are redrawn at most twice per second, whatever the block rate
+        self.timer = QTimer(self)
+        self.timer.timeout.connect(self.redraw)
+        self.timer.start(500)
+        self.session.start()
+
+    def on_info(self, sfreq, ch_names):
+        import mne
+        info = mne.create_info(ch_names, sfreq, 'eeg')
         try:
-            self.raw.plot(block=True)
-            self.log_action("Plotted current EEG data.")
-        except Exception as e:
-            QMessageBox.critical(self, "Error", f"An error occurred while plotting data:\n{e}")
-            self.log_action(f"Error plotting data: {e}")
+            info.set_montage('biosemi16')
+            self.info = info
+        except ValueError:
+            self.app.log_action("Live mode: channel names do not match the biosemi16 montage, topomaps disabled.")
+        self.status_label.setText(f"Streaming {len(ch_names)} channels at {sfreq:g} Hz")
+
+    def on_block(self, latency, n_samples, stream_seconds):
+        self.latencies.append(latency)
+        self.stream_seconds = stream_seconds
+
+    def on_powers(self, label, powers, n_segments, closed):
+        # Acquisition time of the newest sample in these powers
+        self.powers_time = time.time() - (self.latencies[-1] if self.latencies else 0.0)
+        self.latest_powers = (label, powers, n_segments, closed)
+        if closed:
+            self.app.log_action(f"Live interval '{label}' closed after {n_segments} segment(s).")
+
+    def on_flag(self, flag, stream_seconds):
+        self.interval_label.setText(f"Interval '{flag}' opened at {stream_seconds:.1f} s")
+
+    def on_error(self, message):
+        QMessageBox.critical(self, "Error", f"Live mode error:\n{message}")
+        self.app.log_action(f"Live mode error: {message}")
+
+    def on_end(self):
+        self.timer.stop()
+        self.redraw()
+        self.status_label.setText(f"Stream ended after {self.stream_seconds:.1f} s")
+        self.app.log_action(f"Live mode stopped after {self.stream_seconds:.1f} s of stream.")
+
+    def redraw(self):
+        import numpy as np
+        import mne
+        import pipeline
+        if self.latencies:
+            latencies = np.array(self.latencies) * 1000
+            display = f", display {self.display_latency * 1000:.0f} ms" if self.display_latency is not None else ""
+            self.latency_label.setText(f"Latency: processing {latencies.mean():.1f} ms mean, "
+                                       f"{latencies.max():.1f} ms max{display} | stream at {self.stream_seconds:.1f} s")
+        if self.latest_powers is None or self.info is None:
+            return
+        label, powers, n_segments, closed = self.latest_powers
+        self.latest_powers = None
+        for ax, band, band_powers in zip(self.axes, pipeline.BANDS, powers):
+            ax.clear()
+            mne.viz.plot_topomap(band_powers, self.info, axes=ax, show=False, cmap='jet')
+            ax.set_title(band, fontsize=8)
+        state = 'closed' if closed else 'running'
+        self.figure.suptitle(f"Interval '{label}' ({state}, {n_segments} segments)", fontsize=10)
+        self.canvas.draw()
+        self.display_latency = time.time() - self.powers_time
+
+    def closeEvent(self, event):
+        self.timer.stop()
+        self.session.stop()
+        self.session.join(timeout=5)
+        super().closeEvent(event)
+
 
 def main():
     app = QApplication(sys.argv)
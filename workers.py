@@ -0,0 +1,121 @@
+import threading
+import traceback
+from PyQt5.QtCore import QObject, QRunnable, QThreadPool, pyqtSignal
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class JobSignals(QObject):
+    # Signals live in the GUI thread, so connected slots always run there
+    started = pyqtSignal(str)
+    progress = pyqtSignal(str, int)
+    partial = pyqtSignal(str, object)
+    finished = pyqtSignal(str, object)
+    error = pyqtSignal(str, str, str)  # name, message, traceback
+    cancelled = pyqtSignal(str)
+
+
+class Job(QRunnable):
+    """
+    A single processing step executed on a background thread.
+    The wrapped function receives the job as first argument so it can
+    report progress and check for cancellation between its stages.
+    """
+    def __init__(self, name, fn, *args, **kwargs):
+        super().__init__()
+        self.name = name
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.signals = JobSignals()
+        self._cancel_event = threading.Event()
+        # The queue keeps its own reference, Qt must not delete the job
+        self.setAutoDelete(False)
+
+    def cancel(self):
+        self._cancel_event.set()
+
+    def is_cancelled(self):
+        return self._cancel_event.is_set()
+
+    def check_cancelled(self):
+        if self._cancel_event.is_set():
+            raise JobCancelled(self.name)
+
+    def report_progress(self, done, total=100):
+        self.check_cancelled()
+        percent = int(100 * done / total) if total else 100
+        self.signals.progress.emit(self.name, percent)
+
+    def emit_partial(self, result):
+        self.check_cancelled()
+        self.signals.partial.emit(self.name, result)
+
+    def run(self):
+        if self.is_cancelled():
+            self.signals.cancelled.emit(self.name)
+            return
+        self.signals.started.emit(self.name)
+        try:
+            result = self.fn(self, *self.args, **self.kwargs)
+        except JobCancelled:
+            self.signals.cancelled.emit(self.name)
+        except Exception as e:
+            self.signals.error.emit(self.name, str(e), traceback.format_exc())
+        else:
+            self.signals.finished.emit(self.name, result)
+
+
+class JobQueue(QObject):
+    """
+    Runs jobs one after another on a single worker thread, so queued steps
+    see the result of the previous step while the GUI stays responsive.
+    A job is started once the slots of the previous one have run on the GUI
+    thread, so the state they apply is there when the next job reads it.
+    """
+    queue_changed = pyqtSignal(int)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.pool = QThreadPool(self)
+        self.pool.setMaxThreadCount(1)
+        self.jobs = []
+
+    def submit(self, job, on_done=None, on_error=None, on_partial=None):
+        if on_done is not None:
+            job.signals.finished.connect(lambda name, result: on_done(result))
+        if on_error is not None:
+            job.signals.error.connect(lambda name, message, details: on_error(message, details))
+        if on_partial is not None:
+            job.signals.partial.connect(lambda name, result: on_partial(result))
+        job.signals.finished.connect(lambda *_: self._job_done(job))
+        job.signals.error.connect(lambda *_: self._job_done(job))
+        job.signals.cancelled.connect(lambda *_: self._job_done(job))
+
+        self.jobs.append(job)
+        if len(self.jobs) == 1:
+            self.pool.start(job)
+        self.queue_changed.emit(len(self.jobs))
+        return job
+
+    def _job_done(self, job):
+        if job in self.jobs:
+            self.jobs.remove(job)
+        # Connected after the slots of the job, they have run already
+        if self.jobs:
+            self.pool.start(self.jobs[0])
+        self.queue_changed.emit(len(self.jobs))
+
+    def pending(self):
+        return len(self.jobs)
+
+    def cancel_all(self):
+        # Queued jobs are skipped, the running one stops at its next checkpoint
+        for job in list(self.jobs):
+            job.cancel()
+
+    def wait(self, msecs=-1):
+        # Only the running job is waited for, the queued ones start from the GUI thread
+        return self.pool.waitForDone(msecs)
@@ -0,0 +1,97 @@
+import os
+import json
+import numpy as np
+import mne
+
+# Samples copied per block when moving data in and out of the memory map
+BLOCK_SAMPLES = 2 ** 20
+
+
+class WorkingStore:
+    """
+    Snapshot of the working signal of a session for resuming it later: a
+    float32 .npy file inside '<session>/.working', written through a memory map,
+    with the info, annotations and applied steps needed to rebuild the Raw
+    object without decoding the bdf file and re-running the steps.
+    It is a persisted copy, not a memory-saving store: steps still run on the
+    float64 signal in memory, every write adds a pass over the full signal and
+    open() rebuilds a full float64 array.
+    """
+    def __init__(self, directory_path):
+        self.path = os.path.join(directory_path, '.working')
+        self.data_file = os.path.join(self.path, 'signal.npy')
+        self.info_file = os.path.join(self.path, 'info.fif')
+        self.annotations_file = os.path.join(self.path, 'annotations.fif')
+        self.meta_file = os.path.join(self.path, 'meta.json')
+
+    @staticmethod
+    def source_id(bdf_file_path):
+        stat = os.stat(bdf_file_path)
+        return {'path': os.path.abspath(bdf_file_path), 'size': stat.st_size, 'mtime': stat.st_mtime}
+
+    def read_meta(self):
+        if not os.path.exists(self.meta_file):
+            return None
+        with open(self.meta_file, 'r') as file:
+            return json.load(file)
+
+    def has_snapshot(self, bdf_file_path):
+        meta = self.read_meta()
+        return (meta is not None and os.path.exists(self.data_file)
+                and meta['source'] == self.source_id(bdf_file_path))
+
+    def write(self, raw, bdf_file_path, steps):
+        os.makedirs(self.path, exist_ok=True)
+        data = raw._data
+        shape = data.shape
+
+        # Same shape is written in place, otherwise a new map replaces the old one
+        meta = self.read_meta()
+        if meta is not None and os.path.exists(self.data_file) and tuple(meta['shape']) == shape:
+            signal = np.load(self.data_file, mmap_mode='r+')
+            target = self.data_file
+        else:
+            target = self.data_file + '.tmp'
+            signal = np.lib.format.open_memmap(target, mode='w+', dtype=np.float32, shape=shape)
+
+        for start in range(0, shape[1], BLOCK_SAMPLES):
+            stop = min(start + BLOCK_SAMPLES, shape[1])
+            signal[:, start:stop] = data[:, start:stop]
+        signal.flush()
+        del signal
+        if target != self.data_file:
+            os.replace(target, self.data_file)
+
+        mne.io.write_info(self.info_file, raw.info)
+        raw.annotations.save(self.annotations_file, overwrite=True)
+        with open(self.meta_file, 'w') as file:
+            json.dump({
+                'source': self.source_id(bdf_file_path),
+                'shape': list(shape),
+                'first_samp': int(raw.first_samp),
+                'steps': list(steps),
+            }, file, indent=2)
+
+    def open(self):
+        """
+        Rebuilds the Raw object from the store. The float32 map is converted
+        block by block into a single float64 array that the Raw object uses directly.
+        """
+        meta = self.read_meta()
+        signal = np.load(self.data_file, mmap_mode='r')
+        data = np.empty(signal.shape, dtype=np.float64)
+        for start in range(0, signal.shape[1], BLOCK_SAMPLES):
+            stop = min(start + BLOCK_SAMPLES, signal.shape[1])
+            data[:, start:stop] = signal[:, start:stop]
+        del signal
+
+        info = mne.io.read_info(self.info_file)
+        raw = mne.io.RawArray(data, info, first_samp=meta['first_samp'])
+        if os.path.exists(self.annotations_file):
+            raw.set_annotations(mne.read_annotations(self.annotations_file))
+        return raw, meta['steps']
+
+    def clear(self):
+        for file in (self.data_file, self.info_file, self.annotations_file, self.meta_file):
+            if os.path.exists(file):
+                os.remove(file)